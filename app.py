@@ -7,129 +7,56 @@ from datetime import datetime, timedelta
 import pandas as pd
 
 # Import custom modules
+from startup import STARTUP, load_measurement_config
 from layout import serve_header_layout, serve_sidebar_layout, CONTENT_STYLE
 from callbacks import register_callbacks
 from hilltop_api import fetch_site_list, fetch_active_site_list,fetch_site_list_collection
-from constants import MEASUREMENTS_FOR_MAPS_AND_DATASETS, DUMMY_RAINFALL_SITES, DUMMY_FLOW_SITES, DF_SITES, BASE
+from recent_poller import start_pollers
+from dataset_store import register_download_routes
+from cache import init_cache, background_manager
+from metrics import register_metrics_route
+from callback_profiler import register_admin_routes
+from tracing import register_tracing
+from constants import MEASUREMENTS_FOR_MAPS_AND_DATASETS, RECENT_POLL_COLLECTIONS, RECENT_POLL_ENABLED
 
 # --- Initialize Data (moved to app.py as it's part of app startup) ---
-try:
-    # stage_site_data = fetch_site_list(measurement="Stage")# [Water Level]")
-    # flow_site_data = fetch_site_list(measurement="Flow")# [Water Level]")
-    # rainfall_site_data = fetch_site_list(measurement="Rainfall")# [Rainfall]")
-    # water_temperature_site_data = fetch_site_list(measurement="Water Temperature")# [Water temperature (Continuous)]")
-    # air_temperature_site_data = fetch_site_list(measurement="Air Temperature (Continuous)")#[Air temperature (Continuous)]")
-    
-    stage_site_data = fetch_site_list_collection("WebRivers") # [Water Level]")
-    flow_site_data = stage_site_data
-    rainfall_site_data = fetch_site_list_collection("WebRainfall")# [Rainfall]")
-    water_temperature_site_data = stage_site_data # [Water temperature (Continuous)]")
-    air_temperature_site_data = fetch_site_list_collection("WebAirTemp") #[Air temperature (Continuous)]")
-
-    # stage_site_data = fetch_active_site_list(BASE, "WebRivers", 60, DF_SITES) # [Water Level]")
-    # flow_site_data = stage_site_data
-    # rainfall_site_data = fetch_active_site_list(BASE, "WebRainfall", 60, DF_SITES)# [Rainfall]")
-    # water_temperature_site_data = stage_site_data # [Water temperature (Continuous)]")
-    # air_temperature_site_data = fetch_active_site_list(BASE, "WebAirTemp", 60, DF_SITES) #[Air temperature (Continuous)]")
-
-
-    MEASUREMENTS_FOR_MAPS_AND_DATASETS.update({
-        # "Rainfall (mm)": {
-        #     "hilltop_measurement_name": "Rainfall",# [Rainfall]",
-        #     "is_incremental": True,
-        #     "sites": rainfall_site_data,
-        #     "interval": "",
-        #     "method": "",
-        #     "measures": "Rainfall,Rainfall SCADA",
-        # },
-        "Hourly Rainfall (mm)": {
-            "hilltop_measurement_name": "Rainfall",# [Rainfall]",
-            "is_incremental": True,
-            "sites": pd.DataFrame(rainfall_site_data) if rainfall_site_data else pd.DataFrame(),  # Convert to DataFrame,
-            "interval": "1 hour",
-            "method": "Total",
-            "measures": "Rainfall,Rainfall SCADA",
-        },
-        "Daily Rainfall (mm)": {
-            "hilltop_measurement_name": "Rainfall",# [Rainfall]",
-            "is_incremental": True,
-            "sites": pd.DataFrame(rainfall_site_data) if rainfall_site_data else pd.DataFrame(),  # Convert to DataFrame,
-            "interval": "1 day",
-            "method": "Total",
-            "measures": "Rainfall,Rainfall SCADA",
-        },
-        "River Stage (m)": {
-            "hilltop_measurement_name": "Stage",# [Water Level]",
-            "is_incremental": False,
-            "sites": pd.DataFrame(stage_site_data) if stage_site_data else pd.DataFrame(),  # Convert to DataFrame,
-            "interval": "",
-            "method": "",
-            "measures": "Stage",
-        },
-        "River Flow (m³/s)": {
-            "hilltop_measurement_name": "Flow",# [Water Level]",
-            "is_incremental": False,
-            "sites": pd.DataFrame(flow_site_data) if flow_site_data else pd.DataFrame(),  # Convert to DataFrame,
-            "interval": "",
-            "method": "",
-            "measures": "Flow",
-        },
-        "Water Temperature (°C)": {
-            "hilltop_measurement_name": "Water Temperature",# [Water temperature (Continuous)]",
-            "is_incremental": False,
-            "sites": pd.DataFrame(water_temperature_site_data) if water_temperature_site_data else pd.DataFrame(),  # Convert to DataFrame,
-            "interval": "",
-            "method": "",
-            "measures": "Water Temperature (Continuous)",
-        },
-        "Air Temperature (°C)": {
-            "hilltop_measurement_name": "Air Temperature",# [Air temperature (Continuous)]",
-            "is_incremental": False,
-            "sites": pd.DataFrame(air_temperature_site_data) if air_temperature_site_data else pd.DataFrame(),  # Convert to DataFrame,
-            "interval": "",
-            "method": "",
-            "measures": "Air Temperature (Continuous)",
-        }, # Add other measurements as needed
-    })
-    print("Successfully loaded site and measurement configurations.")
-except Exception as e:
-    print(f"Error loading site/measurement configurations: {e}. Using dummy data.")
-    # Fallback to dummy data if Hilltop connection fails at startup
-    MEASUREMENTS_FOR_MAPS_AND_DATASETS.update({
-        "Rainfall (mm)": {
-            "hilltop_measurement_name": "Rainfall [Rainfall]",
-            "is_incremental": True,
-            "sites": DUMMY_RAINFALL_SITES,
-            "interval": "",
-            "method": "",
-            "measures": "Rainfall",
-        },
-        "River Flow (m³/s)": {
-            "hilltop_measurement_name": "Flow",
-            "is_incremental": False,
-            "sites": DUMMY_FLOW_SITES,
-            "interval": "",
-            "method": "",
-            "measures": "Flow",
-        },
-    })
+# Built once and snapshotted (see startup.py): with gunicorn --preload the master
+# builds it and workers inherit it copy-on-write; otherwise each worker attaches
+# to the snapshot file instead of repeating the Hilltop calls.
+MEASUREMENTS_FOR_MAPS_AND_DATASETS.update(load_measurement_config())
+
+# --- Background pollers for the latest-reading map ---
+# One RecentDataTable request per collection per RECENT_POLL_INTERVAL, shared by every map view.
+# Under gunicorn this runs in the preloading master only; workers read the
+# snapshots it publishes (see gunicorn.conf.py and recent_poller.py).
+if RECENT_POLL_ENABLED:
+    with STARTUP.phase("recent pollers"):
+        start_pollers(RECENT_POLL_COLLECTIONS)
 
 # --- Dash App Initialization ---
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
-server = app.server
+with STARTUP.phase("dash app"):
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
+    server = app.server
+    register_download_routes(server) # /download/<token>.<csv|parquet|arrow> for loaded datasets
+    init_cache(server) # Memoized data_processing results (see cache.py)
+    register_metrics_route(server) # Prometheus /metrics: Hilltop call phases, payload sizes, cache hit rates
+    register_admin_routes(server) # /admin/callbacks: callback percentiles and profiles (needs ADMIN_TOKEN)
+    register_tracing(server) # Spans for every callback request; /admin/traces waterfalls (needs ADMIN_TOKEN)
 
 # --- App Layout ---
 app.layout = dbc.Container([
     dcc.Location(id='url', refresh=False),
-    dcc.Store(id='hilltop-data-store'), # To cache fetched data for download
+    dcc.Store(id='hilltop-data-store'), # Token of the loaded dataset, kept server-side in dataset_store.py
     serve_header_layout(),
     serve_sidebar_layout(),
     html.Div(id="page-content", style=CONTENT_STYLE), # Dynamic content area
     html.Div(id='current-page-path', style={'display': 'none'}) # Hidden div for current path
 ], fluid=True) # Use fluid=True for full width if desired
 
-# Register all callbacks
-register_callbacks(app)
+# Register all callbacks (dataset loads run in the background when diskcache is available)
+with STARTUP.phase("callbacks"):
+    register_callbacks(app, background_manager=background_manager())
+STARTUP.report()
 
 # Run the app
 if __name__ == '__main__':
@@ -0,0 +1,29 @@
+// map_layer.js
+//
+// Client-side rendering for the map page's dl.GeoJSON layer (see layout.py).
+// Each site feature only carries its name, latest value and colour (worked out
+// by process_map_data_2); the circle marker and popup are built here. The
+// measurement label for the popup arrives once per update in the layer's hideout.
+
+window.envDash = Object.assign({}, window.envDash, {
+    mapLayer: {
+        pointToLayer: function (feature, latlng) {
+            const p = feature.properties;
+            const hasValue = p.value !== null && p.value !== undefined;
+            return L.circleMarker(latlng, {
+                radius: hasValue ? 8 : 4,
+                color: p.color,
+                fillColor: p.color,
+                fillOpacity: hasValue ? 0.8 : 0.5
+            });
+        },
+        bindPopup: function (feature, layer, context) {
+            const p = feature.properties;
+            const label = (context && context.hideout && context.hideout.label) || "";
+            const text = (p.value === null || p.value === undefined)
+                ? "No data available"
+                : `${label}: ${Number(p.value).toFixed(1)} (Latest)`;
+            layer.bindPopup(`<b>${p.name}</b><br>${text}`);
+        }
+    }
+});
@@ -0,0 +1,71 @@
+# bench_callbacks.py
+#
+# Whole Dash callback requests (POST /_dash-update-component through Flask's
+# test client, so JSON decoding, the callback, profiling/tracing hooks and
+# response serialisation are all included), against the stub with empty caches:
+#
+#   update_map_marker_data_store   hourly rainfall map layer for every site
+#   load_dataset                   a day of raw flow for up to 100 sites (inline,
+#                                  not as a background callback)
+
+import json
+
+import dash
+import pandas as pd
+import pytest
+
+from callbacks import register_callbacks
+from dataset_store import register_download_routes
+from constants import MEASUREMENTS_FOR_MAPS_AND_DATASETS
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = dash.Dash(__name__, suppress_callback_exceptions=True)
+    app.layout = dash.html.Div()
+    register_download_routes(app.server)
+    register_callbacks(app)
+    app._setup_server() # What Dash does on the first request: builds the callback map
+    return app, app.server.test_client()
+
+
+def _update(app, client, output, inputs, state=()):
+    """Runs the callback whose outputs include `output` ("id.property") and returns the response JSON."""
+    key = next(k for k in app.callback_map if f"..{output}." in k or k == output)
+    outputs = [dict(zip(("id", "property"), o.rsplit(".", 1))) for o in key.strip(".").split("...")]
+    body = {
+        "output": key,
+        "outputs": outputs if len(outputs) > 1 else outputs[0],
+        "inputs": [{"id": i, "property": p, "value": v} for (i, p), v in inputs],
+        "state": [{"id": i, "property": p, "value": v} for (i, p), v in state],
+        "changedPropIds": [f"{i}.{p}" for (i, p), _ in inputs],
+    }
+    response = client.post("/_dash-update-component", data=json.dumps(body), content_type="application/json")
+    assert response.status_code == 200, response.data[:500]
+    return response.get_json()
+
+
+@pytest.mark.benchmark(group="callback update_map_marker_data_store")
+def test_update_map_marker_data_store(benchmark, hilltop, cold, client):
+    app, http = client
+    result = benchmark.pedantic(_update, args=(app, http, "marker-layer.data", [
+        (("map-measurement-dropdown", "value"), "Hourly Rainfall (mm)"),
+        (("map-time-period-dropdown", "value"), "Last 24 Hours"),
+    ]), **cold)
+    assert result["response"]["marker-layer"]["data"]
+
+
+@pytest.mark.benchmark(group="callback load_dataset")
+def test_load_dataset(benchmark, hilltop, cold, client):
+    app, http = client
+    sites = MEASUREMENTS_FOR_MAPS_AND_DATASETS["River Flow (m³/s)"]["sites"]["SiteName"].tolist()[:100]
+    end = pd.Timestamp.now().normalize()
+    result = benchmark.pedantic(_update, args=(app, http, "dataset-output-container.children", [
+        (("load-dataset-btn", "n_clicks"), 1),
+    ], [
+        (("dataset-measurement-dropdown", "value"), "River Flow (m³/s)"),
+        (("dataset-date-range-picker", "start_date"), (end - pd.Timedelta(days=1)).date().isoformat()),
+        (("dataset-date-range-picker", "end_date"), end.date().isoformat()),
+        (("dataset-site-dropdown", "value"), sites),
+    ]), **cold)
+    assert result["response"]["hilltop-data-store"]["data"]
@@ -0,0 +1,47 @@
+# bench_data_processing.py
+#
+# The data_processing functions behind the map and dataset pages, against the
+# stub with empty caches each round (the app cache isn't initialised here, so
+# @memoize just runs the function):
+#
+#   process_map_data_2, DataTable path     hourly rainfall totals for every site
+#   process_map_data_2, poller path        river flow from a RecentDataTable snapshot
+#   get_dataset_data_for_display           a day of raw flow for every site
+
+import pandas as pd
+import pytest
+
+from data_processing import process_map_data_2, get_dataset_data_for_display
+from recent_poller import get_poller
+from constants import MEASUREMENTS_FOR_MAPS_AND_DATASETS
+
+
+@pytest.mark.benchmark(group="process_map_data_2")
+def test_process_map_data_2_fetch(benchmark, hilltop, cold):
+    fc = benchmark.pedantic(process_map_data_2, args=("Hourly Rainfall (mm)", "Last 24 Hours"), **cold)
+    assert len(fc["features"]) == hilltop
+
+
+@pytest.mark.benchmark(group="process_map_data_2")
+def test_process_map_data_2_poller(benchmark, hilltop, cold):
+    poller = get_poller("WebRivers", start=False)
+
+    def setup():
+        cold["setup"]()
+        poller.poll_once() # A fresh snapshot, as the background poller keeps one
+
+    fc = benchmark.pedantic(process_map_data_2, args=("River Flow (m³/s)", "Last 24 Hours"),
+                            **dict(cold, setup=setup))
+    assert len(fc["features"]) == hilltop
+
+
+@pytest.mark.benchmark(group="get_dataset_data_for_display")
+def test_get_dataset_data_for_display(benchmark, hilltop, cold):
+    sites = MEASUREMENTS_FOR_MAPS_AND_DATASETS["River Flow (m³/s)"]["sites"]["SiteName"].tolist()
+    end = pd.Timestamp.now().normalize()
+    start = end - pd.Timedelta(days=1)
+    df, found = benchmark.pedantic(get_dataset_data_for_display,
+                                   args=("River Flow (m³/s)", sites, start.date().isoformat(), end.date().isoformat()),
+                                   **cold)
+    benchmark.extra_info["rows"] = len(df)
+    assert found
@@ -0,0 +1,42 @@
+# bench_fetch.py
+#
+# DataTable fetches from the stub, through the time series cache, with empty
+# caches each round:
+#
+#   fetch_data_table_for_custom_collection   one multi-site call (up to
+#                                            PLANNER_MAX_SITES_PER_CALL sites), two days raw
+#   fetch_collection_table                   every site, two days of hourly totals,
+#                                            split into parallel chunks by the planner
+
+import pandas as pd
+import pytest
+
+from hilltop_api import fetch_data_table_for_custom_collection
+from request_planner import fetch_collection_table
+from site_registry import SITE_REGISTRY
+from constants import PLANNER_MAX_SITES_PER_CALL
+
+
+def _window():
+    end = pd.Timestamp.now().floor("h")
+    return end - pd.Timedelta(days=2), end
+
+
+@pytest.mark.benchmark(group="fetch_data_table_for_custom_collection")
+def test_fetch_data_table_for_custom_collection(benchmark, hilltop, cold):
+    sites = ",".join(SITE_REGISTRY.collection("WebRivers")["SiteName"][:PLANNER_MAX_SITES_PER_CALL])
+    start, end = _window()
+    df = benchmark.pedantic(fetch_data_table_for_custom_collection,
+                            args=(sites, "Flow", start.isoformat(), end.isoformat(), None, None), **cold)
+    benchmark.extra_info["rows"] = len(df)
+    assert not df.empty
+
+
+@pytest.mark.benchmark(group="fetch_collection_table")
+def test_fetch_collection_table(benchmark, hilltop, cold):
+    sites = SITE_REGISTRY.collection("WebRainfall")["SiteName"].tolist()
+    start, end = _window()
+    df = benchmark.pedantic(fetch_collection_table,
+                            args=(sites, "Rainfall,Rainfall SCADA", start, end, "Total", "1 hour"), **cold)
+    benchmark.extra_info["rows"] = len(df)
+    assert df["SiteName"].nunique() == hilltop
@@ -0,0 +1,79 @@
+# bench_latest_valid.py
+#
+# Compares the old per-site groupby().apply(lambda) / sort+groupby().tail(1)
+# "latest reading" code with the vectorised latest_valid_by_key routine.
+#
+# Run from the repository root:
+#     python benchmarks/bench_latest_valid.py
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hilltop_api import latest_valid_by_key, get_latest_by_site  # noqa: E402
+
+# (sites, timesteps) pairs; rows = sites x timesteps
+SIZES = [
+    (100, 10),       # 1k rows
+    (1_000, 10),     # 10k rows
+    (1_000, 100),    # 100k rows
+    (10_000, 10),    # 100k rows, many sites
+]
+REPEATS = 3
+
+
+def make_frame(n_sites, n_steps, nan_fraction=0.2, seed=0):
+    """DataTable-shaped frame (SiteName, Time, M1) with some missing values."""
+    rng = np.random.default_rng(seed)
+    sites = np.repeat([f"Site {i}" for i in range(n_sites)], n_steps)
+    times = np.tile(pd.date_range("2025-07-01", periods=n_steps, freq="15min").to_numpy(), n_sites)
+    values = rng.random(n_sites * n_steps) * 100
+    values[rng.random(values.size) < nan_fraction] = np.nan
+    df = pd.DataFrame({"SiteName": sites, "Time": times, "M1": values})
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True) # Hilltop doesn't promise order
+
+
+def old_map_latest(df):
+    """The original process_map_data_2 code."""
+    return df.groupby('SiteName', group_keys=False)['M1'].apply(
+        lambda x: x.loc[x.last_valid_index()] if x.last_valid_index() is not None else None
+    ).dropna().reset_index(name='M1')
+
+
+def old_get_latest_by_site(df):
+    """The original get_latest_by_site code."""
+    df = df.dropna(subset=["Time"])
+    latest_df = df.sort_values("Time").groupby("SiteName", as_index=False).tail(1)
+    return latest_df.sort_values("SiteName").reset_index(drop=True)
+
+
+def best_of(fn, df):
+    best = float("inf")
+    for _ in range(REPEATS):
+        data = df.copy()
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    print(f"{'sites':>8} {'steps':>6} {'rows':>8} | {'map old ms':>10} {'map new ms':>10} {'x':>6} | "
+          f"{'latest old ms':>13} {'latest new ms':>13} {'x':>6}")
+    for n_sites, n_steps in SIZES:
+        df = make_frame(n_sites, n_steps)
+        map_old = best_of(old_map_latest, df)
+        map_new = best_of(lambda d: latest_valid_by_key(d, ["M1"]), df)
+        lat_old = best_of(old_get_latest_by_site, df)
+        lat_new = best_of(get_latest_by_site, df)
+        print(f"{n_sites:>8} {n_steps:>6} {len(df):>8} | {map_old:>10.1f} {map_new:>10.1f} {map_old / map_new:>6.1f} | "
+              f"{lat_old:>13.1f} {lat_new:>13.1f} {lat_old / lat_new:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# bench_parse.py
+#
+# parse_hilltop_xml on a day of WebRivers readings (3 measurements, 15-minute
+# steps), from bytes already in memory: the parse and convert cost alone.
+
+import pytest
+
+from hilltop_api import parse_hilltop_xml
+
+
+@pytest.mark.benchmark(group="parse_hilltop_xml")
+def test_parse_hilltop_xml(benchmark, data_table_xml):
+    df = benchmark(parse_hilltop_xml, data_table_xml)
+    benchmark.extra_info.update(rows=len(df), megabytes=round(len(data_table_xml) / 1e6, 1))
+    assert len(df) > 0
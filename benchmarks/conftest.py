@@ -0,0 +1,118 @@
+# conftest.py
+#
+# Fixtures for the pytest-benchmark suite: every benchmark runs against
+# hilltop_stub.py instead of the TRC server, at each size in BENCH_SITES.
+#
+# Run from the repository root:
+#     pip install -r benchmarks/requirements.txt
+#     pytest benchmarks/ --benchmark-autosave             # 10, 100, 1k and 10k sites
+#     BENCH_SITES=10,100 pytest benchmarks/               # quicker
+#     pytest-benchmark compare 0001 0002                  # before/after a change
+#
+# The stub runs in its own process (so generating XML doesn't compete with the
+# code being measured for the GIL) on a fixed port, restarted for each size.
+# The app is configured here, before any app module is imported: HILLTOP_BASE_URL
+# points at the stub, state goes to a temporary directory, and the pollers,
+# on-disk store and config snapshot are off so each round measures the same work.
+# The in-memory caches are cleared before every round (see `cold`).
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SITE_COUNTS = [int(n) for n in os.environ.get("BENCH_SITES", "10,100,1000,10000").split(",")]
+STUB_LATENCY = os.environ.get("BENCH_LATENCY", "0") # Seconds per request; 0 measures our own overhead
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+STUB_PORT = _free_port()
+os.environ.update({
+    "HILLTOP_BASE_URL": f"http://127.0.0.1:{STUB_PORT}/",
+    "ENV_DASH_CACHE_DIR": tempfile.mkdtemp(prefix="env_dash_bench_"),
+    "RECENT_POLL_ENABLED": "0",
+    "TIMESERIES_STORE_ENABLED": "0",
+    "CONFIG_SNAPSHOT_ENABLED": "0",
+    "BACKGROUND_CALLBACKS_ENABLED": "0",
+    "CALLBACK_PROFILE_THRESHOLD": "1e9",
+})
+
+
+def _start_stub(sites):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "hilltop_stub.py"), "--port", str(STUB_PORT),
+         "--sites", str(sites), "--latency", STUB_LATENCY],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", STUB_PORT), timeout=0.5).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"hilltop_stub.py exited with {process.returncode}")
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("hilltop_stub.py did not start")
+
+
+def clear_caches():
+    """Forgets everything fetched so far, so the next call goes to the stub."""
+    from timeseries_cache import TIMESERIES_CACHE
+    from rollups import ROLLUPS
+    TIMESERIES_CACHE.clear()
+    ROLLUPS.clear()
+
+
+@pytest.fixture(scope="session", params=SITE_COUNTS, ids=lambda n: f"{n}sites")
+def hilltop(request):
+    """
+    The stub serving `request.param` sites, with the site registry and the
+    measurement configuration loaded from it. Yields the number of sites.
+    """
+    from site_registry import SITE_REGISTRY
+    from startup import build_measurement_config
+    from constants import MEASUREMENTS_FOR_MAPS_AND_DATASETS
+
+    process = _start_stub(request.param)
+    try:
+        SITE_REGISTRY.refresh()
+        measurements, ok = build_measurement_config()
+        assert ok, "could not load the site configuration from the stub"
+        MEASUREMENTS_FOR_MAPS_AND_DATASETS.clear()
+        MEASUREMENTS_FOR_MAPS_AND_DATASETS.update(measurements)
+        clear_caches()
+        yield request.param
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture
+def cold():
+    """pedantic() keyword arguments for rounds that each start with empty caches."""
+    return {"setup": clear_caches, "rounds": int(os.environ.get("BENCH_ROUNDS", "3")), "iterations": 1}
+
+
+@pytest.fixture(scope="session", params=SITE_COUNTS, ids=lambda n: f"{n}sites")
+def data_table_xml(request):
+    """A day of raw 15-minute WebRivers readings for `request.param` sites, as DataTable XML bytes."""
+    from hilltop_stub import HilltopStub
+    stub = HilltopStub(sites=request.param)
+    try:
+        return "".join(stub.data_table({"collection": "WebRivers", "from": "", "to": ""})).encode("utf-8")
+    finally:
+        stub.stop()
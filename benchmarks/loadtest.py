@@ -0,0 +1,532 @@
+# loadtest.py
+#
+# Concurrent-user load test of the Dash callbacks, over HTTP, the way the
+# browser drives them.
+#
+#   python benchmarks/loadtest.py --sites 1000 --users 40 --ramp-up 20 --duration 120
+#
+# starts hilltop_stub.py and the app under gunicorn (gunicorn.conf.py, pointed
+# at the stub, with its state in a temporary directory), runs the users, and
+# stops both. `--url http://host:8050` loads an app that is already running
+# instead (add `--pid <gunicorn master>` to follow its memory).
+#
+# Each user opens the app (GET /, which carries the Dash config the renderer
+# signs background callback requests with), then repeats one scenario, with an
+# exponentially distributed think time (mean --think seconds) between steps:
+#
+#   map       display_page('/maps'), update_map_time_period_options and
+#             update_map_marker_data_store for a random measurement
+#   dataset   display_page('/datasets'), update_dataset_site_options,
+#             load_dataset for --dataset-sites random sites over --dataset-days,
+#             then GET the CSV download link it returns
+#
+# --mix map=3,dataset=1 sets the share of users running each scenario, and the
+# users start evenly over --ramp-up seconds. Callback requests are built from
+# the app's own /_dash-dependencies (the registered signatures), so they stay in
+# step with callbacks.py. Background callbacks (load_dataset when diskcache is
+# installed) are polled with their cacheKey/job at the registered interval
+# until they finish, as the renderer does; their latency is the whole job.
+#
+# The report gives, per step and overall, requests, errors, throughput and
+# p50/p90/p99 latency, and the RSS of the gunicorn master and each worker at
+# the start, at its peak and at the end (psutil, sampled every second).
+# `--json results.json` also writes it all out for comparing runs.
+
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+import psutil
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+SCENARIOS = ("map", "dataset")
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url, process, timeout):
+    """Waits until `url` answers 200, or raises if `process` exits or `timeout` passes."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with {process.returncode}")
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_servers(args):
+    """Starts the stub and the app under gunicorn; returns (app URL, [processes])."""
+    log_prefix = "[LOADTEST]"
+    stub_port, app_port = _free_port(), _free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "hilltop_stub.py"), "--port", str(stub_port),
+         "--sites", str(args.sites), "--latency", str(args.latency)],
+        stdout=subprocess.DEVNULL,
+    )
+    _wait_for(f"http://127.0.0.1:{stub_port}/boo.hts?Service=Hilltop&Request=SiteList", stub, 30)
+
+    env = dict(os.environ,
+               HILLTOP_BASE_URL=f"http://127.0.0.1:{stub_port}/",
+               ENV_DASH_CACHE_DIR=tempfile.mkdtemp(prefix="env_dash_load_"),
+               GUNICORN_BIND=f"127.0.0.1:{app_port}",
+               GUNICORN_WORKERS=str(args.workers))
+    app = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:server"],
+        cwd=ROOT, env=env,
+        stdout=None if verbose else subprocess.DEVNULL, stderr=None if verbose else subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{app_port}"
+    try:
+        _wait_for(url + "/", app, 300) # Preloading builds the measurement config from the stub
+    except RuntimeError:
+        stub.terminate()
+        app.terminate()
+        raise
+    print(f"{log_prefix} Stub with {args.sites} sites on :{stub_port}, app with {args.workers} workers on :{app_port}")
+    return url, [app, stub]
+
+
+# --- Talking to the app like the Dash renderer ---
+
+class DashClient:
+    """One user's connection to the app: its own session, Dash config and callback signatures."""
+
+    def __init__(self, url, timeout):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.end_id = None
+        self.dependencies = None
+
+    def open(self):
+        """GET / (for the signed end_id in the Dash config) and the callback signatures."""
+        response = self.session.get(self.url + "/", timeout=self.timeout)
+        response.raise_for_status()
+        match = re.search(r'<script id="_dash-config" type="application/json">(.*?)</script>', response.text, re.S)
+        self.end_id = json.loads(match.group(1)).get("end_id") if match else None
+        self.dependencies = self.session.get(self.url + "/_dash-dependencies", timeout=self.timeout).json()
+        return response
+
+    def _signature(self, output):
+        for dependency in self.dependencies:
+            if f"..{output}.." in dependency["output"] or dependency["output"] == output:
+                return dependency
+        raise KeyError(f"No callback with output {output}")
+
+    def callback(self, output, values, changed):
+        """
+        Runs the callback that has `output` ("id.property"), taking its inputs and
+        state from `values` ({"id.property": value}, missing ones None) and
+        `changed` as the triggering prop. Returns {id: {property: value}}, empty
+        when the callback prevented the update.
+        """
+        dependency = self._signature(output)
+        key = dependency["output"]
+        outputs = [dict(zip(("id", "property"), o.rsplit(".", 1))) for o in key.strip(".").split("...")]
+        body = {
+            "output": key,
+            "outputs": outputs if key.startswith("..") else outputs[0],
+            "inputs": [dict(i, value=values.get(f"{i['id']}.{i['property']}")) for i in dependency["inputs"]],
+            "state": [dict(s, value=values.get(f"{s['id']}.{s['property']}")) for s in dependency["state"]],
+            "changedPropIds": [changed],
+        }
+        params = {"endId": self.end_id} if self.end_id else {}
+        data = self._post(body, params)
+        if dependency.get("background") and data and "response" not in data:
+            # The first answer is the job handle; poll it until the job returns
+            interval = dependency["background"]["interval"] / 1000
+            params = dict(params, cacheKey=data["cacheKey"], job=data["job"])
+            polled = dict(body, inputs=[dict(i, value=None) for i in body["inputs"]],
+                          state=[dict(s, value=None) for s in body["state"]])
+            while data and "response" not in data:
+                time.sleep(interval)
+                data = self._post(polled, params)
+        return data.get("response", {})
+
+    def _post(self, body, params):
+        response = self.session.post(self.url + "/_dash-update-component", json=body, params=params,
+                                     timeout=self.timeout)
+        if response.status_code == 204: # PreventUpdate / no_update
+            return {}
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, path):
+        response = self.session.get(self.url + path, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+
+def find_component(tree, component_id):
+    """The props of the component with `component_id` in a serialised layout, or None."""
+    if isinstance(tree, list):
+        for child in tree:
+            found = find_component(child, component_id)
+            if found is not None:
+                return found
+    elif isinstance(tree, dict):
+        props = tree.get("props", {})
+        if props.get("id") == component_id:
+            return props
+        return find_component(props.get("children"), component_id)
+    return None
+
+
+def _option_values(options):
+    return [o["value"] if isinstance(o, dict) else o for o in options or []]
+
+
+# --- Results ---
+
+class Results:
+    """Latencies and errors per step, shared by all the users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+        self.started = None
+        self.finished = None
+
+    def timed(self, step, fn, *args):
+        """Runs fn(*args) as `step`; returns its result, or None when it failed."""
+        t0 = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            with self._lock:
+                self.errors[step] += 1
+                self.error_samples.setdefault(step, f"{type(e).__name__}: {e}"[:200])
+            if verbose:
+                print(f"[LOADTEST] {step} failed: {e}")
+            return None
+        seconds = time.perf_counter() - t0
+        with self._lock:
+            self.latencies[step].append(seconds)
+        return result
+
+    def summary(self):
+        elapsed = max((self.finished or time.monotonic()) - self.started, 1e-9)
+        rows = {}
+        steps = sorted(set(self.latencies) | set(self.errors))
+        everything = [s for step in steps for s in self.latencies[step]]
+        for step, latencies in [(step, self.latencies[step]) for step in steps] + [("all", everything)]:
+            errors = sum(self.errors.values()) if step == "all" else self.errors[step]
+            count = len(latencies) + errors
+            ordered = sorted(latencies)
+            rows[step] = {
+                "requests": count,
+                "errors": errors,
+                "error_rate": errors / count if count else 0.0,
+                "per_second": count / elapsed,
+                **{f"p{int(q * 100)}": _percentile(ordered, q) for q in PERCENTILES},
+                "max": ordered[-1] if ordered else None,
+            }
+        return {"seconds": elapsed, "steps": rows, "error_samples": dict(self.error_samples)}
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class MemoryMonitor(threading.Thread):
+    """Samples the RSS of a server process and its children (the gunicorn workers) every `interval` seconds."""
+
+    def __init__(self, pid, interval=1.0):
+        super().__init__(daemon=True)
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.samples = {} # pid -> {"role", "first", "peak", "last", "alive"}
+        self._stop = threading.Event()
+
+    def sample(self):
+        try:
+            processes = [self.root] + self.root.children(recursive=True)
+        except psutil.Error:
+            return
+        seen = set()
+        for process in processes:
+            try:
+                rss = process.memory_info().rss
+            except psutil.Error:
+                continue
+            seen.add(process.pid)
+            entry = self.samples.setdefault(process.pid, {
+                "role": "master" if process.pid == self.root.pid else "worker",
+                "first": rss, "peak": rss, "last": rss, "alive": True,
+            })
+            entry["peak"] = max(entry["peak"], rss)
+            entry["last"] = rss
+        for pid, entry in self.samples.items():
+            entry["alive"] = pid in seen
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+        self.sample()
+
+    def summary(self):
+        # Processes that came and went (background callback jobs) are only counted
+        processes = {pid: e for pid, e in self.samples.items() if e["alive"]}
+        return {
+            "processes": {str(pid): dict(e, growth=e["last"] - e["first"]) for pid, e in sorted(processes.items())},
+            "short_lived": sum(1 for e in self.samples.values() if not e["alive"]),
+        }
+
+
+def _listening_pid(url):
+    """The pid of the process listening on the port of `url`, when it can be seen from here."""
+    port = urlsplit(url).port or 80
+    try:
+        for connection in psutil.net_connections(kind="tcp"):
+            if connection.status == psutil.CONN_LISTEN and connection.laddr.port == port and connection.pid:
+                return psutil.Process(connection.pid).parent().pid if _is_worker(connection.pid) else connection.pid
+    except psutil.Error:
+        pass
+    return None
+
+
+def _is_worker(pid):
+    try:
+        parent = psutil.Process(pid).parent()
+        return parent is not None and "gunicorn" in " ".join(parent.cmdline())
+    except psutil.Error:
+        return False
+
+
+# --- Users ---
+
+def map_user(client, results, rng, think, stop):
+    """Opens the map page, then keeps choosing a measurement and loading its markers."""
+    page = results.timed("display_page /maps", client.callback, "page-content.children",
+                         {"url.pathname": "/maps"}, "url.pathname")
+    dropdown = find_component(page and page["page-content"]["children"], "map-measurement-dropdown")
+    measurements = _option_values(dropdown and dropdown.get("options"))
+    while measurements and not stop.is_set():
+        think()
+        measurement = rng.choice(measurements)
+        periods = results.timed("update_map_time_period_options", client.callback, "map-time-period-dropdown.options",
+                                {"map-measurement-dropdown.value": measurement}, "map-measurement-dropdown.value")
+        if periods is None:
+            continue
+        period = rng.choice(_option_values(periods["map-time-period-dropdown"]["options"]) or [None])
+        results.timed("update_map_marker_data_store", client.callback, "marker-layer.data",
+                      {"map-measurement-dropdown.value": measurement, "map-time-period-dropdown.value": period},
+                      "map-time-period-dropdown.value")
+
+
+def dataset_user(client, results, rng, think, stop, sites_per_load, days):
+    """Opens the datasets page, then keeps loading datasets for random sites and downloading them."""
+    page = results.timed("display_page /datasets", client.callback, "page-content.children",
+                         {"url.pathname": "/datasets"}, "url.pathname")
+    dropdown = find_component(page and page["page-content"]["children"], "dataset-measurement-dropdown")
+    measurements = _option_values(dropdown and dropdown.get("options"))
+    clicks = 0
+    while measurements and not stop.is_set():
+        think()
+        measurement = rng.choice(measurements)
+        options = results.timed("update_dataset_site_options", client.callback, "dataset-site-dropdown.options",
+                                {"dataset-measurement-dropdown.value": measurement}, "dataset-measurement-dropdown.value")
+        sites = _option_values(options and options["dataset-site-dropdown"]["options"])
+        if not sites:
+            continue
+        think()
+        clicks += 1
+        end = date.today()
+        loaded = results.timed("load_dataset", client.callback, "dataset-output-container.children", {
+            "load-dataset-btn.n_clicks": clicks,
+            "dataset-measurement-dropdown.value": measurement,
+            "dataset-date-range-picker.start_date": (end - timedelta(days=days)).isoformat(),
+            "dataset-date-range-picker.end_date": end.isoformat(),
+            "dataset-site-dropdown.value": rng.sample(sites, min(sites_per_load, len(sites))),
+        }, "load-dataset-btn.n_clicks")
+        href = loaded and loaded.get("download-csv-btn", {}).get("href")
+        if href:
+            think()
+            results.timed("download csv", lambda: len(client.get(href).content))
+
+
+def run_user(index, scenario, args, results, stop):
+    rng = random.Random(args.seed * 10007 + index)
+    think = lambda: stop.wait(rng.expovariate(1 / args.think)) if args.think > 0 else None
+    client = DashClient(args.url, args.timeout)
+    while not stop.is_set():
+        if results.timed("GET /", client.open) is None:
+            stop.wait(1)
+            continue
+        if scenario == "map":
+            map_user(client, results, rng, think, stop)
+        else:
+            dataset_user(client, results, rng, think, stop, args.dataset_sites, args.dataset_days)
+        stop.wait(1) # Only reached when a page gave nothing to choose from
+
+
+def parse_mix(text):
+    """'map=3,dataset=1' -> {'map': 3.0, 'dataset': 1.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r} (expected one of {', '.join(SCENARIOS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def assign_scenarios(users, mix):
+    """Splits `users` between the scenarios in proportion to `mix`, interleaved so the ramp-up mixes them too."""
+    total = sum(mix.values())
+    counts = {name: 0 for name in mix}
+    assigned = []
+    for i in range(users):
+        # Each user goes to the scenario furthest below its share so far
+        name = max(mix, key=lambda n: mix[n] / total * (i + 1) - counts[n])
+        counts[name] += 1
+        assigned.append(name)
+    return assigned
+
+
+def run(args):
+    """Runs the users for --duration seconds after the ramp-up; returns the report dict."""
+    log_prefix = "[LOADTEST]"
+    scenarios = assign_scenarios(args.users, args.mix)
+    results = Results()
+    stop = threading.Event()
+
+    monitor = None
+    pid = args.pid or _listening_pid(args.url)
+    if pid:
+        monitor = MemoryMonitor(pid)
+        monitor.sample()
+        monitor.start()
+    else:
+        print(f"{log_prefix} Can't see the server process for {args.url}; no memory figures (use --pid)")
+
+    print(f"{log_prefix} {args.users} users ({', '.join(f'{scenarios.count(n)} {n}' for n in args.mix)}) "
+          f"over {args.ramp_up:g}s, then {args.duration:g}s, think time {args.think:g}s")
+    results.started = time.monotonic()
+    threads = []
+    for i, scenario in enumerate(scenarios):
+        if i and args.ramp_up:
+            stop.wait(args.ramp_up / args.users)
+        thread = threading.Thread(target=run_user, args=(i, scenario, args, results, stop), daemon=True,
+                                  name=f"user-{i}-{scenario}")
+        thread.start()
+        threads.append(thread)
+
+    stop.wait(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join(args.timeout)
+    results.finished = time.monotonic()
+    if monitor:
+        monitor.stop()
+
+    report = {
+        "users": args.users,
+        "mix": dict(args.mix),
+        "think": args.think,
+        "ramp_up": args.ramp_up,
+        **results.summary(),
+        "memory": monitor.summary() if monitor else None,
+    }
+    return report
+
+
+def print_report(report):
+    def ms(value):
+        return "" if value is None else f"{value * 1000:.0f}"
+
+    print(f"\n{report['users']} users for {report['seconds']:.0f}s")
+    print(f"  {'step':<32} {'requests':>8} {'errors':>7} {'req/s':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for step, row in report["steps"].items():
+        if step == "all":
+            print("  " + "-" * 94)
+        print(f"  {step:<32} {row['requests']:8d} {row['error_rate']:7.1%} {row['per_second']:7.2f} "
+              f"{ms(row['p50']):>8} {ms(row['p90']):>8} {ms(row['p99']):>8} {ms(row['max']):>8}")
+    for step, sample in report["error_samples"].items():
+        print(f"  first {step} error: {sample}")
+
+    memory = report["memory"]
+    if memory:
+        print(f"\n  {'process':<16} {'start MB':>9} {'peak MB':>9} {'end MB':>9} {'growth MB':>10}")
+        for pid, e in memory["processes"].items():
+            print(f"  {e['role'] + ' ' + pid:<16} {e['first'] / 2**20:9.1f} {e['peak'] / 2**20:9.1f} "
+                  f"{e['last'] / 2**20:9.1f} {e['growth'] / 2**20:+10.1f}")
+        if memory["short_lived"]:
+            print(f"  (+{memory['short_lived']} short-lived processes, e.g. background callback jobs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user load test of the env_dash callbacks")
+    parser.add_argument("--url", help="App to load (default: start the stub and the app under gunicorn)")
+    parser.add_argument("--pid", type=int, help="Server (gunicorn master) pid to follow the memory of, with --url")
+    parser.add_argument("--sites", type=int, default=1000, help="Stub site count (default 1000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub seconds per request (default 0)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers (default 2)")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent users (default 20)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("map=3,dataset=1"),
+                        help="Share of users per scenario (default map=3,dataset=1)")
+    parser.add_argument("--think", type=float, default=2.0, help="Mean think time between steps, seconds (default 2)")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds over which the users start (default 10)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run after the ramp-up starts (default 60)")
+    parser.add_argument("--dataset-sites", type=int, default=5, help="Sites per dataset load (default 5)")
+    parser.add_argument("--dataset-days", type=int, default=7, help="Days per dataset load (default 7)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Request timeout, seconds (default 120)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    processes = []
+    if not args.url:
+        args.url, processes = start_servers(args)
+        args.pid = processes[0].pid
+    try:
+        report = run(args)
+    finally:
+        for process in processes:
+            process.terminate()
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# cache.py
+#
+# Flask-Caching layer for the data_processing functions behind the callbacks.
+#
+# init_cache(server) attaches the backend chosen by APP_CACHE_TYPE (file system
+# cache under CACHE_DIR by default, so every worker shares it; "SimpleCache" for
+# a single process, or any Flask-Caching backend such as "RedisCache").
+#
+# @memoize(ttl, stale_ttl) caches a function's result per normalised arguments.
+# For `ttl` seconds the cached result is returned as is. Up to `stale_ttl`
+# seconds after that it is still returned instantly, but a background refresh is
+# started so the next caller gets fresh data. Exceptions are never cached, and
+# results failing the optional `cache_if(result)` predicate (e.g. partial data)
+# are returned without being cached; a refresh that raises or fails the
+# predicate keeps the stale value. Before init_cache is called (e.g. in
+# scripts) memoized functions just run. Outside a request (background callback
+# jobs, which run in short-lived worker processes that would kill a refresh
+# thread) a stale entry is refreshed synchronously instead.
+#
+# background_manager() returns the DiskcacheManager that runs long callbacks
+# (dataset loads) in worker processes with progress updates and cancellation.
+
+import functools
+import hashlib
+import inspect
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+from flask import has_request_context
+from flask_caching import Cache
+
+from metrics import cache_lookup
+from constants import APP_CACHE_CONFIG, BACKGROUND_CALLBACKS_ENABLED, BACKGROUND_CACHE_DIR
+
+try:
+    import diskcache
+except ImportError: # Optional: long callbacks run inline without it
+    diskcache = None
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+cache = Cache()
+_server = None
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_STALE = object()
+
+
+def init_cache(server, config=None):
+    """Attaches the cache backend to the Dash app's Flask server."""
+    global _server
+    log_prefix = "[CACHE-INIT]"
+    config = dict(APP_CACHE_CONFIG, **(config or {}))
+    cache.init_app(server, config=config)
+    _server = server
+    if verbose:
+        print(f"{log_prefix} Using {config['CACHE_TYPE']}")
+    return cache
+
+
+def _normalise(value):
+    """Makes equivalent arguments produce the same key ('2025-07-01' == datetime(2025, 7, 1), lists == tuples)."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalise(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalise(v)) for k, v in value.items()))
+    if isinstance(value, (datetime, date, pd.Timestamp)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, str) and len(value) >= 10 and value[4:5] == "-" and value[7:8] == "-":
+        try:
+            return pd.Timestamp(value).isoformat()
+        except ValueError:
+            pass
+    return value
+
+
+def make_key(fn, args, kwargs, ignore=()):
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    normalised = tuple((name, _normalise(value)) for name, value in bound.arguments.items() if name not in ignore)
+    digest = hashlib.sha1(repr(normalised).encode("utf-8")).hexdigest()
+    return f"memo:{fn.__module__}.{fn.__qualname__}:{digest}"
+
+
+def _refresh(key, fn, args, kwargs, timeout, cache_if):
+    """Recomputes a stale entry; returns the fresh value, or _STALE if it should be kept."""
+    log_prefix = "[CACHE-REFRESH]"
+    try:
+        with _server.app_context():
+            value = fn(*args, **kwargs)
+            if cache_if is not None and not cache_if(value):
+                print(f"{log_prefix} Refresh of {key} was incomplete, keeping the stale value")
+                return _STALE
+            cache.set(key, (time.time(), value), timeout=timeout)
+        if verbose:
+            print(f"{log_prefix} Refreshed {key}")
+        return value
+    except Exception as e:
+        print(f"{log_prefix} Refresh of {key} failed, keeping the stale value: {e}")
+        return _STALE
+
+
+def _refresh_in_background(key, fn, args, kwargs, timeout, cache_if):
+    try:
+        _refresh(key, fn, args, kwargs, timeout, cache_if)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def memoize(ttl, stale_ttl=0, ignore=(), cache_if=None):
+    """
+    Caches results for `ttl` seconds, then serves them stale for up to `stale_ttl`
+    more while refreshing. Keyword arguments named in `ignore` (e.g. progress
+    callbacks) don't affect the key and are left out of background refreshes.
+    If given, only results for which cache_if(result) is true are cached.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            log_prefix = "[CACHE-MEMOIZE]"
+            if _server is None:
+                return fn(*args, **kwargs)
+
+            key = make_key(fn, args, kwargs, ignore)
+            timeout = ttl + stale_ttl
+            try:
+                entry = cache.get(key)
+            except Exception as e: # A broken backend shouldn't take the page down
+                print(f"{log_prefix} Cache read failed for {key}: {e}")
+                entry = None
+
+            if entry is not None:
+                stored_at, value = entry
+                age = time.time() - stored_at
+                if age < ttl:
+                    cache_lookup("app", "hit")
+                    return value
+                cache_lookup("app", "stale")
+                if not has_request_context():
+                    # A background callback job: its process exits when the job
+                    # returns, so a refresh thread would be killed part way through
+                    fresh = _refresh(key, fn, args, kwargs, timeout, cache_if)
+                    return value if fresh is _STALE else fresh
+                with _refreshing_lock:
+                    start_refresh = key not in _refreshing
+                    _refreshing.add(key)
+                if start_refresh:
+                    refresh_kwargs = {k: v for k, v in kwargs.items() if k not in ignore}
+                    threading.Thread(target=_refresh_in_background, args=(key, fn, args, refresh_kwargs, timeout, cache_if),
+                                     name="cache-refresh", daemon=True).start()
+                if verbose:
+                    print(f"{log_prefix} Serving {fn.__name__} stale ({age:.0f}s old) while refreshing")
+                return value
+
+            cache_lookup("app", "miss")
+            value = fn(*args, **kwargs)
+            if cache_if is not None and not cache_if(value):
+                if verbose:
+                    print(f"{log_prefix} Not caching {fn.__name__}: result failed cache_if")
+                return value
+            try:
+                cache.set(key, (time.time(), value), timeout=timeout)
+            except Exception as e:
+                print(f"{log_prefix} Cache write failed for {key}: {e}")
+            return value
+        return wrapper
+    return decorator
+
+
+def background_manager():
+    """
+    DiskcacheManager for Dash background callbacks, or None when they are
+    disabled or diskcache isn't installed (callbacks then run inline).
+    """
+    log_prefix = "[CACHE-BACKGROUND]"
+    if not BACKGROUND_CALLBACKS_ENABLED or diskcache is None:
+        if verbose:
+            print(f"{log_prefix} Background callbacks off, running long callbacks inline")
+        return None
+    from dash import DiskcacheManager
+    return DiskcacheManager(diskcache.Cache(BACKGROUND_CACHE_DIR))
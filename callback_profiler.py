@@ -0,0 +1,245 @@
+# callback_profiler.py
+#
+# Per-callback timing and profiling for the Dash app.
+#
+# register_callbacks() registers everything through profiled(app), whose
+# .callback() wraps each callback so every run records:
+#
+#   callback_seconds{callback, clock}          wall and CPU (thread) time
+#   callback_payload_bytes{callback, direction} request and response body sizes
+#                                               of /_dash-update-component
+#   callback_calls_total{callback, outcome}     ok, prevented or error
+#
+# as rolling-window summaries in the metrics registry (so they are added up
+# across workers and also appear on /metrics).
+#
+# A callback that takes longer than CALLBACK_PROFILE_THRESHOLD seconds is armed:
+# its next run is captured with cProfile, and kept under CALLBACK_PROFILE_DIR if
+# it is slow again (CALLBACK_PROFILE_ALL profiles every run). The /admin/callbacks
+# page, which needs ADMIN_TOKEN, shows the percentiles and the saved profiles.
+
+import cProfile
+import functools
+import hmac
+import html
+import io
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+import dash
+from flask import Response, abort, g, has_request_context, request, send_file
+
+import metrics
+import tracing
+from constants import (
+    CALLBACK_PROFILING_ENABLED,
+    CALLBACK_STATS_WINDOW,
+    CALLBACK_PROFILE_THRESHOLD,
+    CALLBACK_PROFILE_ALL,
+    CALLBACK_PROFILE_DIR,
+    CALLBACK_PROFILE_KEEP,
+    ADMIN_TOKEN,
+)
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+CALLBACK_SECONDS = metrics.summary("callback_seconds", "Dash callback time by clock (wall, cpu)",
+                                   ("callback", "clock"), CALLBACK_STATS_WINDOW)
+CALLBACK_PAYLOAD_BYTES = metrics.summary("callback_payload_bytes", "Dash callback request/response body bytes",
+                                         ("callback", "direction"), CALLBACK_STATS_WINDOW)
+CALLBACK_CALLS = metrics.counter("callback_calls_total", "Dash callback runs by outcome (ok, prevented, error)",
+                                 ("callback", "outcome"))
+
+_armed = set()                      # Callbacks whose next run is profiled
+_profile_lock = threading.Lock()    # One cProfile at a time (it can't nest across threads)
+
+
+def _save_profile(name, profile, wall):
+    """Writes the profile (.prof for snakeviz etc., .txt summary) and keeps the newest CALLBACK_PROFILE_KEEP."""
+    log_prefix = "[CALLBACK-PROFILE]"
+    stem = f"{datetime.now():%Y%m%d-%H%M%S}-{name}-{os.getpid()}-{wall:.2f}s"
+    try:
+        os.makedirs(CALLBACK_PROFILE_DIR, exist_ok=True)
+        profile.dump_stats(os.path.join(CALLBACK_PROFILE_DIR, f"{stem}.prof"))
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(40)
+        with open(os.path.join(CALLBACK_PROFILE_DIR, f"{stem}.txt"), "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+        stems = sorted({os.path.splitext(e.name)[0] for e in os.scandir(CALLBACK_PROFILE_DIR)})
+        for old in stems[:-CALLBACK_PROFILE_KEEP]:
+            for ext in (".prof", ".txt"):
+                try:
+                    os.remove(os.path.join(CALLBACK_PROFILE_DIR, old + ext))
+                except OSError:
+                    pass
+        print(f"{log_prefix} Saved profile of {name} ({wall:.2f}s) as {stem}")
+    except OSError as e:
+        print(f"{log_prefix} Could not save profile of {name}: {e}")
+
+
+def _wrap(fn):
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if has_request_context():
+            g.callback_name = name # For the payload sizes recorded after the response
+        profile = None
+        if (CALLBACK_PROFILE_ALL or name in _armed) and _profile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+        outcome = "ok"
+        wall0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            if profile is not None:
+                profile.enable()
+            # Child of the request's trace; background jobs (no request) start their own
+            with tracing.span(f"callback {name}", root=not has_request_context(),
+                              expected=(dash.exceptions.PreventUpdate,)):
+                return fn(*args, **kwargs)
+        except dash.exceptions.PreventUpdate:
+            outcome = "prevented"
+            raise
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.thread_time() - cpu0
+            if profile is not None:
+                profile.disable()
+                _profile_lock.release()
+            CALLBACK_SECONDS.add((name, "wall"), wall)
+            CALLBACK_SECONDS.add((name, "cpu"), cpu)
+            CALLBACK_CALLS.add((name, outcome))
+            if wall > CALLBACK_PROFILE_THRESHOLD:
+                if profile is not None:
+                    _save_profile(name, profile, wall)
+                    _armed.discard(name)
+                else:
+                    _armed.add(name)
+            elif profile is not None:
+                _armed.discard(name) # Fast this time; re-armed if it's slow again
+            if verbose:
+                print(f"[CALLBACK-PROFILER] {name}: {outcome} in {wall:.3f}s wall, {cpu:.3f}s CPU")
+            if not has_request_context():
+                metrics.flush() # Background job processes are short-lived
+    return wrapper
+
+
+class _ProfiledApp:
+    """Stands in for the Dash app in register_callbacks; .callback() wraps each callback."""
+
+    def __init__(self, app):
+        self._app = app
+
+    def callback(self, *args, **kwargs):
+        register = self._app.callback(*args, **kwargs)
+        return lambda fn: register(_wrap(fn))
+
+    def __getattr__(self, name):
+        return getattr(self._app, name)
+
+
+def profiled(app):
+    """`app` with profiled callbacks, or `app` itself when CALLBACK_PROFILING_ENABLED is off."""
+    if not CALLBACK_PROFILING_ENABLED:
+        return app
+    _register_payload_hook(app.server)
+    return _ProfiledApp(app)
+
+
+def _register_payload_hook(server):
+    @server.after_request
+    def record_callback_payload(response):
+        name = g.get("callback_name")
+        if name is not None and not response.direct_passthrough:
+            CALLBACK_PAYLOAD_BYTES.add((name, "request"), request.content_length or 0)
+            CALLBACK_PAYLOAD_BYTES.add((name, "response"), response.calculate_content_length() or 0)
+        return response
+
+
+# --- Admin page ---
+
+def authorised():
+    """True when the request carries ADMIN_TOKEN (X-Admin-Token header or ?token=)."""
+    supplied = request.headers.get("X-Admin-Token") or request.args.get("token") or ""
+    return hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+
+def _fmt(value, unit):
+    if value is None:
+        return ""
+    if unit == "s":
+        return f"{value * 1000:.0f} ms" if value < 1 else f"{value:.2f} s"
+    return f"{value / 1024:.1f} KB" if value >= 1024 else f"{value:.0f} B"
+
+
+def _admin_page():
+    totals = metrics.merged()
+    seconds = totals["callback_seconds"]
+    payloads = totals["callback_payload_bytes"]
+    calls = totals["callback_calls_total"]
+    names = sorted({labels[0] for labels in seconds} | {labels[0] for labels in calls})
+
+    rows = []
+    for name in names:
+        wall = seconds.get((name, "wall"), [0, 0, []])[2]
+        cpu = seconds.get((name, "cpu"), [0, 0, []])[2]
+        sent = payloads.get((name, "response"), [0, 0, []])[2]
+        received = payloads.get((name, "request"), [0, 0, []])[2]
+        counts = {outcome: calls.get((name, outcome), [0])[0] for outcome in ("ok", "prevented", "error")}
+        cells = [html.escape(name), counts["ok"], counts["prevented"], counts["error"],
+                 *(_fmt(metrics.quantile(wall, q), "s") for q in metrics.SUMMARY_QUANTILES),
+                 _fmt(metrics.quantile(cpu, 0.5), "s"), _fmt(metrics.quantile(cpu, 0.9), "s"),
+                 _fmt(metrics.quantile(received, 0.5), "B"),
+                 _fmt(metrics.quantile(sent, 0.5), "B"), _fmt(metrics.quantile(sent, 0.9), "B")]
+        rows.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+
+    token = html.escape(request.args.get("token", ""), quote=True)
+    try:
+        stems = sorted({os.path.splitext(e.name)[0] for e in os.scandir(CALLBACK_PROFILE_DIR)}, reverse=True)
+    except OSError:
+        stems = []
+    profiles = "".join(f'<li><a href="/admin/callbacks/profiles/{html.escape(s)}.txt?token={token}">{html.escape(s)}</a>'
+                       f' (<a href="/admin/callbacks/profiles/{html.escape(s)}.prof?token={token}">.prof</a>)</li>'
+                       for s in stems)
+
+    headers = ["Callback", "OK", "Prevented", "Errors", "Wall p50", "Wall p90", "Wall p99",
+               "CPU p50", "CPU p90", "Request p50", "Response p50", "Response p90"]
+    return f"""<!doctype html>
+<html><head><title>Callback timings</title>
+<style>body{{font-family:sans-serif}} td,th{{padding:2px 10px;text-align:right}} td:first-child,th:first-child{{text-align:left}}</style>
+</head><body>
+<h3>Callback timings (last {CALLBACK_STATS_WINDOW} runs per worker, all workers)</h3>
+<table><tr>{"".join(f"<th>{h}</th>" for h in headers)}</tr>{"".join(rows)}</table>
+<h3>Profiles of runs over {CALLBACK_PROFILE_THRESHOLD:g} s</h3>
+<ul>{profiles or "<li>None yet</li>"}</ul>
+</body></html>"""
+
+
+def register_admin_routes(server):
+    """Adds /admin/callbacks (timings and profiles); it answers 404 unless ADMIN_TOKEN is set and supplied."""
+
+    @server.route("/admin/callbacks")
+    def admin_callbacks():
+        if not ADMIN_TOKEN or not authorised():
+            abort(404)
+        return Response(_admin_page(), mimetype="text/html")
+
+    @server.route("/admin/callbacks/profiles/<stem>.<ext>")
+    def admin_callback_profile(stem, ext):
+        if not ADMIN_TOKEN or not authorised():
+            abort(404)
+        if ext not in ("txt", "prof") or "/" in stem or stem.startswith("."):
+            abort(404)
+        path = os.path.join(CALLBACK_PROFILE_DIR, f"{stem}.{ext}")
+        if not os.path.isfile(path):
+            abort(404)
+        if ext == "txt":
+            return send_file(path, mimetype="text/plain")
+        return send_file(path, mimetype="application/octet-stream", as_attachment=True)
+
+    return admin_callbacks
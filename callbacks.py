@@ -12,7 +12,7 @@ from layout import (
     serve_quick_reference_rainfall_summary_layout, serve_quick_reference_river_flow_status_layout, 
     serve_quick_reference_air_quality_report_layout,serve_quick_reference_waiwhakaiho_report_layout,
     serve_map_page_layout,serve_quick_reference_waiwhakaiho_egmont_village_layout,
-    serve_datasets_page_layout, create_dataset_display,
+    serve_datasets_page_layout, create_dataset_display, dataset_figure,
     serve_charts_page_layout, serve_reports_page_layout
 )
 from data_processing import (
@@ -20,11 +20,19 @@ from data_processing import (
     get_dataset_site_options, get_dataset_data_for_display,
     get_rainfall_summary_data, get_flow_status_data
 )
+from geojson_utils import build_site_geojson, encode_for_map
+from dataset_store import DATASET_STORE, DOWNLOAD_FORMATS, download_url
+from callback_profiler import profiled
 from constants import MEASUREMENTS_FOR_MAPS_AND_DATASETS 
 
 
-def register_callbacks(app):
-    """Registers all callbacks with the Dash app."""
+def register_callbacks(app, background_manager=None):
+    """
+    Registers all callbacks with the Dash app. With a background_manager,
+    dataset loads run as background callbacks with progress and cancellation.
+    """
+    # Every callback's wall/CPU time and payload sizes are recorded (see callback_profiler.py)
+    app = profiled(app)
 
     # Callback for Navbar Toggler (No Change)
     @app.callback(
@@ -123,9 +131,10 @@ def register_callbacks(app):
         print(f"{log_prefix}: Returning options: {options}, value: {value}")
         return options, value
 
-    # Callback to process data and store it in dcc.Store (remains unchanged)
+    # Callback to process data and hand it straight to the map's GeoJSON layer
     @app.callback(
-        Output("map-marker-data-store", "data"),
+        Output("marker-layer", "data"),
+        Output("marker-layer", "hideout"),  # Measurement label used in the client-side popups
         Output("loading-map", "children"),  # Add loading output
         Input("map-measurement-dropdown", "value"),
         Input("map-time-period-dropdown", "value")
@@ -135,34 +144,18 @@ def register_callbacks(app):
         print(f"{log_prefix}: Triggered with: Measurement='{selected_measurement}', TimePeriod='{selected_time_period}'")
 
         if not selected_measurement or not selected_time_period:
-            print(f"{log_prefix}: Inputs incomplete. Storing empty data.")
-            return []
+            print(f"{log_prefix}: Inputs incomplete. Clearing the map layer.")
+            return encode_for_map(build_site_geojson([])), dash.no_update, dash.no_update
 
-        markers = process_map_data_2(selected_measurement, selected_time_period)
+        feature_collection = process_map_data_2(selected_measurement, selected_time_period)
 
-        if not markers:
-            print(f"{log_prefix}: No markers with valid data. Storing empty data.")
-            return [], dash.no_update
+        if not feature_collection["features"]:
+            print(f"{log_prefix}: No markers with valid data. Clearing the map layer.")
+            return encode_for_map(feature_collection), {"label": selected_measurement}, dash.no_update
 
-        print(f"{log_prefix}: Storing {len(markers)} markers in dcc.Store.")
-        return markers, dash.no_update
-
-    # NEW CALLBACK: To render/clear the entire map overlay based on stored data
-    # Fix the callback name (missing 'y' in 'dynamically')
-    @app.callback(
-        Output("dynamic-map-overlay-container", "children"),
-        Input("map-marker-data-store", "data"),
-        prevent_initial_call=True
-    )
-    def render_map_overlay_dynamically(stored_markers_data):
-        log_prefix = "[RENDER-MAP-OVERLAY-DYNAMICALLY]"
-        
-        if not stored_markers_data or len(stored_markers_data) == 0:
-            # Return an empty LayerGroup to clear the map
-            return None
-        
-        # Return the overlay with markers
-        return dl.LayerGroup(children=stored_markers_data, id="marker-layer")
+        # One compact FeatureCollection (geobuf-encoded when available) instead of a component per site
+        print(f"{log_prefix}: Sending {len(feature_collection['features'])} sites to the map layer.")
+        return encode_for_map(feature_collection), {"label": selected_measurement}, dash.no_update
 
     # ... (rest of your callbacks for Datasets Page)
     # --- Callbacks for Datasets Page --- (No Change)
@@ -174,51 +167,116 @@ def register_callbacks(app):
     def update_dataset_site_options(selected_measurement):
         return get_dataset_site_options(selected_measurement)
 
-    @app.callback(
-        Output('dataset-output-container', 'children'),
-        Output('download-csv-btn', 'disabled'),
-        Output('hilltop-data-store', 'data'),
-        Input('load-dataset-btn', 'n_clicks'),
-        State('dataset-measurement-dropdown', 'value'),
-        State('dataset-date-range-picker', 'start_date'),
-        State('dataset-date-range-picker', 'end_date'),
-        State('dataset-site-dropdown', 'value'),
-        prevent_initial_call=True
-    )
-    def load_dataset(n_clicks, selected_measurement, start_date, end_date, selected_sites):
+    def _load_dataset(set_progress, n_clicks, selected_measurement, start_date, end_date, selected_sites):
         if not n_clicks:
             raise dash.exceptions.PreventUpdate
 
         if not selected_measurement or not selected_sites or not start_date or not end_date:
-            return (dbc.Alert("Please select all options to load data.", color="info"), True, None)
+            return (dbc.Alert("Please select all options to load data.", color="info"), True, None, None, None, True)
 
         if not MEASUREMENTS_FOR_MAPS_AND_DATASETS:
-            return (dbc.Alert("Site and measurement data not loaded. Check Hilltop connection.", color="danger"), True, None)
+            return (dbc.Alert("Site and measurement data not loaded. Check Hilltop connection.", color="danger"), True, None, None, None, True)
+
+        def progress(done, total, frames):
+            # "12/30 sites loaded" plus a chart of what has arrived so far
+            partial = None
+            if frames:
+                partial = dcc.Graph(id='dataset-partial-graph',
+                                    figure=dataset_figure(pd.concat(frames, ignore_index=True), selected_measurement))
+            set_progress((f"{done}/{total} sites loaded", int(100 * done / total), partial))
 
         combined_df, data_found = get_dataset_data_for_display(
-            selected_measurement, selected_sites, start_date, end_date
+            selected_measurement, selected_sites, start_date, end_date,
+            progress=progress if set_progress is not None else None
         )
         
+        if not data_found and combined_df.attrs.get("failed_sites"):
+            return (dbc.Alert("Could not load data from Hilltop. Please try again.", color="danger"), True, None, None, None, True)
         if not data_found:
-            return (dbc.Alert("No data found for the selected criteria.", color="warning"), True, None)
+            return (dbc.Alert("No data found for the selected criteria.", color="warning"), True, None, None, None, True)
 
-        data_to_store = combined_df.to_json(date_format='iso', orient='split')
+        # The data stays on the server; the browser only gets a token and download links
+        filename = f"{selected_measurement.replace(' ', '_').replace('(', '').replace(')', '')}_data"
+        token = DATASET_STORE.put(combined_df, {"measurement": selected_measurement, "filename": filename})
+        print(f"Stored dataset {token} ({filename}) with {len(combined_df)} rows.")
 
         return (create_dataset_display(combined_df, selected_measurement, selected_sites, start_date, end_date), 
                 False, 
-                data_to_store)
+                token,
+                download_url(token, "csv"),
+                download_url(token, "parquet") if "parquet" in DOWNLOAD_FORMATS else None,
+                "parquet" not in DOWNLOAD_FORMATS)
+
+    load_dataset_outputs = [
+        Output('dataset-output-container', 'children'),
+        Output('download-csv-btn', 'disabled'),
+        Output('hilltop-data-store', 'data'),
+        Output('download-csv-btn', 'href'),
+        Output('download-parquet-btn', 'href'),
+        Output('download-parquet-btn', 'disabled'),
+        Input('load-dataset-btn', 'n_clicks'),
+        State('dataset-measurement-dropdown', 'value'),
+        State('dataset-date-range-picker', 'start_date'),
+        State('dataset-date-range-picker', 'end_date'),
+        State('dataset-site-dropdown', 'value'),
+    ]
+
+    if background_manager is not None:
+        # Runs in a worker process: the button is disabled and progress shown while
+        # it runs, and changing the selection cancels a load that's no longer wanted
+        @app.callback(
+            *load_dataset_outputs,
+            background=True,
+            manager=background_manager,
+            progress=[
+                Output('dataset-progress-text', 'children'),
+                Output('dataset-progress-bar', 'value'),
+                Output('dataset-partial-output', 'children'),
+            ],
+            running=[
+                (Output('load-dataset-btn', 'disabled'), True, False),
+                (Output('dataset-progress', 'style'), {'display': 'block'}, {'display': 'none'}),
+            ],
+            cancel=[
+                Input('dataset-measurement-dropdown', 'value'),
+                Input('dataset-site-dropdown', 'value'),
+                Input('dataset-date-range-picker', 'start_date'),
+                Input('dataset-date-range-picker', 'end_date'),
+            ],
+            prevent_initial_call=True
+        )
+        def load_dataset(set_progress, n_clicks, selected_measurement, start_date, end_date, selected_sites):
+            return _load_dataset(set_progress, n_clicks, selected_measurement, start_date, end_date, selected_sites)
+    else:
+        @app.callback(*load_dataset_outputs, prevent_initial_call=True)
+        def load_dataset(n_clicks, selected_measurement, start_date, end_date, selected_sites):
+            return _load_dataset(None, n_clicks, selected_measurement, start_date, end_date, selected_sites)
 
     @app.callback(
-        Output("download-dataframe-csv", "data"),
-        Input("download-csv-btn", "n_clicks"),
-        State("hilltop-data-store", "data"),
-        State("dataset-measurement-dropdown", "value"),
-        prevent_initial_call=True,
+        Output('dataset-graph', 'figure'),
+        Input('dataset-graph', 'relayoutData'),
+        State('hilltop-data-store', 'data'),
+        State('dataset-measurement-dropdown', 'value'),
+        prevent_initial_call=True
     )
-    def download_csv(n_clicks, stored_data, selected_measurement):
-        if not n_clicks or not stored_data:
+    def resample_dataset_graph(relayout_data, token, selected_measurement):
+        """Re-draws the dataset chart at full available resolution for the zoomed window."""
+        log_prefix = "[RESAMPLE-DATASET-GRAPH]"
+        if not relayout_data or not token:
             raise dash.exceptions.PreventUpdate
-        df = pd.read_json(io.StringIO(stored_data), orient='split')
-        filename = f"{selected_measurement.replace(' ', '_').replace('(', '').replace(')', '')}_data.csv"
-        print(f"Preparing to download {filename} with {len(df)} rows.")
-        return dcc.send_data_frame(df.to_csv, filename=filename)
\ No newline at end of file
+
+        if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+            x_range = (pd.Timestamp(relayout_data['xaxis.range[0]']), pd.Timestamp(relayout_data['xaxis.range[1]']))
+        elif 'xaxis.range' in relayout_data:
+            x_range = tuple(pd.Timestamp(t) for t in relayout_data['xaxis.range'])
+        elif relayout_data.get('xaxis.autorange'):
+            x_range = None # Zoomed back out: whole dataset
+        else:
+            raise dash.exceptions.PreventUpdate # y-only zoom, legend clicks, ...
+
+        stored = DATASET_STORE.get(token)
+        if stored is None:
+            raise dash.exceptions.PreventUpdate # Dataset expired; keep the current figure
+        combined_df, _ = stored
+        print(f"{log_prefix}: Re-sampling {token} for {x_range or 'full range'}")
+        return dataset_figure(combined_df, selected_measurement, x_range=x_range)
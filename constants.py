@@ -1,14 +1,115 @@
 # constants.py
-from hilltoppy import Hilltop
+import os
 import dash_bootstrap_components as dbc
 from datetime import datetime, timedelta
 
 # --- Hilltop API Configuration ---
-TRC_HILLTOP_BASE_URL = 'https://extranet.trc.govt.nz/getdata/' 
-TRC_HILLTOP_HTS_FILE = 'boo.hts' # Or 'boo.hts' if that's the correct one
+# HILLTOP_BASE_URL points the app at another server, e.g. hilltop_stub.py for local work
+TRC_HILLTOP_BASE_URL = os.environ.get("HILLTOP_BASE_URL", 'https://extranet.trc.govt.nz/getdata/')
+TRC_HILLTOP_HTS_FILE = os.environ.get("HILLTOP_HTS_FILE", 'boo.hts') # Or 'boo.hts' if that's the correct one
 BASE = f"{TRC_HILLTOP_BASE_URL}{TRC_HILLTOP_HTS_FILE}"
 
-DF_SITES = Hilltop(TRC_HILLTOP_BASE_URL, TRC_HILLTOP_HTS_FILE).get_site_list(location='LatLong').dropna()
+# --- Local cache / snapshot files ---
+CACHE_DIR = os.environ.get("ENV_DASH_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+SITE_REGISTRY_SNAPSHOT = os.path.join(CACHE_DIR, "site_registry.json")
+SITE_REGISTRY_MAX_AGE = timedelta(hours=24) # Older snapshots are served, then refreshed in the background
+
+# --- Hilltop HTTP transport (see hilltop_http.py) ---
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HILLTOP_HTTP_POOL_CONNECTIONS", 4))  # Hosts to keep a pool for
+HTTP_POOL_MAXSIZE = int(os.environ.get("HILLTOP_HTTP_POOL_MAXSIZE", 16))         # Keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HILLTOP_HTTP_CONNECT_TIMEOUT", 5))   # seconds
+HTTP_READ_TIMEOUT = float(os.environ.get("HILLTOP_HTTP_READ_TIMEOUT", 60))        # seconds
+HTTP_MAX_RETRIES = int(os.environ.get("HILLTOP_HTTP_MAX_RETRIES", 2))            # Connect errors / 502-504 only
+
+# --- Record/replay of Hilltop traffic (see hilltop_cassette.py) ---
+HILLTOP_CASSETTE_MODE = os.environ.get("HILLTOP_CASSETTE_MODE", "") # "record", "replay", or "" for live traffic
+HILLTOP_CASSETTE_DIR = os.environ.get("HILLTOP_CASSETTE_DIR", os.path.join(CACHE_DIR, "cassettes", "default"))
+HILLTOP_REPLAY_SPEED = float(os.environ.get("HILLTOP_REPLAY_SPEED", "1")) # 1 = recorded timing, 10 = ten times faster, 0 = no delays
+
+# --- In-memory time series cache (see timeseries_cache.py) ---
+TIMESERIES_CACHE_MAX_BYTES = int(os.environ.get("TIMESERIES_CACHE_MAX_MB", 256)) * 1024 * 1024
+TIMESERIES_CACHE_NOW_TTL = int(os.environ.get("TIMESERIES_CACHE_NOW_TTL", 300)) # seconds before data up to "now" is re-fetched
+TIMESERIES_CACHE_LIVE_LAG = int(os.environ.get("TIMESERIES_CACHE_LIVE_LAG", 3600)) # seconds behind "now" readings may still arrive (re-fetched with it)
+
+# --- Rollup pyramid of hourly/daily/monthly/annual aggregates (see rollups.py) ---
+ROLLUP_MAX_SERIES = int(os.environ.get("ROLLUP_MAX_SERIES", 500)) # Least recently used series are dropped beyond this
+
+# --- Concurrent fetching (see fetch_engine.py) ---
+FETCH_MAX_WORKERS = int(os.environ.get("HILLTOP_FETCH_MAX_WORKERS", 8))     # Threads per batch of requests
+FETCH_PER_HOST_LIMIT = int(os.environ.get("HILLTOP_FETCH_PER_HOST", 6))     # In-flight requests per host, process-wide
+
+# --- Request planner (see request_planner.py) ---
+PLANNER_MAX_URL_LENGTH = int(os.environ.get("HILLTOP_MAX_URL_LENGTH", 2000))    # Stay well under common 4-8 KB server limits
+PLANNER_MAX_SITES_PER_CALL = int(os.environ.get("HILLTOP_MAX_SITES_PER_CALL", 40)) # Keeps each DataTable query reasonably quick
+
+# --- Background RecentDataTable pollers (see recent_poller.py) ---
+RECENT_POLL_COLLECTIONS = ["WebRivers", "WebRainfall", "WebAirTemp"]
+RECENT_POLL_ENABLED = os.environ.get("RECENT_POLL_ENABLED", "1") not in ("0", "false", "False", "")
+RECENT_POLL_INTERVAL = int(os.environ.get("RECENT_POLL_INTERVAL", 60)) # Seconds between RecentDataTable calls per collection
+RECENT_POLL_MAX_AGE = int(os.environ.get("RECENT_POLL_MAX_AGE", 5 * RECENT_POLL_INTERVAL)) # Older snapshots fall back to a direct fetch
+RECENT_POLL_SNAPSHOT_DIR = os.path.join(CACHE_DIR, "recent") # Published snapshots, read by processes that don't poll
+
+# --- On-disk time series store (see timeseries_store.py) ---
+TIMESERIES_STORE_ENABLED = os.environ.get("TIMESERIES_STORE_ENABLED", "1") not in ("0", "false", "False", "")
+TIMESERIES_STORE_PATH = os.path.join(CACHE_DIR, "timeseries.sqlite")
+TIMESERIES_STORE_SETTLE = timedelta(days=int(os.environ.get("TIMESERIES_STORE_SETTLE_DAYS", 2))) # Newer data is always fetched live
+
+# --- Server-side datasets and downloads (see dataset_store.py) ---
+DATASET_STORE_DIR = os.path.join(CACHE_DIR, "datasets")
+DATASET_STORE_TTL = int(os.environ.get("DATASET_STORE_TTL", 3600)) # seconds a loaded dataset stays downloadable
+DATASET_STORE_MAX_BYTES = int(os.environ.get("DATASET_STORE_MAX_MB", 512)) * 1024 * 1024
+DATASET_CSV_CHUNK_ROWS = 50_000 # Rows per chunk when streaming CSV downloads
+
+# --- Chart downsampling (see downsampling.py) ---
+DOWNSAMPLE_TARGET_POINTS = int(os.environ.get("DOWNSAMPLE_TARGET_POINTS", 2000)) # Per series; about 2 per pixel of a full-width chart
+DOWNSAMPLE_METHOD = os.environ.get("DOWNSAMPLE_METHOD", "lttb") # "lttb" (keeps bucket peaks) or "minmax"
+SCATTERGL_THRESHOLD = 1000 # Series with more points than this are drawn with WebGL
+
+# --- Flask-Caching memoization of data_processing results (see cache.py) ---
+APP_CACHE_CONFIG = {
+    "CACHE_TYPE": os.environ.get("APP_CACHE_TYPE", "FileSystemCache"), # Shared by all workers; "SimpleCache" for one process
+    "CACHE_DIR": os.path.join(CACHE_DIR, "flask_cache"),
+    "CACHE_DEFAULT_TIMEOUT": 300,
+    "CACHE_THRESHOLD": 2000,
+}
+if os.environ.get("APP_CACHE_REDIS_URL"):
+    APP_CACHE_CONFIG["CACHE_REDIS_URL"] = os.environ["APP_CACHE_REDIS_URL"]
+# (fresh seconds, extra seconds served stale while refreshing), aligned to how often the data changes
+MAP_DATA_TTL = (60, 300)            # RecentDataTable pollers run every minute
+QUICK_REFERENCE_TTL = (300, 900)    # 5-15 minute sensor reporting interval
+DATASET_TTL = (900, 3600)           # Mostly history; recent edge refreshes every 15 minutes
+
+# --- Measurement/site configuration snapshot shared by workers (see startup.py) ---
+CONFIG_SNAPSHOT_ENABLED = os.environ.get("CONFIG_SNAPSHOT_ENABLED", "1") not in ("0", "false", "False", "")
+CONFIG_SNAPSHOT_PATH = os.environ.get("CONFIG_SNAPSHOT_PATH", os.path.join(CACHE_DIR, "measurement_config.pkl"))
+CONFIG_SNAPSHOT_MAX_AGE = timedelta(hours=int(os.environ.get("CONFIG_SNAPSHOT_MAX_AGE_HOURS", "24"))) # Older snapshots are rebuilt
+
+# --- Hilltop call and cache metrics on /metrics (see metrics.py) ---
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") not in ("0", "false", "False", "")
+METRICS_DIR = os.path.join(CACHE_DIR, "metrics") # One file per worker, added up by /metrics
+METRICS_FLUSH_INTERVAL = 15     # Seconds between writes of a worker's metrics file
+METRICS_FILE_MAX_AGE = 86400    # Files of workers that stopped this long ago are dropped
+
+# --- Per-callback timing and profiling (see callback_profiler.py) ---
+CALLBACK_PROFILING_ENABLED = os.environ.get("CALLBACK_PROFILING_ENABLED", "1") not in ("0", "false", "False", "")
+CALLBACK_STATS_WINDOW = 500         # Runs per callback (per worker) the percentiles are taken over
+CALLBACK_PROFILE_THRESHOLD = float(os.environ.get("CALLBACK_PROFILE_THRESHOLD", "2.0")) # Seconds; slower runs arm cProfile
+CALLBACK_PROFILE_ALL = os.environ.get("CALLBACK_PROFILE_ALL", "0") not in ("0", "false", "False", "")
+CALLBACK_PROFILE_DIR = os.path.join(CACHE_DIR, "profiles")
+CALLBACK_PROFILE_KEEP = 50          # Newest profiles kept
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "") # /admin pages are off unless this is set
+
+# --- Request tracing (see tracing.py) ---
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") not in ("0", "false", "False", "")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0")) # Share of callback requests traced
+TRACE_KEEP = 200                    # Recent traces kept in memory per worker for /admin/traces
+TRACE_OTLP_FILE = os.environ.get("TRACE_OTLP_FILE", "") # OTLP/JSON lines file; unset means in-memory only
+
+# --- Background callbacks for long dataset loads (see cache.py) ---
+BACKGROUND_CALLBACKS_ENABLED = os.environ.get("BACKGROUND_CALLBACKS_ENABLED", "1") not in ("0", "false", "False", "")
+BACKGROUND_CACHE_DIR = os.path.join(CACHE_DIR, "background")
+
+# DF_SITES is resolved lazily from the shared site registry (see __getattr__ at the bottom)
 
 # --- App Styling ---
 SIDEBAR_STYLE = {
@@ -63,6 +164,7 @@ TIME_PERIOD_OPTIONS_INSTANTANEOUS = [
 # --- Map Configuration ---
 TARANAKI_MAP_CENTER = [-39.2, 174.2] # Approximate center of Taranaki
 DEFAULT_MAP_ZOOM = 9
+MAP_GEOBUF = os.environ.get("MAP_GEOBUF", "1") not in ("0", "false", "False", "") # Send map points geobuf-encoded when geobuf is installed
 
 # --- Dummy Data for Hilltop Connection Errors (for robustness) ---
 # Use these if fetch_site_list fails, so the app still loads
@@ -74,4 +176,12 @@ DUMMY_RAINFALL_SITES = [
 DUMMY_FLOW_SITES = [
     {'SiteName': 'Manganui River (Flow)', 'Latitude': -39.300, 'Longitude': 174.350},
     {'SiteName': 'Waingongoro River (Flow)', 'Latitude': -39.450, 'Longitude': 174.200},
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    # Keeps `from constants import DF_SITES` working without a Hilltop call at import time
+    if name == "DF_SITES":
+        from site_registry import SITE_REGISTRY
+        return SITE_REGISTRY.sites()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -8,82 +8,107 @@ from urllib.parse import quote
 
 from hilltop_api import (fetch_data,
                          fetch_measurement_list,
-                         fetch_data_table_for_custom_collection)
+                         fetch_data_table_for_custom_collection,
+                         latest_valid_by_key)
+from request_planner import HilltopRequest, iter_batch, fetch_collection_table
+from recent_poller import latest_values
+from geojson_utils import build_site_geojson
+from cache import memoize
+from tracing import span, traced
 from constants import (
     MEASUREMENTS_FOR_MAPS_AND_DATASETS, 
     TIME_PERIOD_OPTIONS_INCREMENTAL, 
-    TIME_PERIOD_OPTIONS_INSTANTANEOUS
+    TIME_PERIOD_OPTIONS_INSTANTANEOUS,
+    MAP_DATA_TTL, QUICK_REFERENCE_TTL, DATASET_TTL
 )
 
 
 # Chose whether to see all the print statements
 verbose=False # Default is False
 
+# Per-site properties sent to the browser for the map's GeoJSON layer; the marker
+# and its popup are built from these client-side (see assets/map_layer.js)
+MAP_FEATURE_PROPERTIES = ["value", "color"]
+
 # --- Helper to get data for Quick Reference Pages ---
 
 def get_rainfall_summary_data(sitename='Manganui at Everett Park'):
     """Fetches and processes data for the Taranaki Rainfall Summary."""
     try:
-        site = sitename # Example site, replace with dynamic logic
-        measurement = 'Rainfall'
-        start_date = (datetime.now() - timedelta(days=7)).isoformat()
-        end_date = datetime.now().isoformat()
-        
-        # Use fetch_data from hilltop_api with rainfall processing
-        data_dict = fetch_data(site, measurement, start_date, end_date, process_as_rainfall=True)
-        
-        if data_dict and "hourly_totals" in data_dict:
-            df = data_dict["hourly_totals"]
-            df.columns = ['DateTime','Rainfall (mm)']
-            df['DateTime'] = pd.to_datetime(df['DateTime'])
-            return df
-        else:
-            if verbose:
-                print(f"No hourly rainfall data for {site}.")
-            return pd.DataFrame(columns=['DateTime','Rainfall (mm)'])
+        return _rainfall_summary_data(sitename)
     except Exception as e:
         if verbose:
             print(f"[DP-GET-RAINFALL-SUMMARY] Error in get_rainfall_summary_data: {e}")
         return pd.DataFrame(columns=['DateTime','Rainfall (mm)'])
 
+# Errors propagate out of the memoized helpers so the fallbacks above/below are
+# never cached (or written over a good stale value by a background refresh)
+@memoize(*QUICK_REFERENCE_TTL)
+def _rainfall_summary_data(sitename):
+    site = sitename # Example site, replace with dynamic logic
+    measurement = 'Rainfall'
+    start_date = (datetime.now() - timedelta(days=7)).isoformat()
+    end_date = datetime.now().isoformat()
+    
+    # Use fetch_data from hilltop_api with rainfall processing
+    data_dict = fetch_data(site, measurement, start_date, end_date, process_as_rainfall=True)
+    
+    if data_dict and "hourly_totals" in data_dict:
+        df = data_dict["hourly_totals"]
+        df.columns = ['DateTime','Rainfall (mm)']
+        df['DateTime'] = pd.to_datetime(df['DateTime'])
+        return df
+    else:
+        if verbose:
+            print(f"No hourly rainfall data for {site}.")
+        return pd.DataFrame(columns=['DateTime','Rainfall (mm)'])
+
+def _mean_annual_flood(site):
+    if site == "Waiwhakaiho at Egmont Village":
+        return 337.319 # m3/s
+    elif site == "Patea at Skinner Rd":
+        return 158.318 # m3/s
+    else:
+        return 100.0
+
 def get_flow_status_data(sitename="Patea at Skinner Rd"):
     """Fetches and processes data for the River Flow Status quick reference page."""
+    log_prefix = "[DP-GET-FLOW-STATUS-DATA]"
+    try:
+        return _flow_status_data(sitename)
+    except Exception as e:
+        if verbose:
+            print(f"{log_prefix} Error in get_flow_status_data: {e}")
+        return pd.DataFrame(columns=['DateTime', 'Flow (m³/s)']), 'N/A', "Unavailable", _mean_annual_flood(sitename)
+
+@memoize(*QUICK_REFERENCE_TTL)
+def _flow_status_data(sitename):
     log_prefix = "[DP-GET-FLOW-STATUS-DATA]"
     flow_data = pd.DataFrame(columns=['DateTime', 'Flow (m³/s)'])
     latest_flow_value = 'N/A'
     flow_status_text = "Unavailable"
 
-    try:
-        site = sitename # Example site, replace with dynamic logic
-        measurement = 'Flow'
-        if site == "Waiwhakaiho at Egmont Village":
-            mean_annual_flood = 337.319 # m3/s
-        elif site == "Patea at Skinner Rd":
-            mean_annual_flood = 158.318 # m3/s
-        else:
-            mean_annual_flood = 100.0
-        start_date = (datetime.now() - timedelta(days=7)).isoformat() # Last 48 hrs for graph
-        end_date = datetime.now().isoformat()
-        
-        data_dict = fetch_data(site, measurement, start_date, end_date, process_as_rainfall=False)
-        
-        if data_dict and "raw_data" in data_dict:
-            df = data_dict["raw_data"]
-            df = df[['time', 'Value']].rename(columns={'time': 'DateTime', 'Value': 'Flow (m³/s)'})
-            df['DateTime'] = pd.to_datetime(df['DateTime'])
-            #df.set_index('DateTime', inplace=True)
-            
-            if not df.empty:
-                flow_data = df
-                latest_flow_value = flow_data['Flow (m³/s)'].iloc[-1] # Latest flow value
-                if isinstance(latest_flow_value, (int, float)):
-                    if latest_flow_value > mean_annual_flood: flow_status_text = "Greater than mean annual flood flow"
-                    elif latest_flow_value < 5: flow_status_text = "Low"
-                    else: flow_status_text = "Normal"
+    site = sitename # Example site, replace with dynamic logic
+    measurement = 'Flow'
+    mean_annual_flood = _mean_annual_flood(site)
+    start_date = (datetime.now() - timedelta(days=7)).isoformat() # Last 48 hrs for graph
+    end_date = datetime.now().isoformat()
+    
+    data_dict = fetch_data(site, measurement, start_date, end_date, process_as_rainfall=False)
+    
+    if data_dict and "raw_data" in data_dict:
+        df = data_dict["raw_data"]
+        df = df[['time', 'Value']].rename(columns={'time': 'DateTime', 'Value': 'Flow (m³/s)'})
+        df['DateTime'] = pd.to_datetime(df['DateTime'])
+        #df.set_index('DateTime', inplace=True)
         
-    except Exception as e:
-        if verbose:
-            print(f"{log_prefix} Error in get_flow_status_data: {e}")
+        if not df.empty:
+            flow_data = df
+            latest_flow_value = flow_data['Flow (m³/s)'].iloc[-1] # Latest flow value
+            if isinstance(latest_flow_value, (int, float)):
+                if latest_flow_value > mean_annual_flood: flow_status_text = "Greater than mean annual flood flow"
+                elif latest_flow_value < 5: flow_status_text = "Low"
+                else: flow_status_text = "Normal"
 
     if verbose:
         print(f"{log_prefix} Flow data fetched for {site}: {len(flow_data)} records, latest value: {latest_flow_value}, status: {flow_status_text}")
@@ -370,22 +395,31 @@ def process_map_data(selected_measurement, selected_time_period):
 
     return map_markers
 
+def _map_feature_collection(map_markers):
+    """Site marker dicts -> the GeoJSON FeatureCollection rendered by the map's dl.GeoJSON layer."""
+    return build_site_geojson(map_markers, properties=MAP_FEATURE_PROPERTIES)
+
+
+@traced()
+@memoize(*MAP_DATA_TTL)
 def process_map_data_2(selected_measurement, selected_time_period):
     """
     Fetches and processes data for map display markers.
-    Returns a list of dl.CircleMarker components.
+    Returns a GeoJSON FeatureCollection, one point per site, whose properties
+    (name, value, color) are turned into circle markers with popups in the
+    browser by assets/map_layer.js.
     """
     verbose = globals().get('verbose', False)
     log_prefix = "[DP-PROCESS-MAP-DATA-2]"
     map_markers = []
     if not selected_measurement or not selected_time_period:
         if verbose: print(f"{log_prefix} Incomplete selection: {selected_measurement}, {selected_time_period}. Returning empty markers.")
-        return map_markers
+        return _map_feature_collection(map_markers)
 
     measurement_info = MEASUREMENTS_FOR_MAPS_AND_DATASETS.get(selected_measurement)
     if not measurement_info:
         if verbose: print(f"{log_prefix} No measurement info for: {selected_measurement}. Returning empty markers.")
-        return map_markers
+        return _map_feature_collection(map_markers)
 
     if verbose:
         print(f"\n{log_prefix} --- START PROCESSING FOR: {selected_measurement} ({selected_time_period}) ---")
@@ -401,90 +435,83 @@ def process_map_data_2(selected_measurement, selected_time_period):
     interval = measurement_info["interval"]
     is_incremental = measurement_info["is_incremental"]
 
-    end_date = datetime.now()
-    start_date = datetime.now() - timedelta(days=2) # This is a fixed window for all requests
+    # Instantaneous measurements come straight from the background RecentDataTable
+    # poller's snapshot; aggregated ones (and a missing/stale snapshot) fetch as before.
+    df_most_recent = None
+    if not method and measurement_info.get("collection"):
+        with span("poller snapshot", collection=measurement_info["collection"]):
+            df_most_recent = latest_values(measurement_info["collection"], measurements_str)
+        if verbose: print(f"{log_prefix}: Poller snapshot for {measurement_info['collection']}: {'hit' if df_most_recent is not None else 'miss'}")
 
-    result = ','.join(sites_base_df['SiteName'])
-    sitenames_quoted = quote(result)
-    measurements_quoted = quote(measurements_str)
-    
-    if verbose:
-        print(f"{log_prefix}: Requesting data for sites: {sites_base_df['SiteName'].tolist()}")
-        print(f"{log_prefix}: Requesting data for measures: {measurements_str}")
-        print(f"{log_prefix}: Using method: '{method}', interval: '{interval}'")
-        print(f"{log_prefix}: Date range: {start_date.isoformat()} to {end_date.isoformat()}")
-
-    df_fetched_raw = fetch_data_table_for_custom_collection(
-        sitenames_quoted,
-        measurements_quoted,
-        from_date=start_date,
-        to_date=end_date,
-        method=method,
-        interval=interval
-    )
+    if df_most_recent is None:
+        end_date = datetime.now()
+        start_date = datetime.now() - timedelta(days=2) # This is a fixed window for all requests
+
+        if verbose:
+            print(f"{log_prefix}: Requesting data for sites: {sites_base_df['SiteName'].tolist()}")
+            print(f"{log_prefix}: Requesting data for measures: {measurements_str}")
+            print(f"{log_prefix}: Using method: '{method}', interval: '{interval}'")
+            print(f"{log_prefix}: Date range: {start_date.isoformat()} to {end_date.isoformat()}")
+
+        # Large collections are split into size-bounded chunks fetched in parallel
+        df_fetched_raw = fetch_collection_table(
+            sites_base_df['SiteName'].tolist(),
+            measurements_str,
+            from_date=start_date,
+            to_date=end_date,
+            method=method,
+            interval=interval
+        )
     
-    if df_fetched_raw.empty:
-        if verbose: 
-            print(f"{log_prefix}: No raw data fetched for {selected_measurement}. Showing sites without data.")
+        if df_fetched_raw.empty:
+            if verbose: 
+                print(f"{log_prefix}: No raw data fetched for {selected_measurement}. Showing sites without data.")
         
-            # Create markers for all sites with no data (grey)
-            for _, site in sites_base_df.iterrows():
-                map_markers.append(
-                    dl.CircleMarker(
-                        center=[site['Latitude'], site['Longitude']],
-                        radius=4,
-                        color='grey',
-                        fillColor='grey',
-                        fillOpacity=0.5,
-                        children=[dl.Popup(content=f"<b>{site['SiteName']}</b><br>No data available")],
-                        key=f"{site['SiteName']}-no-data"
-                    )
-                )
-            return map_markers  # Return early with grey markers
+                # Create markers for all sites with no data (grey)
+                for _, site in sites_base_df.iterrows():
+                    map_markers.append({
+                        "SiteName": site['SiteName'],
+                        "Latitude": site['Latitude'],
+                        "Longitude": site['Longitude'],
+                        "value": None, # Drawn small and grey, with a "No data available" popup
+                        "color": 'grey',
+                    })
+                return _map_feature_collection(map_markers)  # Return early with grey markers
     
-    # Continue processing to show grey markers for all sites
+        # Continue processing to show grey markers for all sites
 
-    if verbose:
-        print(f"{log_prefix}: Raw fetched data columns: {df_fetched_raw.columns.tolist()}")
-        print(f"{log_prefix}: Raw fetched data head:\n{df_fetched_raw.head()}")
+        if verbose:
+            print(f"{log_prefix}: Raw fetched data columns: {df_fetched_raw.columns.tolist()}")
+            print(f"{log_prefix}: Raw fetched data head:\n{df_fetched_raw.head()}")
     
-    # Standardize 'M1' if 'M2' contains the primary data for Rainfall as per app.py logic
-    if hilltop_measurement_name == "Rainfall": # Based on app.py, Rainfall uses M1 or M2
-        if 'M2' in df_fetched_raw.columns:
-            df_fetched_raw['M1'] = df_fetched_raw['M1'].combine_first(df_fetched_raw['M2'])
-            if verbose: print(f"{log_prefix}: Combined M1 and M2 for Rainfall.")
-        df_processed = df_fetched_raw[["SiteName", "Time", "M1"]]
-    else:
-        # For other measurements, assume M1 is the relevant column
-        if 'M1' in df_fetched_raw.columns:
+        # Standardize 'M1' if 'M2' contains the primary data for Rainfall as per app.py logic
+        if hilltop_measurement_name == "Rainfall": # Based on app.py, Rainfall uses M1 or M2
+            if 'M2' in df_fetched_raw.columns:
+                df_fetched_raw['M1'] = df_fetched_raw['M1'].combine_first(df_fetched_raw['M2'])
+                if verbose: print(f"{log_prefix}: Combined M1 and M2 for Rainfall.")
             df_processed = df_fetched_raw[["SiteName", "Time", "M1"]]
         else:
-            if verbose: print(f"{log_prefix}: 'M1' column not found for {selected_measurement}. Available columns: {df_fetched_raw.columns.tolist()}")
-            return map_markers # Cannot proceed without M1
-
-    # Get the last valid reading for 'M1' for each site
-    # This needs to handle potential NaNs correctly
-    # Get the last valid reading for 'M1' for each site
-    # This revised apply directly selects the 'M1' value, resulting in a Series.
-    # Then .dropna() removes any sites that had no valid 'M1' value.
-    df_most_recent = df_processed.groupby('SiteName', group_keys=False)['M1'].apply(
-        lambda x: x.loc[x.last_valid_index()] if x.last_valid_index() is not None else None
-    ).dropna()
-
-    # --- FIX STARTS HERE ---
-    # Now, df_most_recent is a Series with SiteName as its index.
-    # reset_index() will convert the Series into a DataFrame and promote the index ('SiteName') to a column.
-    df_most_recent = df_most_recent.reset_index(name='M1') # Name the value column 'M1' after reset
-    # --- FIX ENDS HERE ---
+            # For other measurements, assume M1 is the relevant column
+            if 'M1' in df_fetched_raw.columns:
+                df_processed = df_fetched_raw[["SiteName", "Time", "M1"]]
+            else:
+                if verbose: print(f"{log_prefix}: 'M1' column not found for {selected_measurement}. Available columns: {df_fetched_raw.columns.tolist()}")
+                return _map_feature_collection(map_markers) # Cannot proceed without M1
+
+        # Get the last valid (non-NaN) reading of 'M1' for each site, vectorised over all sites.
+        # Sites without any valid 'M1' are left out, so they get no marker below.
+        with span("latest valid per site", rows=len(df_processed)):
+            df_most_recent = latest_valid_by_key(df_processed, ["M1"], key="SiteName", time_col="Time")
 
     if verbose:
-        print(f"{log_prefix}: df_most_recent (after groupby, apply on M1, dropna, and reset_index):\n{df_most_recent.head()}")
-        print(f"{log_prefix}: df_most_recent columns (after reset_index): {df_most_recent.columns.tolist()}")
+        print(f"{log_prefix}: df_most_recent (latest valid M1 per site):\n{df_most_recent.head()}")
+        print(f"{log_prefix}: df_most_recent columns: {df_most_recent.columns.tolist()}")
         print(f"{log_prefix}: sites_base_df columns : {sites_base_df.columns.tolist()}")
               
     # Merge the base site information with the most recent sensor value
     # Now df_most_recent has 'SiteName' and 'M1' as columns.
-    sites_with_data = pd.merge(sites_base_df, df_most_recent[['SiteName', 'M1']], on='SiteName', how='left')
+    with span("merge sites"):
+        sites_with_data = pd.merge(sites_base_df, df_most_recent[['SiteName', 'M1']], on='SiteName', how='left')
         
     if verbose:
         print(f"{log_prefix}: Merged 'sites_with_data' DataFrame head:\n{sites_with_data.head()}")
@@ -492,66 +519,57 @@ def process_map_data_2(selected_measurement, selected_time_period):
         # Check if _merge column shows issues like 'both' where it should be 'left_only' or vice versa
         # print(f"{log_prefix}: Merge indicator counts:\n{sites_with_data['_merge'].value_counts()}")
     
-    sites_dict=[]
-    sites_dict = sites_with_data.to_dict(orient='records')
+    with span("build markers"):
+        sites_dict=[]
+        sites_dict = sites_with_data.to_dict(orient='records')
     
-    map_markers=[]
-    for item in sites_dict:
-        site_name = item["SiteName"]
-        value = item.get("M1") # Use .get() for safer access, returns None if not present
-        lat = item["Latitude"]
-        lon = item["Longitude"]
+        map_markers=[]
+        for item in sites_dict:
+            site_name = item["SiteName"]
+            value = item.get("M1") # Use .get() for safer access, returns None if not present
+            lat = item["Latitude"]
+            lon = item["Longitude"]
         
-        if verbose: print(f"{log_prefix}: Processing site '{site_name}'. Raw value from merged DF: {value}")
+            if verbose: print(f"{log_prefix}: Processing site '{site_name}'. Raw value from merged DF: {value}")
 
-        # **CRITICAL CHANGE: ONLY GENERATE A MARKER IF THERE IS VALID DATA FOR THE SELECTED MEASUREMENT**
-        if pd.isna(value):
-            if verbose: print(f"{log_prefix}: Site '{site_name}': No VALID data (NaN) for {selected_measurement}. Skipping marker creation.")
-            continue # <--- THIS IS THE KEY CHANGE: Skip this site if value is NaN
+            # **CRITICAL CHANGE: ONLY GENERATE A MARKER IF THERE IS VALID DATA FOR THE SELECTED MEASUREMENT**
+            if pd.isna(value):
+                if verbose: print(f"{log_prefix}: Site '{site_name}': No VALID data (NaN) for {selected_measurement}. Skipping marker creation.")
+                continue # <--- THIS IS THE KEY CHANGE: Skip this site if value is NaN
         
-        # If we reach here, 'value' is not NaN, so it's valid data for the current measurement
-        radius = 8
-        color = 'green' # Default color
+            # If we reach here, 'value' is not NaN, so it's valid data for the current measurement
+            color = 'green' # Default color
     
-        # Colouring points
-        if selected_measurement == "Hourly Rainfall (mm)" or selected_measurement == "Daily Rainfall (mm)":
-            if value > 50: color = 'red'
-            elif value > 10: color = 'orange'
-        elif selected_measurement == "River Flow (m³/s)":
-            if value > 100: color = 'red'
-            elif value > 50: color = 'orange'
-        elif selected_measurement == "Water Temperature (°C)":
-            if value > 25: color = 'red'
-            elif value > 15: color = 'orange'
-        elif selected_measurement == "Air Temperature (°C)":
-            if value > 24: color = 'red'
-            elif value > 10: color = 'orange'
-        elif selected_measurement == "River Stage (m)":
-            if value > 7: color = 'red'
-            elif value > 3: color = 'orange'
+            # Colouring points
+            if selected_measurement == "Hourly Rainfall (mm)" or selected_measurement == "Daily Rainfall (mm)":
+                if value > 50: color = 'red'
+                elif value > 10: color = 'orange'
+            elif selected_measurement == "River Flow (m³/s)":
+                if value > 100: color = 'red'
+                elif value > 50: color = 'orange'
+            elif selected_measurement == "Water Temperature (°C)":
+                if value > 25: color = 'red'
+                elif value > 15: color = 'orange'
+            elif selected_measurement == "Air Temperature (°C)":
+                if value > 24: color = 'red'
+                elif value > 10: color = 'orange'
+            elif selected_measurement == "River Stage (m)":
+                if value > 7: color = 'red'
+                elif value > 3: color = 'orange'
         
-        popup_content = f"<b>{site_name}</b><br>{selected_measurement}: {value:.1f} (Latest)"
-        if verbose: print(f"{log_prefix}: Site: '{site_name}', Data: {value:.1f}, color: {color}.")
-
-        # **NEW CRITICAL CHANGE: Add a unique key to each CircleMarker**
-        # This forces React/Dash to treat each marker as a new element on every render
-        marker_key = f"{site_name}-{selected_measurement}-{selected_time_period}"
-    
-        # print(f"{log_prefix}: Map markers: {map_markers}")
-        map_markers.append(
-            dl.CircleMarker(
-                center=[lat, lon],
-                radius=radius,
-                color=color,
-                fillColor=color,
-                fillOpacity=0.8,
-                children=[dl.Popup(content=popup_content)],
-                key=marker_key # <--- ADD THIS LINE HERE
-            )
-        )
-    if verbose: print(f"{log_prefix}: Returning {len(map_markers)} markers for {selected_measurement}")
-    if verbose: print(f"{log_prefix} --- END PROCESSING FOR: {selected_measurement} ---")
-    return map_markers
+            if verbose: print(f"{log_prefix}: Site: '{site_name}', Data: {value:.1f}, color: {color}.")
+
+            # print(f"{log_prefix}: Map markers: {map_markers}")
+            map_markers.append({
+                "SiteName": site_name,
+                "Latitude": lat,
+                "Longitude": lon,
+                "value": round(float(value), 3),
+                "color": color,
+            })
+        if verbose: print(f"{log_prefix}: Returning {len(map_markers)} markers for {selected_measurement}")
+        if verbose: print(f"{log_prefix} --- END PROCESSING FOR: {selected_measurement} ---")
+        return _map_feature_collection(map_markers)
 
 # --- Helpers for Dataset Page ---
 
@@ -575,13 +593,25 @@ def get_dataset_site_options(selected_measurement):
         return options, []  # Return empty list for default value
     return [], []
 
-def get_dataset_data_for_display(selected_measurement, selected_sites, start_date, end_date):
+def _complete_dataset(result):
+    """Only datasets with no failed site fetches are cached (see get_dataset_data_for_display)."""
+    combined_df, _ = result
+    return not combined_df.attrs.get("failed_sites")
+
+@traced()
+@memoize(*DATASET_TTL, ignore=("progress",), cache_if=_complete_dataset)
+def get_dataset_data_for_display(selected_measurement, selected_sites, start_date, end_date, progress=None):
     """
     Fetches and combines raw data for the dataset display.
     Returns combined_df and a boolean indicating if data was found.
+
+    If given, progress(done, total, frames) is called as each site's data
+    arrives, with the per-site frames loaded so far (for partial display).
+
+    Sites whose fetch failed are listed in combined_df.attrs["failed_sites"];
+    such a partial result is returned but not cached.
     """
     log_prefix = "[DP-GET-DATASET-FOR-DISPLAY]"
-    all_site_data = []
 
     measurement_info = MEASUREMENTS_FOR_MAPS_AND_DATASETS.get(selected_measurement)
     if not measurement_info:
@@ -592,47 +622,47 @@ def get_dataset_data_for_display(selected_measurement, selected_sites, start_dat
     method =measurement_info["method"]
     interval = measurement_info["interval"]
     
+    sites = pd.DataFrame(measurement_info["sites"]) # DataFrame, or dummy list of dicts
+    known_sites = set(sites["SiteName"]) if "SiteName" in sites else set() # Empty if the site list failed to load
+    requests = []
     for site_name in selected_sites:
-        try:
-            site_info = next((s for s in measurement_info["sites"].to_dict(orient='records') if s['SiteName'] == site_name), None)
-            # print(f"{log_prefix} {site_info}")
-            
-            if not site_info:
-                if verbose:
-                    print(f"{log_prefix} Warning: Site '{site_name}' not found in measurement info for {selected_measurement}.")
-                continue
-
-            df = fetch_data_table_for_custom_collection(site_name,
-                                            measurements,
-                                            from_date=start_date,
-                                            to_date=end_date,
-                                            method=method,
-                                            interval=interval)
-            
+        if site_name not in known_sites:
+            if verbose:
+                print(f"{log_prefix} Warning: Site '{site_name}' not found in measurement info for {selected_measurement}.")
+            continue
+        requests.append(HilltopRequest(site_name, measurements, start_date, end_date, method, interval))
+
+    # The planner merges the sites into as few multi-site DataTable calls as possible
+    # and runs them in parallel; results arrive per site as each call finishes
+    site_frames = {}
+    failed_sites = []
+    for done, result in enumerate(iter_batch(requests), start=1):
+        site_name, df = result.key.site, result.value
+        if result.error is not None:
+            print(f"{log_prefix} Error fetching data for site {site_name} in dataset: {result.error}")
+            failed_sites.append(site_name)
+        else:
             if verbose:
                 print(f"{log_prefix}: Dataframe [df] -> {df.head()}")
-            
+
             # Ensure consistent column naming after fetch_data processing
-            if df is not None and not df.empty:                
+            if df is not None and not df.empty:
                 df = df[['Time', 'M1']].rename(columns={'Time': 'DateTime', 'M1': "Value"})
                 if verbose:
                     print(f"{log_prefix}: Dataframe [df] -> {df.head()}")
-                # df['DateTime'] = pd.to_datetime(df['DateTime'])
                 df['Measurement'] = selected_measurement
                 df['SiteName'] = site_name
-                if verbose:
-                    print(f"{log_prefix}: Dataframe [df] -> {df.info()}")
-                all_site_data.append(df) # Append the processed DataFrame
+                site_frames[site_name] = df
             else:
                 if verbose:
                     print(f"{log_prefix} No data for {site_name} - {hilltop_measurement_name} for period {start_date} to {end_date}")
 
-        except Exception as e:
-            if verbose:
-                print(f"{log_prefix} Error fetching data for site {site_name} in dataset: {e}")
-            
-    if not all_site_data:
-        return pd.DataFrame(), False
+        if progress is not None:
+            progress(done, len(requests), list(site_frames.values()))
+
+    # Back in selection order
+    all_site_data = [site_frames[r.site] for r in requests if r.site in site_frames]
 
-    combined_df = pd.concat(all_site_data, ignore_index=True)
-    return combined_df, True
\ No newline at end of file
+    combined_df = pd.concat(all_site_data, ignore_index=True) if all_site_data else pd.DataFrame()
+    combined_df.attrs["failed_sites"] = failed_sites
+    return combined_df, bool(all_site_data)
\ No newline at end of file
@@ -0,0 +1,151 @@
+# dataset_store.py
+#
+# Server-side home for datasets loaded on the Datasets page.
+#
+# load_dataset keeps the combined DataFrame here and puts only a short token in
+# the browser's dcc.Store. Downloads come straight from the server through
+# /download/<token>.<format>: CSV is streamed in chunks, Parquet and Arrow (IPC)
+# are offered when pyarrow is installed. Datasets are pickled under CACHE_DIR so
+# every worker process can serve any token; they expire after DATASET_STORE_TTL
+# seconds and the oldest are dropped once the directory passes DATASET_STORE_MAX_BYTES.
+
+import io
+import os
+import pickle
+import re
+import secrets
+import threading
+import time
+
+from flask import Response, abort, send_file, stream_with_context
+
+from constants import DATASET_STORE_DIR, DATASET_STORE_TTL, DATASET_STORE_MAX_BYTES, DATASET_CSV_CHUNK_ROWS
+
+try:
+    import pyarrow
+    import pyarrow.feather
+except ImportError: # Optional: only CSV downloads without it
+    pyarrow = None
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+DOWNLOAD_FORMATS = ("csv", "parquet", "arrow") if pyarrow is not None else ("csv",)
+
+_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class DatasetStore:
+    """Token -> (DataFrame, metadata dict), kept on disk with a TTL and a total size bound."""
+
+    def __init__(self, directory=DATASET_STORE_DIR, ttl=DATASET_STORE_TTL, max_bytes=DATASET_STORE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def put(self, df, meta=None):
+        """Stores `df` and returns its token."""
+        log_prefix = "[DATASET-STORE-PUT]"
+        os.makedirs(self.directory, exist_ok=True)
+        token = secrets.token_urlsafe(12)
+        path = self._path(token)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"meta": dict(meta or {}), "frame": df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if verbose:
+            print(f"{log_prefix} Stored {len(df)} rows as {token} ({os.path.getsize(path)} bytes)")
+        self._prune()
+        return token
+
+    def get(self, token):
+        """(DataFrame, meta) for `token`, or None if it is unknown or expired."""
+        if not token or not _TOKEN_RE.match(token):
+            return None
+        path = self._path(token)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "rb") as f:
+                stored = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        return stored["frame"], stored["meta"]
+
+    def _path(self, token):
+        return os.path.join(self.directory, f"{token}.pkl")
+
+    def _prune(self):
+        """Drops expired datasets, then the oldest ones until the directory fits in max_bytes."""
+        log_prefix = "[DATASET-STORE-PRUNE]"
+        with self._lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue # Removed by another worker
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            entries.sort() # Oldest first
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if now - mtime <= self.ttl and total <= self.max_bytes:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    if verbose:
+                        print(f"{log_prefix} Removed {os.path.basename(path)}")
+                except OSError:
+                    pass
+
+
+def download_url(token, fmt="csv"):
+    return f"/download/{token}.{fmt}"
+
+
+def _iter_csv(df, chunk_rows=DATASET_CSV_CHUNK_ROWS):
+    """Yields the CSV for `df` a chunk of rows at a time, header first."""
+    yield df.iloc[0:0].to_csv(index=False)
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False)
+
+
+def register_download_routes(server, store=None):
+    """Adds the /download/<token>.<format> route to the app's Flask server."""
+    store = store or DATASET_STORE
+
+    @server.route("/download/<token>.<fmt>")
+    def download_dataset(token, fmt):
+        if fmt not in DOWNLOAD_FORMATS:
+            abort(404)
+        stored = store.get(token)
+        if stored is None:
+            abort(404) # Unknown or expired: the user needs to load the dataset again
+        df, meta = stored
+        filename = f"{meta.get('filename', 'dataset')}.{fmt}"
+        disposition = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+        if fmt == "csv":
+            return Response(stream_with_context(_iter_csv(df)), mimetype="text/csv", headers=disposition)
+
+        buffer = io.BytesIO()
+        if fmt == "parquet":
+            df.to_parquet(buffer, index=False)
+            mimetype = "application/vnd.apache.parquet"
+        else:
+            pyarrow.feather.write_feather(df, buffer) # Arrow IPC file
+            mimetype = "application/vnd.apache.arrow.file"
+        buffer.seek(0)
+        return send_file(buffer, mimetype=mimetype, as_attachment=True, download_name=filename)
+
+    return download_dataset
+
+
+# Shared store used by the dataset callbacks and the download route
+DATASET_STORE = DatasetStore()
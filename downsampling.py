@@ -0,0 +1,119 @@
+# downsampling.py
+#
+# Server-side downsampling of time series for charts.
+#
+# A chart a thousand pixels wide can't show more than a couple of thousand
+# points, so long series are cut down to about DOWNSAMPLE_TARGET_POINTS before
+# they go into a figure. Two pickers are available:
+#
+#   lttb_indices    Largest-Triangle-Three-Buckets, plus each bucket's maximum so
+#                   flood peaks are never dropped (the default)
+#   minmax_indices  min and max of every bucket, fully vectorised
+#
+# Both return positions into the (time-sorted) input, so callers can pick rows.
+
+import numpy as np
+import pandas as pd
+
+from constants import DOWNSAMPLE_TARGET_POINTS, DOWNSAMPLE_METHOD
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+
+def lttb_indices(x, y, n_out, keep_peaks=True):
+    """
+    Largest-Triangle-Three-Buckets: positions of about `n_out` points that keep
+    the visual shape of (x, y). x must be sorted; y must have no NaNs.
+
+    With keep_peaks, any bucket whose maximum wasn't the point LTTB chose also
+    keeps its maximum, so the result can be up to twice as long as n_out.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    next_starts, next_ends = ends, np.append(edges[2:], n)
+
+    # Average point of each bucket's right-hand neighbour, for all buckets at once
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    counts = next_ends - next_starts
+    avg_x = (cx[next_ends] - cx[next_starts]) / counts
+    avg_y = (cy[next_ends] - cy[next_starts]) / counts
+
+    chosen = np.empty(n_out, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    peaks = []
+    a = 0
+    for i in range(len(starts)):
+        s, e = starts[i], ends[i]
+        xs, ys = x[s:e], y[s:e]
+        area = np.abs((x[a] - avg_x[i]) * (ys - y[a]) - (x[a] - xs) * (avg_y[i] - y[a]))
+        a = s + int(np.argmax(area))
+        chosen[i + 1] = a
+        if keep_peaks:
+            peak = s + int(np.argmax(ys))
+            if ys[peak - s] > y[a]:
+                peaks.append(peak)
+
+    if peaks:
+        return np.union1d(chosen, peaks)
+    return chosen
+
+
+def minmax_indices(y, n_buckets):
+    """Positions of the minimum and maximum of each of `n_buckets` equal-count buckets, plus the end points."""
+    n = len(y)
+    if n_buckets * 2 >= n or n_buckets < 1:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    # Sorted by bucket, each bucket's block starts at its edge: the first entry is its min (or max)
+    imin = np.lexsort((y, bucket))[edges[:-1]]
+    imax = np.lexsort((-y, bucket))[edges[:-1]]
+    return np.unique(np.concatenate(([0], imin, imax, [n - 1])))
+
+
+def downsample_indices(x, y, n_out=DOWNSAMPLE_TARGET_POINTS, method=DOWNSAMPLE_METHOD):
+    if method == "minmax":
+        return minmax_indices(y, n_out // 2)
+    return lttb_indices(x, y, n_out)
+
+
+def downsample_frame(df, x_col, y_col, n_out=DOWNSAMPLE_TARGET_POINTS, by=None, method=DOWNSAMPLE_METHOD):
+    """
+    Downsamples `df` to about `n_out` rows per series (per `by` group when given),
+    sorted by `x_col`. Rows with no `y_col` value are dropped first.
+    """
+    log_prefix = "[DOWNSAMPLE]"
+    if df is None or df.empty:
+        return df
+    df = df.dropna(subset=[y_col])
+    if df.empty:
+        return df
+    groups = df.groupby(by, sort=False, observed=True) if by is not None else [(None, df)]
+
+    parts = []
+    for _, part in groups:
+        part = part.sort_values(x_col, kind="stable")
+        if len(part) > n_out:
+            part = part.iloc[downsample_indices(part[x_col].to_numpy(), part[y_col].to_numpy(), n_out, method)]
+        parts.append(part)
+    result = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+    if verbose:
+        print(f"{log_prefix} {len(df)} -> {len(result)} rows ({method}, target {n_out} per series)")
+    return result
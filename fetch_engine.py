@@ -0,0 +1,102 @@
+# fetch_engine.py
+#
+# Bounded concurrent execution of Hilltop fetches.
+#
+# Callbacks that need several independent requests (one per site, one per chunk
+# of a collection, ...) hand them to run_concurrently() so they go out in
+# parallel. A per-host semaphore caps how many requests are in flight to any one
+# server across all callbacks, so a busy page can't swamp the TRC server.
+
+import contextvars
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from constants import BASE, FETCH_MAX_WORKERS, FETCH_PER_HOST_LIMIT
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# One task's outcome: `value` on success, otherwise `error` holds the exception
+FetchResult = namedtuple("FetchResult", ["key", "value", "error"])
+
+DEFAULT_HOST = urlparse(BASE).netloc
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Slots held by the parent's threads at fork time would never be released here
+    global _host_semaphores_lock
+    _host_semaphores.clear()
+    _host_semaphores_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _host_semaphore(host):
+    with _host_semaphores_lock:
+        sem = _host_semaphores.get(host)
+        if sem is None:
+            sem = _host_semaphores[host] = threading.BoundedSemaphore(FETCH_PER_HOST_LIMIT)
+        return sem
+
+
+def _run_one(key, fn, host):
+    log_prefix = "[FETCH-ENGINE]"
+    with _host_semaphore(host):
+        try:
+            return FetchResult(key, fn(), None)
+        except Exception as e:
+            if verbose:
+                print(f"{log_prefix} Task {key!r} failed: {e}")
+            return FetchResult(key, None, e)
+
+
+def _iter_indexed(tasks, max_workers, host):
+    """Yields (task index, FetchResult) pairs in completion order."""
+    if len(tasks) == 1:
+        key, fn = tasks[0]
+        yield 0, _run_one(key, fn, host)
+        return
+
+    workers = max(1, min(max_workers, len(tasks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hilltop-fetch") as pool:
+        # Each task runs in a copy of the caller's context, so its trace spans
+        # (see tracing.py) nest under the span that started the fetch
+        futures = {pool.submit(contextvars.copy_context().run, _run_one, key, fn, host): i
+                   for i, (key, fn) in enumerate(tasks)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def iter_concurrently(tasks, max_workers=FETCH_MAX_WORKERS, host=DEFAULT_HOST):
+    """
+    Runs `tasks`, a list of (key, zero-argument callable) pairs, in parallel and
+    yields a FetchResult for each one as soon as it finishes (completion order).
+
+    A task that raises doesn't stop the others; its exception is returned in
+    `error`. At most FETCH_PER_HOST_LIMIT tasks per host run at once, process-wide.
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return
+    for _, result in _iter_indexed(tasks, max_workers, host):
+        yield result
+
+
+def run_concurrently(tasks, max_workers=FETCH_MAX_WORKERS, host=DEFAULT_HOST):
+    """
+    Same as iter_concurrently, but waits for every task and returns the
+    FetchResults in the same order as `tasks`.
+    """
+    tasks = list(tasks)
+    results = [None] * len(tasks)
+    if tasks:
+        for i, result in _iter_indexed(tasks, max_workers, host):
+            results[i] = result
+    return results
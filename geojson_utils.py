@@ -1,19 +1,50 @@
-def build_site_geojson(sites):
+import base64
+import math
+
+from constants import MAP_GEOBUF
+from tracing import traced
+
+try:
+    import geobuf
+except ImportError: # Optional: plain GeoJSON is sent instead
+    geobuf = None
+
+# Format of the data sent to the map's dl.GeoJSON layer
+MAP_LAYER_FORMAT = "geobuf" if MAP_GEOBUF and geobuf is not None else "geojson"
+
+
+def build_site_geojson(sites, properties=None):
+    """
+    Builds a GeoJSON FeatureCollection of site points from dicts with SiteName,
+    Latitude and Longitude. Keys listed in `properties` are copied into each
+    feature's properties alongside the site name. Coordinates are rounded to
+    5 decimal places (about 1 m), which is plenty for a site marker.
+    """
     features = []
     for site in sites:
-        if site["Latitude"] is None or site["Longitude"] is None:
+        lat, lon = site["Latitude"], site["Longitude"]
+        if lat is None or lon is None or (isinstance(lat, float) and math.isnan(lat)) or (isinstance(lon, float) and math.isnan(lon)):
             continue
+        feature_properties = {"name": site["SiteName"]}
+        for key in properties or ():
+            feature_properties[key] = site.get(key)
         features.append({
             "type": "Feature",
             "geometry": {
                 "type": "Point",
-                "coordinates": [site["Longitude"], site["Latitude"]]
+                "coordinates": [round(float(lon), 5), round(float(lat), 5)]
             },
-            "properties": {
-                "name": site["SiteName"]
-            }
+            "properties": feature_properties
         })
     return {
         "type": "FeatureCollection",
         "features": features
     }
+
+
+@traced("encode map layer")
+def encode_for_map(feature_collection):
+    """FeatureCollection -> the `data` value for a dl.GeoJSON with format=MAP_LAYER_FORMAT."""
+    if MAP_LAYER_FORMAT == "geobuf":
+        return base64.b64encode(geobuf.encode(feature_collection)).decode()
+    return feature_collection
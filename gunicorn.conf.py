@@ -0,0 +1,40 @@
+# gunicorn.conf.py
+#
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py app:server
+#
+# The app is preloaded in the master, so the site lists and measurement
+# configuration are built (or attached from the snapshot, see startup.py) once,
+# before any worker exists. Workers are forked from it and share those pages
+# copy-on-write; gc.freeze() moves everything loaded so far out of the garbage
+# collector's reach, so collections in a worker don't touch (and copy) them.
+#
+# The RecentDataTable pollers also run only in the master: they publish each
+# snapshot to RECENT_POLL_SNAPSHOT_DIR next to the config snapshot, and workers
+# read it (see recent_poller.py). Adding workers therefore adds no startup or
+# polling calls to Hilltop, only the requests their users make, and little
+# extra memory.
+
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120")) # Long dataset loads run as background callbacks
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Everything the master built is long-lived; keep the collector off those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Workers don't poll: the master's pollers (started by app.py during preload)
+    # keep running and publish their snapshots, which latest_values() reads.
+    # The poller copies inherited here have no thread and would only go stale.
+    # (HTTP sessions, fetch slots and SQLite connections reset themselves, see
+    # hilltop_http.py, fetch_engine.py and timeseries_store.py.)
+    from recent_poller import forget_pollers
+    forget_pollers()
@@ -1,25 +1,112 @@
-from hilltoppy import Hilltop
+import threading
 import pandas as pd
+import numpy as np
 import xml.etree.ElementTree as ET
+from array import array
 from datetime import datetime, timedelta
-import requests
 import pytz
-from io import StringIO
+from io import BytesIO
+
+from site_registry import SITE_REGISTRY
+from hilltop_http import http_get
+from timeseries_cache import TIMESERIES_CACHE, format_hilltop_time, to_timestamp
+from timeseries_store import TIMESERIES_STORE
+from rollups import ROLLUPS
+from metrics import hilltop_call, phase, timed_stream
+from tracing import traced
+from functools import partial
+from urllib.parse import quote, unquote
+from constants import BASE, TRC_HILLTOP_BASE_URL, TRC_HILLTOP_HTS_FILE
 
 # Chose whether to see all the print statements
 verbose=False # Default is False
 
 # Create a connection to the TRC Hilltop server
-SERVER_URL = "https://extranet.trc.govt.nz/getdata"
-hts = "boo.hts"
+SERVER_URL = TRC_HILLTOP_BASE_URL.rstrip("/")
+hts = TRC_HILLTOP_HTS_FILE
 url= f"{SERVER_URL}/{hts}"
-ht = Hilltop(SERVER_URL,hts)
-df_sites = ht.get_site_list(location='LatLong').dropna()
+# The Hilltop client and site list come from the shared, lazily loaded SITE_REGISTRY,
+# so importing this module does no network I/O. `ht` and `df_sites` are still
+# available as module attributes (see __getattr__ below).
+
+def __getattr__(name):
+    if name == "ht":
+        return SITE_REGISTRY.client()
+    if name == "df_sites":
+        return SITE_REGISTRY.sites()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class _SingleFlight:
+    """
+    Request coalescing: concurrent callers with the same key wait for one
+    in-flight call and all get its result (or its exception). Nothing is kept
+    once the call finishes; caching is TIMESERIES_CACHE's job.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        log_prefix = "[HT-API-SINGLE-FLIGHT]"
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            if verbose:
+                print(f"{log_prefix} Joining in-flight request {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if verbose and call.waiters:
+                print(f"{log_prefix} {key} answered {call.waiters} waiting caller(s)")
+        return call.value
+
+
+_inflight = _SingleFlight()
+
+
+def _coalesced_window(start, end):
+    """
+    Widens [start, end] to whole minutes so callers asking "last 2 days up to now"
+    a few milliseconds apart end up with the same upstream request. The result is
+    always a superset of what was asked for.
+    """
+    start = to_timestamp(start)
+    end = to_timestamp(end)
+    return (start.floor("min") if start is not None else None,
+            end.ceil("min") if end is not None else None)
 
 def fetch_site_list(measurement="Flow"):
     """Returns a list of dicts: [{name, lat, lon}]"""
     log_prefix = "[HT-API-FETCH-SITE-LIST]"
-    sites_df = ht.get_site_list(location='LatLong', measurement=measurement)
+    with hilltop_call("SiteList") as call:
+        sites_df = SITE_REGISTRY.client().get_site_list(location='LatLong', measurement=measurement)
+        call.rows = len(sites_df)
     if verbose:
         print(f"{log_prefix}: {type(sites_df)} Found {len(sites_df)} sites for measurement '{measurement}'")
     # Need to add measurement from and to dates check to this list
@@ -29,7 +116,7 @@ def fetch_site_list(measurement="Flow"):
 def fetch_site_list_collection(collection="WebRivers"):
     """Returns a list of dicts: [{name, lat, lon}]"""
     log_prefix = "[HT-API-FETCH-SITE-LIST-COLLECTION]"
-    sites_df = ht.get_site_list(location='LatLong', collection=collection)
+    sites_df = SITE_REGISTRY.collection(collection).copy() # Copy so callers can't modify the shared frame
     if verbose:
         print(f"{log_prefix}: Found {len(sites_df)} sites for collection '{collection}'")
     # Need to add measurement from and to dates check to this list
@@ -38,16 +125,22 @@ def fetch_site_list_collection(collection="WebRivers"):
     return sites_df #.to_dict(orient="records")
 
 
+def _get_measurement_list(site):
+    with hilltop_call("MeasurementList") as call:
+        measurements_df = SITE_REGISTRY.client().get_measurement_list(site)
+        call.rows = len(measurements_df)
+    return measurements_df
+
 def fetch_measurements(site):
     """Returns list of (name, units) tuples"""
-    measurements_df = ht.get_measurement_list(site)
+    measurements_df = _get_measurement_list(site)
     if verbose:
         print(f"Found {len(measurements_df)} measurements for site {site}")
         print(measurements_df.columns)
     return list(zip(measurements_df["MeasurementName"], measurements_df["Units"]))
 
 def fetch_measurement_list(site):
-    measurements_df = ht.get_measurement_list(site)
+    measurements_df = _get_measurement_list(site)
     measurements_df = measurements_df[["SiteName","MeasurementName", "Units", "From", "To"]]
     
     """Returns a DataFrame with measurement details for a site"""
@@ -69,7 +162,30 @@ def active_measurement(df,measurement="Flow"):
         return
 
 def fetch_collection_list():
-    return ht.get_collection_list()
+    with hilltop_call("CollectionList") as call:
+        collections = SITE_REGISTRY.client().get_collection_list()
+        call.rows = len(collections)
+    return collections
+
+
+def _get_data_cached(site, measurement, start_date, end_date, method=None, interval=None):
+    """
+    One site's series as SiteName, MeasurementName, Time, Value (the layout of
+    ht.get_data()). It goes through the request planner like every other
+    DataTable request, so it shares the per-site TIMESERIES_CACHE and
+    TIMESERIES_STORE entries (and in-flight calls) with the dataset page: only
+    the parts of [start_date, end_date] that neither holds yet are requested.
+    """
+    from request_planner import HilltopRequest, fetch_batch # request_planner imports this module
+    result, = fetch_batch([HilltopRequest(site, measurement, start_date, end_date, method or "", interval or "")])
+    if result.error is not None:
+        raise result.error
+    df = result.value
+    if df.empty:
+        return pd.DataFrame(columns=["SiteName", "MeasurementName", "Time", "Value"])
+    df = df.rename(columns={"M1": "Value"})
+    df.insert(1, "MeasurementName", measurement)
+    return df[["SiteName", "MeasurementName", "Time", "Value"]]
 
 
 def fetch_data(site, measurement, start_date, end_date, process_as_rainfall=False):
@@ -78,7 +194,7 @@ def fetch_data(site, measurement, start_date, end_date, process_as_rainfall=Fals
     If process_as_rainfall is True, calculates hourly and daily totals for rainfall data.
     """
     log_prefix = "[HT-API-FETCH-DATA]"
-    df = ht.get_data(site, measurement, start_date, end_date)
+    df = _get_data_cached(site, measurement, start_date, end_date)
     
     if df is None or df.empty:
         if verbose:
@@ -107,22 +223,12 @@ def fetch_data(site, measurement, start_date, end_date, process_as_rainfall=Fals
         if verbose:
             print(f"{log_prefix}  Processing {measurement} data for {site} as rainfall totals...")
         
-        # Calculate hourly totals
-        # .resample('H') groups data by hour. .sum() aggregates values within each hour.
-        # .fillna(0) ensures hours with no rainfall get 0 instead of NaN.
-        hourly_totals = df['Value'].resample('h').sum()#.rename('hourly_total_mm')
-        # print(hourly_totals.head(12))  # Debug: print first few hours to verify structure
-        # Calculate daily totals
-        # .resample('D') groups data by day. .sum() aggregates values within each day.
-        daily_totals = df['Value'].resample('D').sum()#.rename('daily_total_mm')
-        # print(daily_totals.head(12))  # Debug: print first few days to verify structure
-        # Combine into a single DataFrame for return, or return separately as needed
-        # For simplicity, let's return a DataFrame with original, hourly, and daily totals
-        # Merging back to the original index is tricky for totals, better to return aggregated DFs
-        # print(f"Hourly totals calculated: {hourly_totals.shape[0]} hours")
-        # print(f"Daily totals calculated: {daily_totals.shape[0]} days") 
-        # Option 1: Return a dictionary of DataFrames
-        # print(f"{log_prefix}  Returning dict with raw, hourly, and daily totals for {site} ({measurement})")
+        # Hourly and daily totals come from the rollup pyramid, which is only
+        # topped up with raw values it hasn't seen before instead of re-resampling
+        # the whole series on every call. Hours/days without readings are 0, as
+        # resample().sum() gave.
+        hourly_totals = _zero_filled(fetch_rollup(site, measurement, start_date, end_date, freq="1 hour", stat="sum"), "h")
+        daily_totals = _zero_filled(fetch_rollup(site, measurement, start_date, end_date, freq="1 day", stat="sum"), "D")
         return {
             "raw_data": df.reset_index(), # Original raw data with 'time' column
             "hourly_totals": hourly_totals.reset_index(),
@@ -138,13 +244,35 @@ def fetch_data(site, measurement, start_date, end_date, process_as_rainfall=Fals
             print(f"{log_prefix} Returning raw data for {site} ({measurement}) with {df.shape[0]} rows")
         return {"raw_data": df.reset_index()}
     
+def _zero_filled(rollup, freq):
+    """A fetch_rollup() sum frame as a 'Value' series indexed by 'time', with every bucket from first to last."""
+    totals = rollup.rename(columns={"sum": "Value"}).set_index("Time")["Value"]
+    if not totals.empty:
+        totals = totals.reindex(pd.date_range(totals.index.min(), totals.index.max(), freq=freq), fill_value=0.0)
+    totals.index.name = "time"
+    return totals
+
+
+def fetch_rollup(site, measurement, start_date, end_date, freq="1 day", stat="sum"):
+    """
+    Totals/means/maxima (`stat`: sum, mean, max or count) per `freq` bucket
+    ("1 hour", "1 day", "1 month", "1 year" or e.g. "3h") of the raw series,
+    served from the ROLLUPS pyramid at the coarsest level that fits. Returns a
+    DataFrame with Time and the stat.
+    """
+    def fetch_raw(start, end):
+        return _get_data_cached(site, measurement, start, end)
+
+    return ROLLUPS.get(("DataTable", site, measurement), start_date, end_date, freq, stat, fetch_raw=fetch_raw)
+
+
 def fetch_data_by_method(site, measurement, start_date, end_date, method, interval):
     """
     Returns a DataFrame with time series values.
     If process_as_rainfall is True, calculates hourly and daily totals for rainfall data.
     """
     log_prefix = "[HT-API-FETCH-DATA-BY-METHOD]"
-    df = ht.get_data(site, measurement, start_date, end_date, method, interval)
+    df = _get_data_cached(site, measurement, start_date, end_date, method, interval)
     
     if df is None or df.empty:
         print(f"[HT-API-FETCH-DATA-BY-METHOD] No data returned from Hilltop for {site}, {measurement} between {start_date} and {end_date}")
@@ -187,12 +315,16 @@ def fetch_and_parse_hilltop_data(base_url=url,
         "from": from_str,
     }
 
-    # Make the GET request
-    response = requests.get(base_url, params=params)
-    response.raise_for_status()
+    # Make the GET request and parse the body as it streams in
+    with hilltop_call("DataTable") as call:
+        response = http_get(base_url, params=params, stream=True)
+        response.raise_for_status()
 
-    xml_string = response.text
-    return parse_hilltop_xml(xml_string)
+        with response:
+            response.raw.decode_content = True # Let urllib3 undo gzip/deflate
+            df = parse_hilltop_xml(timed_stream(response.raw))
+        call.rows = len(df)
+    return df
 
 def fetch_and_parse_recent_hilltop_data(base_url=url,
                                  collection="WebRivers"):
@@ -209,47 +341,248 @@ def fetch_and_parse_recent_hilltop_data(base_url=url,
         # "from": from_str,
     }
 
-    # Make the GET request
-    response = requests.get(base_url, params=params)
-    response.raise_for_status()
+    # Make the GET request and parse the body as it streams in
+    with hilltop_call("RecentDataTable") as call:
+        response = http_get(base_url, params=params, stream=True)
+        response.raise_for_status()
 
-    xml_string = response.text
-    return parse_hilltop_xml(xml_string)
+        with response:
+            response.raw.decode_content = True # Let urllib3 undo gzip/deflate
+            df = parse_hilltop_xml(timed_stream(response.raw))
+        call.rows = len(df)
+    return df
 
 
 def parse_hilltop_xml(xml_string):
-    root = ET.parse(StringIO(xml_string)).getroot()
+    """
+    Parses a Hilltop DataTable/RecentDataTable response into a DataFrame with
+    SiteName, Time and one "Measurement (Units)" column per measurement.
 
-    # Step 1: Build mapping from ColumnName → "Measurement (Units)"
-    column_map = {}
-    for m in root.findall(".//Measurements"):
-        column = m.findtext("ColumnName")
-        name = m.findtext("Measurement")
-        units = m.findtext("Units")
-        if column:
-            label = f"{name} ({units})" if units else name
-            column_map[column] = label
-
-    # Step 2: Parse Results
-    records = []
-    for result in root.findall(".//Results"):
-        record = {
-            "SiteName": result.findtext("SiteName"),
-            "Time": result.findtext("Time"),
+    `xml_string` may be a str, bytes or a binary file-like object (e.g. a streamed
+    response body); the XML is read incrementally, never as a whole tree.
+    """
+    with phase("parse"):
+        columns, n_rows, column_map = _stream_data_table(xml_string)
+
+    with phase("convert"):
+        # Only the measurement columns described in <Measurements> are kept
+        data = {
+            "SiteName": columns.pop("SiteName", None),
+            "Time": columns.pop("Time", None),
         }
-        for col_key in column_map:
-            record[column_map[col_key]] = result.findtext(col_key)
-        records.append(record)
+        for col_key, label in column_map.items():
+            data[label] = columns.get(col_key)
+        df = _columns_to_frame(data, n_rows)
+
+        # Measurement columns that aren't named M1/M2/... arrive as text
+        for label in column_map.values():
+            if df[label].dtype == object:
+                df[label] = pd.to_numeric(df[label], errors="coerce")
+    return df
 
-    df = pd.DataFrame(records)
 
-    # Step 3: Type conversion
-    df["Time"] = pd.to_datetime(df["Time"])
-    for col in df.columns:
-        if col not in ["SiteName", "Time"]:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
+_NAT_INT = np.datetime64("NaT", "ns").astype(np.int64)
 
-    return df
+
+def _parse_time(text):
+    """
+    ISO timestamp text -> int64 nanoseconds (NaT if it can't be parsed). A
+    timestamp with a UTC offset keeps its local wall time (the offset is
+    dropped), so it lines up with the naive local times of every other series.
+    """
+    if not text:
+        return _NAT_INT
+    if not (text[-1] == "Z" or "+" in text or text.rfind("-") > 10): # No offset: the fast path
+        try:
+            return np.datetime64(text, "ns").astype(np.int64)
+        except ValueError:
+            pass
+    try:
+        return pd.Timestamp(text).tz_localize(None).value
+    except ValueError:
+        return _NAT_INT
+
+
+def _parse_float(text):
+    if text is None:
+        return np.nan
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+class _SiteNameBuffer:
+    """SiteName column kept as integer codes plus a small table of distinct names while parsing."""
+    def __init__(self):
+        self.codes = array("i")
+        self.categories = {}
+
+    def append(self, text):
+        if text is None:
+            self.codes.append(-1)
+        else:
+            self.codes.append(self.categories.setdefault(text, len(self.categories)))
+
+    def extend_missing(self, n):
+        self.codes.extend([-1] * n)
+
+
+class _TypedBuffer:
+    """A growable typed column: Time -> int64 ns, M1/M2/... -> float64, anything else -> str."""
+    def __init__(self, tag):
+        if tag == "Time":
+            self.values, self.convert, self.missing = array("q"), _parse_time, _NAT_INT
+        elif tag.startswith("M"):
+            self.values, self.convert, self.missing = array("d"), _parse_float, np.nan
+        else:
+            self.values, self.convert, self.missing = [], None, None
+
+    def append(self, text):
+        self.values.append(self.convert(text) if self.convert else text)
+
+    def extend_missing(self, n):
+        self.values.extend([self.missing] * n)
+
+
+def _stream_data_table(source):
+    """
+    Incrementally parses the <Results> rows of a Hilltop DataTable response into
+    typed column buffers, clearing each element once it has been read so peak
+    memory follows the size of the output rather than the XML tree.
+
+    Returns (columns, n_rows, column_map) where columns maps each child tag of
+    <Results> to its buffer and column_map maps ColumnName -> "Measurement (Units)".
+    """
+    if isinstance(source, str):
+        source = BytesIO(source.encode("utf-8"))
+    elif isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    columns = {}
+    column_map = {}
+    n_rows = 0
+    stack = []
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+
+        if elem.tag == "Results":
+            seen = set()
+            for child in elem:
+                buf = columns.get(child.tag)
+                if buf is None:
+                    buf = _SiteNameBuffer() if child.tag == "SiteName" else _TypedBuffer(child.tag)
+                    buf.extend_missing(n_rows) # Column first seen part way through the response
+                    columns[child.tag] = buf
+                buf.append(child.text)
+                seen.add(child.tag)
+            for tag, buf in columns.items():
+                if tag not in seen:
+                    buf.extend_missing(1)
+            n_rows += 1
+        elif elem.tag == "Measurements":
+            column = elem.findtext("ColumnName")
+            name = elem.findtext("Measurement")
+            units = elem.findtext("Units")
+            if column:
+                column_map[column] = f"{name} ({units})" if units else name
+        else:
+            continue
+
+        # Done with this row/header: drop it and detach it from its parent
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+    return columns, n_rows, column_map
+
+
+def _columns_to_frame(columns, n_rows):
+    """Builds the DataFrame from the typed buffers without any per-row Python objects."""
+    data = {}
+    for name, buf in columns.items():
+        if buf is None:
+            # Column described by the response but never present in a row
+            data[name] = np.full(n_rows, np.nan)
+        elif isinstance(buf, _SiteNameBuffer):
+            # Codes while parsing; plain strings out, as consumers group, sort and merge on SiteName
+            data[name] = pd.Categorical.from_codes(np.frombuffer(buf.codes, dtype=np.int32),
+                                                   categories=list(buf.categories)).astype(object)
+        elif isinstance(buf.values, array) and buf.values.typecode == "q":
+            data[name] = np.frombuffer(buf.values, dtype=np.int64).view("datetime64[ns]")
+        elif isinstance(buf.values, array):
+            data[name] = np.frombuffer(buf.values, dtype=np.float64)
+        else:
+            data[name] = buf.values
+    return pd.DataFrame(data)
+
+
+def _last_index_per_key(codes, times, valid, n_keys):
+    """
+    Position of the latest valid row for each key code, as an array of length
+    n_keys (-1 where a key has no valid row). `codes` are integer key codes
+    (-1 = missing key), `times` int64 nanoseconds and `valid` a boolean mask of
+    rows allowed to be picked. O(n): no sorting.
+    """
+    idx = np.flatnonzero(valid & (codes >= 0))
+    positions = np.full(n_keys, -1, dtype=np.int64)
+    if idx.size == 0:
+        return positions
+    row_codes, row_times = codes[idx], times[idx]
+
+    latest = np.full(n_keys, np.iinfo(np.int64).min, dtype=np.int64)
+    np.maximum.at(latest, row_codes, row_times)
+
+    # Rows that hold their key's latest time (on ties, one of them is kept)
+    hits = row_times == latest[row_codes]
+    positions[row_codes[hits]] = idx[hits]
+    return positions
+
+
+def latest_valid_by_key(df, value_cols, key="SiteName", time_col="Time", dropna=True):
+    """
+    Most recent non-NaN reading of each column in `value_cols` for every `key`,
+    computed with NumPy rather than a Python call per group.
+
+    Returns a DataFrame sorted by key with columns: key, then for each value
+    column `<col>` (the value) and `<col>_Time` (when it was read). With
+    dropna=True, keys without a valid reading in any value column are left out.
+    """
+    if isinstance(value_cols, str):
+        value_cols = [value_cols]
+
+    codes, uniques = pd.factorize(df[key]) # Sorting the few uniques afterwards is cheaper than sort=True
+    times = df[time_col]
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, errors="coerce")
+    times = times.to_numpy(dtype="datetime64[ns]")
+    has_time = ~np.isnat(times)
+    times = times.view(np.int64)
+
+    out = {key: np.asarray(uniques, dtype=object)}
+    any_valid = np.zeros(len(uniques), dtype=bool)
+    for col in value_cols:
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+        positions = _last_index_per_key(codes, times, has_time & ~np.isnan(values), len(uniques))
+        found = positions >= 0
+
+        col_values = np.full(len(uniques), np.nan)
+        col_times = np.full(len(uniques), _NAT_INT)
+        col_values[found] = values[positions[found]]
+        col_times[found] = times[positions[found]]
+        any_valid |= found
+
+        out[col] = col_values
+        out[f"{col}_Time"] = col_times.view("datetime64[ns]")
+
+    result = pd.DataFrame(out)
+    if dropna:
+        result = result[any_valid]
+    return result.sort_values(key, kind="stable").reset_index(drop=True)
 
 
 def get_latest_by_site(df):
@@ -262,23 +595,22 @@ def get_latest_by_site(df):
         raise ValueError(f"{log_prefix} DataFrame must include 'SiteName' and 'Time' columns.")
 
     # Ensure Time is datetime
-    df["Time"] = pd.to_datetime(df["Time"], errors="coerce")
+    if not pd.api.types.is_datetime64_any_dtype(df["Time"]):
+        df["Time"] = pd.to_datetime(df["Time"], errors="coerce")
 
-    # Drop rows with missing times
-    df = df.dropna(subset=["Time"])
+    # Last row per SiteName by time (rows with missing times are skipped), sorted by SiteName
+    codes, uniques = pd.factorize(df["SiteName"])
+    times = df["Time"].to_numpy(dtype="datetime64[ns]")
+    positions = _last_index_per_key(codes, times.view(np.int64), ~np.isnat(times), len(uniques))
+    latest_df = df.iloc[positions[positions >= 0]].sort_values("SiteName", kind="stable")
 
-    # Sort and get last row per SiteName
-    latest_df = df.sort_values("Time").groupby("SiteName", as_index=False).tail(1)
-    latest_df = latest_df.sort_values("SiteName") #.set_index('SiteName', inplace=True)
-    
-    
     return latest_df.reset_index(drop=True)
 
 
 def fetch_active_site_list(base_url=url, 
                            collection="WebRivers", 
                            minutes_ago=60, 
-                           df_sites=df_sites):
+                           df_sites=None):
     """ 
     Fetches and parses Hilltop data, returning the latest readings for each site.
     The function merges the site data with the latest readings to provide a complete view.
@@ -287,6 +619,8 @@ def fetch_active_site_list(base_url=url,
     log_prefix = "[HT-API-FETCH-ACTIVE-SITE-LIST]"
     df = fetch_and_parse_hilltop_data(base_url, collection, minutes_ago)
     df = get_latest_by_site(df)
+    if df_sites is None:
+        df_sites = SITE_REGISTRY.sites()
     df = pd.merge(df, df_sites, on='SiteName', how='left')
     if verbose:
         print(f"{log_prefix} Found {len(df)} active sites with latest readings for collection '{collection}'")
@@ -302,7 +636,7 @@ def fetch_active_sensor_site_list(sensor="Flow",
                                     base_url=url, 
                                     collection="WebRivers", 
                                     minutes_ago=60, 
-                                    df_sites=df_sites):
+                                    df_sites=None):
     """ 
     Fetches and parses Hilltop data, returning the latest readings for each site.
     The function merges the site data with the latest readings to provide a complete view.
@@ -311,6 +645,8 @@ def fetch_active_sensor_site_list(sensor="Flow",
     log_prefix = "[HT-API-FETCH-ACTIVE-SITE-LIST]"
     df = fetch_and_parse_hilltop_data(base_url, collection, minutes_ago)
     df = get_latest_by_site(df)
+    if df_sites is None:
+        df_sites = SITE_REGISTRY.sites()
     df = pd.merge(df, df_sites, on='SiteName', how='left')
     if verbose:
         print(f"{log_prefix} Found {len(df)} active sites with latest readings for collection '{collection}'")
@@ -343,19 +679,22 @@ def fetch_active_sensor_site_list(sensor="Flow",
 
 def fetch_recent_active_site_list(base_url=url, 
                            collection="WebRivers", 
-                           df_sites=df_sites):
+                           df_sites=None):
     """ 
     Fetches and parses Hilltop data, returning the latest readings for each site.
     The function merges the site data with the latest readings to provide a complete view.
     The `minutes_ago` parameter allows you to specify how far back to look for data    
     """
     df = fetch_and_parse_recent_hilltop_data(base_url, collection)
+    if df_sites is None:
+        df_sites = SITE_REGISTRY.sites()
     df = pd.merge(df, df_sites, on='SiteName', how='left')
     
     return df.to_dict(orient="records") #.set_index('SiteName', inplace=True)
 
 
 
+@traced()
 def fetch_data_table_for_custom_collection(
     site: str,
     measurement: str,
@@ -363,7 +702,7 @@ def fetch_data_table_for_custom_collection(
     to_date: str,
     method: None, #str = "Total",
     interval: None, #str = "1 hour",
-    base_url: str = "https://extranet.trc.govt.nz/getdata/boo.hts"
+    base_url: str = BASE
 ) -> pd.DataFrame:
     """
     Fetches data from a Hilltop DataTable REST endpoint and returns it as a pandas DataFrame.
@@ -379,7 +718,76 @@ def fetch_data_table_for_custom_collection(
     
     Returns:
         pd.DataFrame: DataFrame with Time, SiteName, M1, M2 etc.
+
+    Results are cached per site, in the range-aware TIMESERIES_CACHE and the
+    on-disk TIMESERIES_STORE, so asking for A,B and then A,C only fetches C. Sites
+    missing the same time ranges still share one multi-site DataTable call (cut
+    up per site as it arrives), and identical concurrent calls share a single
+    upstream request.
+
+    Callers go through request_planner, which decides which sites share a call;
+    the grouping here only splits a planned call by what is already cached.
+    """
+    # Sites/measurements arrive both URL-quoted and plain; key on the plain form
+    sites = [s for s in unquote(site).split(",") if s]
+    measurement = unquote(measurement)
+
+    def site_key(name):
+        return ("DataTable", base_url, name, measurement, method or None, interval or None)
+
+    # Sites missing the same ranges (from memory, then from the store) are fetched together
+    groups = {}
+    for name in sites:
+        key = site_key(name)
+        gaps = tuple(window for gap in TIMESERIES_CACHE.missing(key, from_date, to_date)
+                     for window in TIMESERIES_STORE.missing(key, *gap))
+        groups.setdefault(gaps, []).append(name)
+
+    frames = []
+    for group in groups.values():
+        fetch_group = _shared_table_fetch(group, measurement, method, interval, base_url)
+        for name in group:
+            key = site_key(name)
+            fetch = partial(_site_rows, fetch_group, name)
+            frame = TIMESERIES_CACHE.get(key, from_date, to_date, TIMESERIES_STORE.read_through(key, fetch),
+                                         interval=interval)
+            if not frame.empty:
+                frames.append(frame)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def _shared_table_fetch(sites, measurement, method, interval, base_url):
+    """
+    fetch(start, end) -> {site: rows} for one multi-site DataTable call per
+    window, however many of the sites' caches ask for that window.
     """
+    lock = threading.Lock()
+    results = {}
+
+    def fetch(start, end):
+        # Concurrent callers wanting the same table share one upstream request
+        start, end = _coalesced_window(start, end)
+        with lock:
+            if (start, end) not in results:
+                df = _inflight.do(("DataTable", base_url, tuple(sites), measurement, method or None,
+                                   interval or None, start, end), lambda: _fetch_data_table(
+                    quote(",".join(sites)), quote(measurement), format_hilltop_time(start),
+                    format_hilltop_time(end), method, interval, base_url))
+                results[(start, end)] = ({} if df.empty or "SiteName" not in df.columns else
+                                         {name: rows.reset_index(drop=True)
+                                          for name, rows in df.groupby("SiteName", sort=False)})
+            return results[(start, end)]
+    return fetch
+
+
+def _site_rows(fetch_group, site, start, end):
+    return fetch_group(start, end).get(site, pd.DataFrame())
+
+
+def _fetch_data_table(site, measurement, from_date, to_date, method, interval, base_url):
+    """Requests one Hilltop DataTable and parses it (no caching)."""
     log_prefix = "FETCH-DATA-CUSTOM-COLLECTION"
     params = {
         "service": "Hilltop",
@@ -399,40 +807,28 @@ def fetch_data_table_for_custom_collection(
     if verbose:
         print(f"{log_prefix}: Hilltop request:\n{req}")
     
-    response = requests.get(req)
-    
-    if verbose:
-        print(f"{log_prefix}: Response url:\n{response.url}")
-    
-    response.raise_for_status()
-    if verbose:
-        print(f"{log_prefix}: Response status -> {response}")
-    # print(response.text)
-    
-    
-    xml_content = response.text
-
-
-    root = ET.parse(StringIO(xml_content)).getroot()
+    with hilltop_call("DataTable") as call:
+        response = http_get(req, stream=True)
+        
+        if verbose:
+            print(f"{log_prefix}: Response url:\n{response.url}")
+        
+        response.raise_for_status()
+        if verbose:
+            print(f"{log_prefix}: Response status -> {response}")
+        # Stream the body straight into the parser; the raw XML is never held in memory
+        with response, phase("parse"):
+            response.raw.decode_content = True # Let urllib3 undo gzip/deflate
+            columns, n_rows, _ = _stream_data_table(timed_stream(response.raw))
 
-    # Extract all <Results> elements
-    results = []
-    for result in root.findall("Results"):
-        record = {}
-        for child in result:
-            record[child.tag] = child.text
-        results.append(record)
+        call.rows = n_rows
+        if n_rows == 0:
+            return pd.DataFrame()
 
-    # Convert to DataFrame
-    df = pd.DataFrame(results)
+        # All <Results> child tags are kept: SiteName, Time, M1, M2 etc.
+        with phase("convert"):
+            df = _columns_to_frame(columns, n_rows)
 
-    # Optional: convert time and numeric columns
-    if "Time" in df.columns:
-        df["Time"] = pd.to_datetime(df["Time"])
-    for col in df.columns:
-        if col.startswith("M"):
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-   
     if verbose:
         print(f"{log_prefix}: Columns returned: {df.columns.tolist()}")
         print(f"{log_prefix}: First row: {df.iloc[0].to_dict()}")
@@ -0,0 +1,267 @@
+# hilltop_cassette.py
+#
+# Record and replay of Hilltop traffic, for reproducing an event offline.
+#
+# HILLTOP_CASSETTE_MODE=record   every Hilltop request (hilltop_api, trc_api,
+#                                hilltoppy, the pollers...) still goes to the
+#                                server, and is also written to HILLTOP_CASSETTE_DIR:
+#                                one line per request in index.jsonl (URL, status,
+#                                headers, time to headers and body time, sizes) and
+#                                the body gzip-compressed under bodies/, by hash
+# HILLTOP_CASSETTE_MODE=replay   nothing goes to the network: responses come from
+#                                the cassette, delayed as they were when recorded
+#                                (HILLTOP_REPLAY_SPEED=10 plays ten times faster,
+#                                0 without delays)
+#
+# Both work at the transport level (a requests adapter mounted by hilltop_http.py),
+# so every caller and the metrics/tracing around it behave as they do live.
+#
+# A request is matched on its method and URL with the query parameters in any
+# order. Many requests are relative to "now" (from/to, TimeInterval), so when
+# there is no exact match, one with the same parameters apart from those is
+# used. Requests seen several times are answered in recorded order, then the
+# last answer repeats. A request the cassette doesn't have gets a 404 with a
+# Hilltop <Error> body.
+#
+# `python hilltop_cassette.py [dir]` summarises a cassette.
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlsplit
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPResponse
+
+from constants import HILLTOP_CASSETTE_MODE, HILLTOP_CASSETTE_DIR, HILLTOP_REPLAY_SPEED
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# Query parameters that change with the time of the request
+TIME_PARAMS = {"from", "to", "timeinterval"}
+
+# Headers that describe the wire encoding, not the (decoded) body we store
+_WIRE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+def request_keys(method, url):
+    """(exact key, key without the time parameters) for a request."""
+    parts = urlsplit(url)
+    params = sorted((k.lower(), v) for k, v in parse_qsl(parts.query, keep_blank_values=True))
+    path = f"{method} {parts.netloc}{parts.path}"
+    exact = path + "?" + "&".join(f"{k}={v}" for k, v in params)
+    loose = path + "?" + "&".join(f"{k}={v}" for k, v in params if k not in TIME_PARAMS)
+    return exact, loose
+
+
+class Cassette:
+    """A cassette directory: index.jsonl plus gzip-compressed bodies/ by SHA-1."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, "index.jsonl")
+        self.bodies_dir = os.path.join(path, "bodies")
+        self._lock = threading.Lock()
+        self._entries = None            # exact/loose key -> [entries], for replay
+        self._cursors = Counter()       # key -> entries already served
+
+    # --- Recording ---
+
+    def record(self, method, url, status, headers, body, headers_seconds, body_seconds, wire_bytes):
+        """Stores one response; `body` is the decoded body."""
+        digest = hashlib.sha1(body).hexdigest()
+        body_path = os.path.join(self.bodies_dir, f"{digest}.gz")
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        if not os.path.exists(body_path): # Identical bodies are stored once
+            tmp_path = f"{body_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+                f.write(body)
+            os.replace(tmp_path, body_path)
+        entry = {
+            "method": method,
+            "url": url,
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() not in _WIRE_HEADERS},
+            "body": digest,
+            "bytes": len(body),
+            "wire_bytes": wire_bytes,
+            "headers_seconds": round(headers_seconds, 4),
+            "body_seconds": round(body_seconds, 4),
+            "recorded_at": datetime.now().isoformat(timespec="milliseconds"),
+        }
+        # One short append per request, so several workers can record into the same cassette
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    # --- Replay ---
+
+    def entries(self):
+        """All recorded entries, in the order they were recorded."""
+        entries = []
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entries.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _load(self):
+        by_key = defaultdict(list)
+        for entry in self.entries():
+            exact, loose = request_keys(entry["method"], entry["url"])
+            by_key[("exact", exact)].append(entry)
+            by_key[("loose", loose)].append(entry)
+        if verbose:
+            print(f"[CASSETTE] Loaded {sum(len(v) for k, v in by_key.items() if k[0] == 'exact')} responses from {self.path}")
+        return by_key
+
+    def find(self, method, url):
+        """The next recorded entry for this request, or None."""
+        exact, loose = request_keys(method, url)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            for key in (("exact", exact), ("loose", loose)):
+                entries = self._entries.get(key)
+                if entries:
+                    entry = entries[min(self._cursors[key], len(entries) - 1)]
+                    self._cursors[key] += 1
+                    return entry
+        return None
+
+    def body(self, digest):
+        return _read_body(self.bodies_dir, digest)
+
+
+@lru_cache(maxsize=256)
+def _read_body(bodies_dir, digest):
+    with gzip.open(os.path.join(bodies_dir, f"{digest}.gz"), "rb") as f:
+        return f.read()
+
+
+class _PacedBody(io.RawIOBase):
+    """A body that is read no faster than `seconds` for the whole of it."""
+
+    def __init__(self, data, seconds):
+        self._data = io.BytesIO(data)
+        self._size = max(len(data), 1)
+        self._seconds = seconds
+        self._started = time.perf_counter()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._data.readinto(buffer)
+        if self._seconds and n:
+            due = self._started + self._seconds * self._data.tell() / self._size
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return n
+
+
+class RecordingAdapter(HTTPAdapter):
+    """An HTTPAdapter that also writes every response to the cassette."""
+
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, stream=False, **kwargs):
+        t0 = time.perf_counter()
+        response = super().send(request, stream=True, **kwargs)
+        headers_seconds = time.perf_counter() - t0
+        wire_bytes = int(response.headers.get("Content-Length") or 0) or None
+        t1 = time.perf_counter()
+        body = response.raw.read(decode_content=True) # Whole body, even for streamed callers
+        body_seconds = time.perf_counter() - t1
+        try:
+            self.cassette.record(request.method, request.url, response.status_code, response.headers,
+                                 body, headers_seconds, body_seconds, wire_bytes)
+        except OSError as e:
+            print(f"[CASSETTE-RECORD] Could not record {request.url}: {e}")
+        # Hand the caller a fresh body to read, as if it came off the wire
+        return self.build_response(request, _raw_response(response.status_code, response.headers, body, 0))
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers requests from the cassette; never touches the network."""
+
+    def __init__(self, cassette, speed=HILLTOP_REPLAY_SPEED):
+        super().__init__()
+        self.cassette = cassette
+        self.speed = speed
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        log_prefix = "[CASSETTE-REPLAY]"
+        entry = self.cassette.find(request.method, request.url)
+        if entry is None:
+            print(f"{log_prefix} Not in cassette: {request.url}")
+            body = b'<?xml version="1.0" encoding="utf-8"?>\n<HilltopServer><Error>Not in cassette</Error></HilltopServer>'
+            return self.build_response(request, _raw_response(404, {"Content-Type": "text/xml"}, body, 0,
+                                                                 reason="Not in cassette"))
+
+        if self.speed:
+            time.sleep(entry["headers_seconds"] / self.speed)
+        body_seconds = entry["body_seconds"] / self.speed if self.speed else 0
+        raw = _raw_response(entry["status"], entry["headers"], self.cassette.body(entry["body"]), body_seconds)
+        return self.build_response(request, raw)
+
+    def build_response(self, request, raw):
+        return HTTPAdapter.build_response(self, request, raw)
+
+    def close(self):
+        pass
+
+
+def _raw_response(status, headers, body, seconds, reason=None):
+    headers = {k: v for k, v in headers.items() if k.lower() not in _WIRE_HEADERS}
+    headers["Content-Length"] = str(len(body))
+    return HTTPResponse(body=io.BufferedReader(_PacedBody(body, seconds)), headers=headers, status=status,
+                        reason=reason, preload_content=False, decode_content=False)
+
+
+def cassette_adapter(**adapter_kwargs):
+    """
+    The adapter hilltop_http mounts for HILLTOP_CASSETTE_MODE ("record" or
+    "replay"), or None when the mode is unset (live traffic).
+    """
+    if not HILLTOP_CASSETTE_MODE:
+        return None
+    cassette = Cassette(HILLTOP_CASSETTE_DIR)
+    if HILLTOP_CASSETTE_MODE == "record":
+        print(f"[CASSETTE] Recording Hilltop traffic to {HILLTOP_CASSETTE_DIR}")
+        return RecordingAdapter(cassette, **adapter_kwargs)
+    if HILLTOP_CASSETTE_MODE == "replay":
+        print(f"[CASSETTE] Replaying Hilltop traffic from {HILLTOP_CASSETTE_DIR} at speed {HILLTOP_REPLAY_SPEED:g}")
+        return ReplayAdapter(cassette)
+    raise ValueError(f"HILLTOP_CASSETTE_MODE must be 'record' or 'replay', not {HILLTOP_CASSETTE_MODE!r}")
+
+
+if __name__ == "__main__":
+    # Summary of a cassette: requests by type, sizes and the time span recorded
+    cassette = Cassette(sys.argv[1] if len(sys.argv) > 1 else HILLTOP_CASSETTE_DIR)
+    entries = cassette.entries()
+    if not entries:
+        raise SystemExit(f"No recordings in {cassette.path}")
+    by_request = defaultdict(list)
+    for entry in entries:
+        params = {k.lower(): v for k, v in parse_qsl(urlsplit(entry["url"]).query)}
+        by_request[params.get("request", "?")].append(entry)
+    print(f"{cassette.path}: {len(entries)} responses, {entries[0]['recorded_at']} to {entries[-1]['recorded_at']}")
+    for request, group in sorted(by_request.items()):
+        seconds = sorted(e["headers_seconds"] + e["body_seconds"] for e in group)
+        print(f"  {request:<16} {len(group):6d} calls  {sum(e['bytes'] for e in group) / 1e6:9.1f} MB"
+              f"  median {seconds[len(seconds) // 2]:.2f}s  max {seconds[-1]:.2f}s")
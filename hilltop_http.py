@@ -0,0 +1,122 @@
+# hilltop_http.py
+#
+# Shared HTTP transport for every request to the Hilltop server.
+#
+# One requests.Session (and so one urllib3 connection pool per host) is shared by
+# all threads, so DataTable/RecentDataTable/GetData calls reuse warm keep-alive
+# TCP+TLS connections instead of doing a fresh handshake each time. It can also
+# record or replay the traffic (see hilltop_cassette.py).
+
+import os
+import threading
+import time
+from types import ModuleType
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from hilltop_cassette import cassette_adapter
+from constants import (
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _build_session():
+    session = requests.Session()
+    retries = Retry(total=HTTP_MAX_RETRIES,
+                    connect=HTTP_MAX_RETRIES,
+                    read=0,                    # Don't silently re-run slow reads
+                    backoff_factor=0.5,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=("GET",))
+    adapter_kwargs = dict(pool_connections=HTTP_POOL_CONNECTIONS, # Number of hosts to keep pools for
+                          pool_maxsize=HTTP_POOL_MAXSIZE,         # Keep-alive connections per host
+                          pool_block=False,
+                          max_retries=retries)
+    # HILLTOP_CASSETTE_MODE swaps in a recording or replaying adapter (see hilltop_cassette.py)
+    adapter = cassette_adapter(**adapter_kwargs) or HTTPAdapter(**adapter_kwargs)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def get_session():
+    """Returns the process-wide requests.Session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _reset_after_fork():
+    # A forked child (gunicorn worker, background callback) must not share the
+    # parent's pooled sockets, so it builds its own session on first use
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def default_timeout():
+    """(connect, read) timeout tuple used when a caller doesn't pass one."""
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def http_get(url, params=None, timeout=None, **kwargs):
+    """GET through the shared pooled session with the configured connect/read timeouts."""
+    t0 = time.perf_counter()
+    response = get_session().get(url, params=params, timeout=timeout or default_timeout(), **kwargs)
+    metrics.record_response(response, time.perf_counter() - t0, streamed=kwargs.get("stream", False))
+    return response
+
+
+class _HilltoppyRequests(ModuleType):
+    """
+    Stands in for the requests module inside hilltoppy.utils: get() goes through
+    the shared session, everything else (requests.exceptions, which hilltoppy
+    raises once its retries run out, ...) is requests' own.
+    """
+    _env_dash_transport = True
+
+    def __init__(self):
+        super().__init__("requests")
+
+    @staticmethod
+    def get(url, timeout=None, **kwargs):
+        return http_get(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def install_hilltoppy_transport():
+    """
+    Routes hilltoppy's HTTP calls through the shared session.
+
+    hilltoppy calls the module-level requests.get() with a single 60 s timeout and
+    offers no way to pass a session, so its `requests` reference is swapped for a
+    stand-in whose get() uses the pooled session. hilltoppy's `timeout` is dropped
+    on purpose: our separate connect/read timeouts (and retries) apply instead.
+    """
+    from hilltoppy import utils as hilltoppy_utils
+
+    if getattr(hilltoppy_utils.requests, "_env_dash_transport", False):
+        return
+    hilltoppy_utils.requests = _HilltoppyRequests()
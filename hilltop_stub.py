@@ -0,0 +1,384 @@
+# hilltop_stub.py
+#
+# A local stand-in for the TRC Hilltop server, for development without the
+# extranet and for the benchmarks in benchmarks/.
+#
+# It answers the requests the app makes (SiteList, MeasurementList,
+# CollectionList, GetData, DataTable and RecentDataTable) in the same XML shapes
+# Hilltop uses, from synthetic data:
+#
+#   sites         how many sites (every collection holds all of them)
+#   history_days  how far back each record goes
+#   step_minutes  the logging interval of the raw records
+#   gap_fraction  share of readings that are missing, for gap handling
+#   latency       seconds to wait before answering, to mimic the real server
+#
+# Values are a deterministic function of site, measurement and time (a daily or
+# multi-day cycle plus noise, rain in bursts), so any time range can be asked for
+# and the same request always returns the same answer. DataTable and GetData
+# honour method=Total/Average with an interval.
+#
+# Run it and point the app at it:
+#
+#   python hilltop_stub.py --sites 1000 --port 8099 --latency 0.2
+#   HILLTOP_BASE_URL=http://127.0.0.1:8099/ python app.py
+#
+# or in-process: `with HilltopStub(sites=100) as stub: ... stub.base_url ...`.
+
+import argparse
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# Measurement name -> (units, interpolation); values come from _values()
+MEASUREMENTS = {
+    "Stage": ("m", "Instant"),
+    "Flow": ("m3/sec", "Instant"),
+    "Water Temperature (Continuous)": ("oC", "Instant"),
+    "Air Temperature (Continuous)": ("oC", "Instant"),
+    "Rainfall": ("mm", "Incremental"),
+}
+
+# Collection -> measurements its RecentDataTable returns (all sites are in every collection)
+COLLECTIONS = {
+    "WebRivers": ["Stage", "Flow", "Water Temperature (Continuous)"],
+    "WebRainfall": ["Rainfall"],
+    "WebAirTemp": ["Air Temperature (Continuous)"],
+}
+
+DEFAULT_HTS = "boo.hts"
+ROWS_PER_WRITE = 2000   # DataTable rows per chunk of the streamed response
+
+
+def _noise(sites, minutes, salt):
+    """Deterministic pseudo-random numbers in [0, 1) for each (site, minute) pair."""
+    x = np.sin(sites[:, None] * 12.9898 + (minutes[None, :] % 1_000_003) * 78.233 + salt) * 43758.5453
+    return x - np.floor(x)
+
+
+def _values(measurement, sites, minutes):
+    """(sites x times) array of raw readings for `measurement` at the given epoch minutes."""
+    phase = sites[:, None] * 0.37
+    day = 2 * np.pi * minutes[None, :] / 1440
+    noise = _noise(sites, minutes, len(measurement))
+    if measurement == "Stage":
+        return 0.5 + (sites[:, None] % 7) * 0.3 + 0.4 * np.sin(day / 3 + phase) + 0.02 * noise
+    if measurement == "Flow":
+        return (2 + (sites[:, None] % 13) * 8) * (1 + 0.6 * np.sin(day / 3 + phase)) + 0.5 * noise
+    if measurement == "Water Temperature (Continuous)":
+        return 13 + 4 * np.sin(day + phase) + 0.2 * noise
+    if measurement == "Air Temperature (Continuous)":
+        return 14 + 7 * np.sin(day + phase) + 0.5 * noise
+    if measurement == "Rainfall":
+        return np.where(noise > 0.9, (noise - 0.9) * 40, 0.0) # Mostly dry, with showers
+    raise KeyError(measurement)
+
+
+def _lookup(name):
+    """Catalogue name for a requested measurement ("flow", "Water Temperature", ...) or None."""
+    name = (name or "").strip()
+    for candidate in MEASUREMENTS:
+        if candidate.lower() == name.lower():
+            return candidate
+    base = name.split(" (")[0].lower()
+    return next((c for c in MEASUREMENTS if c.split(" (")[0].lower() == base), None)
+
+
+def _parse_time(text, default):
+    if not text or text.lower() == "now":
+        return default
+    try:
+        return pd.Timestamp(text)
+    except ValueError:
+        return pd.to_datetime(text, dayfirst=True) # e.g. 4/7/2025
+
+
+def _interval_minutes(interval):
+    if not interval or interval == "None":
+        return None
+    try:
+        return max(int(pd.Timedelta(interval).total_seconds() // 60), 1)
+    except ValueError:
+        return None
+
+
+class HilltopStub:
+    """Synthetic Hilltop server; start() serves it on a background thread."""
+
+    def __init__(self, sites=100, history_days=30, step_minutes=15, gap_fraction=0.02, latency=0.0,
+                 host="127.0.0.1", port=0, hts=DEFAULT_HTS):
+        self.n_sites = sites
+        self.history_days = history_days
+        self.step_minutes = step_minutes
+        self.gap_fraction = gap_fraction
+        self.latency = latency
+        self.hts = hts
+        self.calls = Counter()      # Requests served, by request type
+        self._calls_lock = threading.Lock()
+        self.site_names = [f"Stub Site {i:05d}" for i in range(sites)]
+        self._site_index = {name: i for i, name in enumerate(self.site_names)}
+        rng = np.random.default_rng(0)
+        # Scattered over Taranaki
+        self.latitudes = np.round(rng.uniform(-39.9, -38.8, sites), 6)
+        self.longitudes = np.round(rng.uniform(173.8, 175.0, sites), 6)
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def base_url(self):
+        """The .hts endpoint, like constants.BASE."""
+        return f"{self.url}{self.hts}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="hilltop-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    # --- Data ---
+
+    def _now(self):
+        step = self.step_minutes
+        return int(time.time() // 60) // step * step
+
+    def _record_minutes(self, start, end):
+        """Epoch minutes of the raw readings between `start` and `end`, within the record."""
+        now = self._now()
+        first = now - self.history_days * 1440
+        lo = max(int(pd.Timestamp(start).value // 60_000_000_000), first)
+        hi = min(int(pd.Timestamp(end).value // 60_000_000_000), now)
+        step = self.step_minutes
+        lo = -(-lo // step) * step
+        return np.arange(lo, hi + 1, step, dtype=np.int64)
+
+    def series(self, sites, measurement, start, end, method=None, interval=None):
+        """
+        (epoch minutes, sites x times values with NaN gaps) for `measurement`,
+        aggregated by `method` ("Total" sums, anything else averages) over `interval`.
+        """
+        idx = np.array([self._site_index[s] for s in sites], dtype=np.float64)
+        minutes = self._record_minutes(start, end)
+        values = _values(measurement, idx, minutes)
+        values[_noise(idx, minutes, 99.0) < self.gap_fraction] = np.nan
+        width = _interval_minutes(interval) if method and method != "None" else None
+        if width is None or minutes.size == 0:
+            return minutes, values
+
+        # Buckets are labelled with their end time, as Hilltop does for totals
+        buckets = (minutes - 1) // width
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        valid = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=1)
+        counts = np.add.reduceat(valid, starts, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            aggregated = sums if method.lower() == "total" else sums / counts
+        aggregated[counts == 0] = np.nan
+        return (buckets[starts] + 1) * width, aggregated
+
+    # --- Responses (each yields the body in pieces) ---
+
+    def site_list(self, params):
+        location = params.get("location")
+        yield '<?xml version="1.0" encoding="utf-8"?>\n<HilltopServer><Agency>Hilltop stub</Agency>'
+        if params.get("collection") and params["collection"] not in COLLECTIONS:
+            yield "</HilltopServer>"
+            return
+        if location:
+            yield "<Projection>NZGD2000</Projection>"
+        for name, lat, lon in zip(self.site_names, self.latitudes, self.longitudes):
+            coords = f"<Latitude>{lat}</Latitude><Longitude>{lon}</Longitude>" if location else ""
+            yield f"<Site Name={quoteattr(name)}>{coords}</Site>"
+        yield "</HilltopServer>"
+
+    def measurement_list(self, params):
+        site = params.get("site")
+        yield '<?xml version="1.0" encoding="utf-8"?>\n<HilltopServer><Agency>Hilltop stub</Agency>'
+        if site not in self._site_index:
+            yield "<Error>No site</Error></HilltopServer>"
+            return
+        now = pd.Timestamp(self._now() * 60_000_000_000)
+        first = now - pd.Timedelta(days=self.history_days)
+        for name, (units, interpolation) in MEASUREMENTS.items():
+            yield (f"<DataSource Name={quoteattr(name)} NumItems=\"1\"><TSType>StdSeries</TSType>"
+                   f"<DataType>SimpleTimeSeries</DataType><Interpolation>{interpolation}</Interpolation>"
+                   f"<From>{first.isoformat()}</From><To>{now.isoformat()}</To>"
+                   f"<Measurement Name={quoteattr(name)}><RequestAs>{escape(name)}</RequestAs><Item>1</Item>"
+                   f"<Units>{units}</Units><Format>#.###</Format></Measurement></DataSource>")
+        yield "</HilltopServer>"
+
+    def collection_list(self, params):
+        yield '<?xml version="1.0" encoding="utf-8"?>\n<HilltopProject>'
+        for collection, measurements in COLLECTIONS.items():
+            yield f"<Collection Name={quoteattr(collection)}>"
+            for name in self.site_names:
+                for measurement in measurements:
+                    yield (f"<Item><SiteName>{escape(name)}</SiteName><Measurement>{escape(measurement)}</Measurement>"
+                           f"<Filename>{self.hts}</Filename></Item>")
+            yield "</Collection>"
+        yield "</HilltopProject>"
+
+    def get_data(self, params):
+        site, measurement = params.get("site"), _lookup(params.get("measurement"))
+        yield '<?xml version="1.0" encoding="utf-8"?>\n<Hilltop><Agency>Hilltop stub</Agency>'
+        if site not in self._site_index or measurement is None:
+            yield "<Error>No data</Error></Hilltop>"
+            return
+        now = pd.Timestamp(self._now() * 60_000_000_000)
+        start, _, end = params.get("timeinterval", "").partition("/")
+        start = _parse_time(start, now - pd.Timedelta(days=self.history_days))
+        end = _parse_time(end, now)
+        minutes, values = self.series([site], measurement, start, end, params.get("method"), params.get("interval"))
+        units, interpolation = MEASUREMENTS[measurement]
+        yield (f"<Measurement SiteName={quoteattr(site)}><DataSource Name={quoteattr(measurement)} NumItems=\"1\">"
+               f"<TSType>StdSeries</TSType><DataType>SimpleTimeSeries</DataType>"
+               f"<Interpolation>{interpolation}</Interpolation><ItemInfo ItemNumber=\"1\">"
+               f"<ItemName>{escape(params.get('measurement'))}</ItemName><ItemFormat>F</ItemFormat>"
+               f"<Divisor>1</Divisor><Units>{units}</Units><Format>#.###</Format></ItemInfo></DataSource>"
+               f"<Data DateFormat=\"Calendar\" NumItems=\"1\">")
+        times = _time_strings(minutes)
+        for t, v in zip(times, values[0]):
+            if not np.isnan(v):
+                yield f"<E><T>{t}</T><I1>{v:.3f}</I1></E>"
+        yield "</Data></Measurement></Hilltop>"
+
+    def data_table(self, params, recent=False):
+        collection = params.get("collection")
+        if collection:
+            sites = self.site_names if collection in COLLECTIONS else []
+            names = COLLECTIONS.get(collection, [])
+        else:
+            sites = [s for s in (params.get("site") or "").split(",") if s in self._site_index]
+            names = (params.get("measurement") or "").split(",")
+        measurements = list(dict.fromkeys(m for m in map(_lookup, names) if m is not None))
+
+        now = pd.Timestamp(self._now() * 60_000_000_000)
+        if recent:
+            start, end, method, interval = now - pd.Timedelta(minutes=self.step_minutes * 4), now, None, None
+        else:
+            start = _parse_time(params.get("from"), now - pd.Timedelta(days=1))
+            end = _parse_time(params.get("to"), now)
+            method, interval = params.get("method"), params.get("interval")
+
+        yield '<?xml version="1.0" encoding="utf-8"?>\n<HilltopServer><Agency>Hilltop stub</Agency>'
+        for i, measurement in enumerate(measurements, start=1):
+            yield (f"<Measurements><ColumnName>M{i}</ColumnName><Measurement>{escape(measurement)}</Measurement>"
+                   f"<Units>{MEASUREMENTS[measurement][0]}</Units></Measurements>")
+
+        # A block of sites at a time keeps memory flat for big collections
+        for lo in range(0, len(sites), 500):
+            block = sites[lo:lo + 500]
+            series = [self.series(block, m, start, end, method, interval) for m in measurements]
+            if not series:
+                break
+            minutes = series[0][0]
+            times = _time_strings(minutes)
+            rows = []
+            for s, site in enumerate(block):
+                name = escape(site)
+                for t in range(len(minutes)):
+                    cells = "".join(f"<M{i}>{values[s, t]:.3f}</M{i}>"
+                                    for i, (_, values) in enumerate(series, start=1) if not np.isnan(values[s, t]))
+                    if not cells:
+                        continue
+                    rows.append(f"<Results><SiteName>{name}</SiteName><Time>{times[t]}</Time>{cells}</Results>")
+                    if len(rows) >= ROWS_PER_WRITE:
+                        yield "".join(rows)
+                        rows = []
+            if rows:
+                yield "".join(rows)
+        yield "</HilltopServer>"
+
+
+def _time_strings(minutes):
+    return np.datetime_as_string(minutes.astype("datetime64[m]"), unit="s")
+
+
+def _handler_for(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like the real server, so pooled sessions are exercised
+
+        def do_GET(self):
+            params = {k.lower(): v for k, v in parse_qsl(urlsplit(self.path).query, keep_blank_values=True)}
+            request = params.get("request", "")
+            responders = {
+                "SiteList": stub.site_list,
+                "MeasurementList": stub.measurement_list,
+                "CollectionList": stub.collection_list,
+                "GetData": stub.get_data,
+                "DataTable": stub.data_table,
+                "RecentDataTable": lambda p: stub.data_table(p, recent=True),
+            }
+            respond = next((fn for name, fn in responders.items() if name.lower() == request.lower()), None)
+            with stub._calls_lock:
+                stub.calls[request] += 1
+            if stub.latency:
+                time.sleep(stub.latency)
+            if respond is None:
+                self.send_error(400, f"Unknown request {request!r}")
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/xml; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for piece in respond(params):
+                    data = piece.encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            if verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic Hilltop server for local development and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--history-days", type=int, default=30)
+    parser.add_argument("--step-minutes", type=int, default=15)
+    parser.add_argument("--gap-fraction", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    args = parser.parse_args()
+
+    stub = HilltopStub(args.sites, args.history_days, args.step_minutes, args.gap_fraction, args.latency,
+                       args.host, args.port)
+    print(f"[HILLTOP-STUB] Serving {args.sites} sites; run the app with HILLTOP_BASE_URL={stub.url}", flush=True)
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
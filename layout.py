@@ -4,6 +4,7 @@ from dash import dcc, html
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import dash_leaflet as dl
+from dash_extensions.javascript import Namespace
 from datetime import datetime, timedelta # Still needed for DatePickerRange defaults
 
 from constants import (
@@ -12,6 +13,13 @@ from constants import (
     # TIME_PERIOD_OPTIONS_INCREMENTAL, TIME_PERIOD_OPTIONS_INSTANTANEOUS, # These are not used directly here
     TARANAKI_MAP_CENTER, DEFAULT_MAP_ZOOM
 )
+from geojson_utils import MAP_LAYER_FORMAT
+from dataset_store import DOWNLOAD_FORMATS
+from downsampling import downsample_frame
+from constants import SCATTERGL_THRESHOLD
+# Client-side map functions defined in assets/map_layer.js
+MAP_LAYER_JS = Namespace("envDash", "mapLayer")
+
 # REMOVED: Imports from data_processing.py that shouldn't be here
 # from data_processing import (
 #     get_rainfall_summary_data, get_flow_status_data, 
@@ -142,6 +150,31 @@ def serve_default_page_layout():
 
 # Quick Reference Page Layouts - these now ACCEPT data as arguments
 # They no longer fetch data themselves
+def time_series_trace(df, x_col, y_col, name=None):
+    """
+    Line trace for a time series, downsampled (peaks kept) to what a chart can
+    show and drawn with WebGL when it still has many points.
+    """
+    df = downsample_frame(df, x_col, y_col)
+    trace = go.Scattergl if len(df) > SCATTERGL_THRESHOLD else go.Scatter
+    return trace(x=df[x_col], y=df[y_col], mode='lines', name=name)
+
+def dataset_figure(combined_df, selected_measurement, x_range=None):
+    """
+    Dataset page chart: one line per site. With `x_range` (start, end) only that
+    window is drawn, so zooming in re-samples at a finer resolution.
+    """
+    if x_range is not None:
+        times = combined_df['DateTime']
+        combined_df = combined_df[(times >= x_range[0]) & (times <= x_range[1])]
+    traces = [time_series_trace(site_df, 'DateTime', 'Value', name=site)
+              for site, site_df in combined_df.groupby('SiteName', sort=False)]
+    layout = go.Layout(title=f'Time Series for {selected_measurement}', xaxis_title='Date', yaxis_title='Value',
+                       uirevision='dataset') # Keep the user's zoom when the data is re-sampled
+    if x_range is not None:
+        layout.xaxis.range = list(x_range)
+    return go.Figure(data=traces, layout=layout)
+
 def serve_quick_reference_rainfall_summary_layout(rainfall_data_df=None):
     """Returns the layout for the Taranaki Rainfall Summary quick reference page."""
     if rainfall_data_df is None or rainfall_data_df.empty:
@@ -179,7 +212,7 @@ def serve_quick_reference_river_flow_status_layout(flow_data_df=None, latest_flo
         table_content = dbc.Alert("No river flow data available for display.", color="warning")
     else:
         latest_flow_display = f"{latest_flow:.1f}" if isinstance(latest_flow, (int, float)) else str(latest_flow)
-        flow_graph_figure = go.Figure(data=[go.Scatter(x=flow_data_df['DateTime'], y=flow_data_df['Flow (m³/s)'], mode='lines')],
+        flow_graph_figure = go.Figure(data=[time_series_trace(flow_data_df, 'DateTime', 'Flow (m³/s)')],
                                      layout=go.Layout(title='Patea at Skinner Rd (Last 7 Days)',
                                                       xaxis_title='Date/Time',
                                                       yaxis_title='Flow (m³/s)',
@@ -215,7 +248,7 @@ def serve_quick_reference_waiwhakaiho_egmont_village_layout(flow_data_df=None, l
         table_content = dbc.Alert("No river flow data available for display.", color="warning")
     else:
         latest_flow_display = f"{latest_flow:.1f}" if isinstance(latest_flow, (int, float)) else str(latest_flow)
-        flow_graph_figure = go.Figure(data=[go.Scatter(x=flow_data_df['DateTime'], y=flow_data_df['Flow (m³/s)'], mode='lines')],
+        flow_graph_figure = go.Figure(data=[time_series_trace(flow_data_df, 'DateTime', 'Flow (m³/s)')],
                                      layout=go.Layout(title='Waiwhakaiho (Last 7 Days)',
                                                       xaxis_title='Date/Time',
                                                       yaxis_title='Flow (m³/s)',
@@ -311,18 +344,24 @@ def serve_map_page_layout():
                     zoom=DEFAULT_MAP_ZOOM,
                     children=[
                         dl.TileLayer(),
-                        # This is the target for the callback, it will receive the dl.Overlay
+                        # One GeoJSON layer holds every site; the map callback only replaces its data.
+                        # Markers and popups are drawn in the browser by assets/map_layer.js.
                         dl.LayersControl(
-                            [dl.Overlay(dl.LayerGroup(id="marker-layer-placeholder"), name="Sites", checked=True)],
+                            [dl.Overlay(
+                                dl.GeoJSON(
+                                    id="marker-layer",
+                                    format=MAP_LAYER_FORMAT,
+                                    pointToLayer=MAP_LAYER_JS("pointToLayer"),
+                                    onEachFeature=MAP_LAYER_JS("bindPopup"),
+                                ),
+                                name="Sites", checked=True)],
                             id="layers-control"
                         ),
-                        html.Div(id="dynamic-map-overlay-container"),
                     ],
                     style={'width': '100%', 'height': '600px', 'margin': "auto", "display": "block"}
                 )
             ]
         ),
-        dcc.Store(id='map-marker-data-store'), # Store to hold processed marker data (used by the logic, but not directly rendered by this new approach)
 
         html.Hr(),
         html.P("Map legend goes here: e.g., Red = High, Orange = Medium, Green = Low")
@@ -385,12 +424,23 @@ def serve_datasets_page_layout():
                 md=3
             ),
             dbc.Col(
-                dbc.Button("Download CSV", id="download-csv-btn", color="success", className="mt-4", 
-                           disabled=True),
+                [
+                    # Links to the server-side download route (see dataset_store.py), set by load_dataset
+                    dbc.Button("Download CSV", id="download-csv-btn", color="success", className="mt-4 me-2", 
+                               disabled=True, external_link=True),
+                    dbc.Button("Parquet", id="download-parquet-btn", color="secondary", outline=True, className="mt-4",
+                               disabled=True, external_link=True,
+                               style={} if "parquet" in DOWNLOAD_FORMATS else {"display": "none"}),
+                ],
                 md=3
             ),
-            dcc.Download(id="download-dataframe-csv"),
         ], className="mb-4"),
+        # Shown while a load runs in the background: sites loaded so far and a preview of their data
+        html.Div(id='dataset-progress', style={'display': 'none'}, children=[
+            html.Small(id='dataset-progress-text'),
+            dbc.Progress(id='dataset-progress-bar', value=0, className="mb-3"),
+            html.Div(id='dataset-partial-output')
+        ]),
         html.Div(id='dataset-output-container', children=[
             dbc.Alert("Select measurement, site(s), and date range, then click 'Load Dataset'.", color="info")
         ])
@@ -405,9 +455,8 @@ def create_dataset_display(combined_df, selected_measurement, selected_sites, st
         html.P(f"Date Range: {start_date} to {end_date}"),
         dbc.Alert(f"Displaying first {min(50, len(combined_df))} rows. Download CSV for full data.", color="info"),
         html.Div(table, style={'maxHeight': '400px', 'overflowY': 'auto'}),
-        dcc.Graph(figure=go.Figure(data=go.Scatter(x=combined_df['DateTime'], y=combined_df['Value'], mode='lines', name='Data'),
-                                   layout=go.Layout(title=f'Time Series for {selected_measurement}', 
-                                                    xaxis_title='Date', yaxis_title='Value')))
+        # Zooming re-draws the visible window from the server-side copy (see callbacks.py)
+        dcc.Graph(id='dataset-graph', figure=dataset_figure(combined_df, selected_measurement))
     ])
 
 def serve_charts_page_layout():
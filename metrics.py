@@ -0,0 +1,393 @@
+# metrics.py
+#
+# Instrumentation of Hilltop calls and caches, served in Prometheus text format
+# on /metrics.
+#
+# Every Hilltop request runs inside hilltop_call(endpoint). Its wall time is
+# split into phases:
+#
+#   network   waiting on the server: the request itself plus every read of a
+#             streamed body (timed by the reader wrapper, see timed_stream)
+#   parse     XML parsing (for streamed responses, the time spent outside reads)
+#   convert   building and typing the DataFrame
+#
+# together with bytes received, rows returned and the outcome. Caches report
+# hit/partial/miss through cache_lookup(). Inside a traced request (see
+# tracing.py) each call and phase is also a span. For hilltoppy calls (GetData,
+# SiteList, ...) parsing and conversion happen inside hilltoppy, so everything
+# after the network is reported as parse.
+#
+# Callback timings and payload sizes (see callback_profiler.py) are summaries:
+# rolling windows of the latest samples, reported as quantiles.
+#
+# Each process keeps its own registry and writes it to METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds. /metrics adds up the files of every worker, so
+# a scrape sees the whole deployment no matter which worker answers it.
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import tracing
+from constants import METRICS_ENABLED, METRICS_DIR, METRICS_FLUSH_INTERVAL, METRICS_FILE_MAX_AGE
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+ROWS_BUCKETS = (1, 10, 100, 1e3, 1e4, 1e5, 1e6)
+
+
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class _Metric:
+    """A counter, histogram or summary: label values -> counts, kept as plain lists so they serialise."""
+
+    def __init__(self, name, help, kind, labelnames, buckets=None, window=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self.window = window
+        self.values = {}
+
+    def _blank(self):
+        # Histogram: per-bucket counts (+Inf last), then sum and count.
+        # Summary: sum, count, then the latest `window` samples.
+        if self.kind == "summary":
+            return [0, 0, []]
+        return [0] * (len(self.buckets) + 3) if self.buckets else [0]
+
+    def add(self, labels, value=1):
+        with _lock:
+            slot = self.values.get(labels)
+            if slot is None:
+                slot = self.values[labels] = self._blank()
+            if self.kind == "summary":
+                slot[0] += value
+                slot[1] += 1
+                slot[2].append(value)
+                if len(slot[2]) > self.window:
+                    del slot[2][:len(slot[2]) - self.window]
+                return
+            if self.buckets is None:
+                slot[0] += value
+                return
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    slot[i] += 1
+                    break
+            else:
+                slot[len(self.buckets)] += 1
+            slot[-2] += value
+            slot[-1] += 1
+
+
+_lock = threading.Lock()
+_registry = {}
+
+
+def _metric(name, help, kind, labelnames, buckets=None, window=None):
+    metric = _registry[name] = _Metric(name, help, kind, labelnames, buckets, window)
+    return metric
+
+
+def counter(name, help, labelnames):
+    """A counter metric; add(labels) counts one."""
+    return _metric(name, help, "counter", labelnames)
+
+
+def summary(name, help, labelnames, window):
+    """A rolling-window summary metric; add(labels, value) records a sample."""
+    return _metric(name, help, "summary", labelnames, window=window)
+
+
+HILLTOP_SECONDS = _metric("hilltop_request_seconds", "Hilltop call time by phase (network, parse, convert, total)",
+                          "histogram", ("endpoint", "phase"), SECONDS_BUCKETS)
+HILLTOP_BYTES = _metric("hilltop_response_bytes", "Bytes received per Hilltop call",
+                        "histogram", ("endpoint",), BYTES_BUCKETS)
+HILLTOP_ROWS = _metric("hilltop_response_rows", "Rows returned per Hilltop call",
+                       "histogram", ("endpoint",), ROWS_BUCKETS)
+HILLTOP_CALLS = _metric("hilltop_requests_total", "Hilltop calls by outcome",
+                        "counter", ("endpoint", "outcome"))
+CACHE_LOOKUPS = _metric("cache_lookups_total", "Cache lookups by cache and result (hit, partial, miss, stale)",
+                        "counter", ("cache", "result"))
+
+
+# --- Recording ---
+
+class _Call:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.stream_seconds = 0.0   # Read time inside a timed "parse" phase, moved to network
+        self.bytes = 0
+        self.rows = None
+
+
+_local = threading.local()
+
+
+def _current():
+    stack = getattr(_local, "calls", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def hilltop_call(endpoint):
+    """
+    Times one Hilltop call. The body can set `.rows` on the yielded object;
+    http_get and timed_stream add network time and bytes to it automatically.
+    """
+    call = _Call(endpoint)
+    stack = getattr(_local, "calls", None)
+    if stack is None:
+        stack = _local.calls = []
+    stack.append(call)
+    outcome = "ok"
+    with tracing.span(f"hilltop {endpoint}") as span:
+        try:
+            yield call
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            stack.pop()
+            if span is not None:
+                span.set("hilltop.bytes", call.bytes)
+                span.set("hilltop.network_seconds", round(call.phases.get("network", 0.0), 4))
+                if call.rows is not None:
+                    span.set("hilltop.rows", call.rows)
+            if METRICS_ENABLED:
+                _record(call, time.perf_counter() - call.started, outcome)
+
+
+def _record(call, total, outcome):
+    phases = dict(call.phases)
+    if "parse" in phases:
+        phases["parse"] = max(phases["parse"] - call.stream_seconds, 0.0)
+    else:
+        # hilltoppy parsed and converted it: everything that wasn't network
+        phases["parse"] = max(total - phases.get("network", 0.0) - phases.get("convert", 0.0), 0.0)
+    phases["total"] = total
+    for phase, seconds in phases.items():
+        HILLTOP_SECONDS.add((call.endpoint, phase), seconds)
+    if call.bytes:
+        HILLTOP_BYTES.add((call.endpoint,), call.bytes)
+    if call.rows is not None:
+        HILLTOP_ROWS.add((call.endpoint,), call.rows)
+    HILLTOP_CALLS.add((call.endpoint, outcome))
+    _ensure_flusher()
+    if verbose:
+        print(f"[METRICS] {call.endpoint} {outcome}: " + ", ".join(f"{k}={v:.3f}s" for k, v in phases.items()))
+
+
+@contextmanager
+def phase(name):
+    """Times the block as `name` for the Hilltop call running on this thread (no-op outside one)."""
+    call = _current()
+    t0 = time.perf_counter()
+    with tracing.span(name):
+        try:
+            yield
+        finally:
+            if call is not None:
+                call.phases[name] += time.perf_counter() - t0
+
+
+def record_response(response, seconds, streamed):
+    """
+    Called by hilltop_http for every request: network time and, for bodies that
+    were read in full, their size (streamed bodies are counted by timed_stream).
+    """
+    call = _current()
+    if call is None:
+        return
+    call.phases["network"] += seconds
+    if not streamed:
+        call.bytes += len(response.content or b"")
+        tracing.record_span("network", seconds, **{"http.status_code": response.status_code})
+
+
+class _TimedReader:
+    """File-like wrapper counting the time and bytes of each read of a streamed body."""
+
+    def __init__(self, raw, call):
+        self._raw = raw
+        self._call = call
+
+    def read(self, *args):
+        t0 = time.perf_counter()
+        data = self._raw.read(*args)
+        seconds = time.perf_counter() - t0
+        self._call.phases["network"] += seconds
+        self._call.stream_seconds += seconds
+        self._call.bytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def timed_stream(raw):
+    """`raw` wrapped so reads count as network time of the current Hilltop call."""
+    call = _current()
+    return _TimedReader(raw, call) if call is not None else raw
+
+
+def cache_lookup(cache, result):
+    """Counts a lookup in `cache` ("memory", "disk", "app") as hit, partial, miss or stale."""
+    if METRICS_ENABLED:
+        CACHE_LOOKUPS.add((cache, result))
+        _ensure_flusher()
+
+
+# --- Sharing between workers ---
+
+_flusher = None
+
+
+def _dump():
+    with _lock:
+        return {name: [[list(labels), [list(v) if isinstance(v, list) else v for v in slot]]
+                       for labels, slot in metric.values.items()]
+                for name, metric in _registry.items()}
+
+
+def flush():
+    """Writes this process's metrics to METRICS_DIR/<pid>.json."""
+    log_prefix = "[METRICS-FLUSH]"
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(_dump(), f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"{log_prefix} Could not write {path}: {e}")
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True)
+                _flusher.start()
+
+
+def _reset_after_fork():
+    # A forked worker starts with empty metrics (the parent's are in its own file)
+    global _flusher, _lock
+    _lock = threading.Lock()
+    _flusher = None
+    _local.__dict__.clear()
+    for metric in _registry.values():
+        metric.values = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _merged():
+    """
+    Every worker's metrics added together (this process's own are always
+    current). Summary sample windows are concatenated.
+    """
+    flush()
+    totals = {name: {} for name in _registry}
+    try:
+        paths = [e.path for e in os.scandir(METRICS_DIR) if e.name.endswith(".json")]
+    except OSError:
+        paths = []
+    now = time.time()
+    for path in paths:
+        try:
+            if now - os.path.getmtime(path) > METRICS_FILE_MAX_AGE:
+                os.remove(path) # Left by a worker that is long gone
+                continue
+            with open(path, encoding="utf-8") as f:
+                dump = json.load(f)
+        except (OSError, ValueError):
+            continue # Being replaced by its worker
+        for name, entries in dump.items():
+            if name not in totals:
+                continue
+            for labels, slot in entries:
+                labels = tuple(labels)
+                current = totals[name].get(labels)
+                totals[name][labels] = slot if current is None else [a + b for a, b in zip(current, slot)]
+    return totals
+
+
+def merged():
+    """{metric name: {label values: slot}} across all workers."""
+    return _merged()
+
+
+def quantile(samples, q):
+    """The q-quantile (nearest rank) of a list of samples, or None if there are none."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, values in _merged().items():
+        metric = _registry[name]
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, slot in sorted(values.items()):
+            if metric.kind == "summary":
+                for q in SUMMARY_QUANTILES:
+                    value = quantile(slot[2], q)
+                    if value is not None:
+                        lines.append(f"{name}{_labels(metric.labelnames, labels, ('quantile', q))} {value}")
+                lines.append(f"{name}_sum{_labels(metric.labelnames, labels)} {slot[0]}")
+                lines.append(f"{name}_count{_labels(metric.labelnames, labels)} {slot[1]}")
+                continue
+            if metric.buckets is None:
+                lines.append(f"{name}{_labels(metric.labelnames, labels)} {slot[0]}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ("+Inf",), slot):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{name}_bucket{_labels(metric.labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, labels)} {slot[-2]}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, labels)} {slot[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def register_metrics_route(server):
+    """Adds /metrics to the app's Flask server."""
+    from flask import Response
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+
+    return metrics
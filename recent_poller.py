@@ -0,0 +1,236 @@
+# recent_poller.py
+#
+# Background RecentDataTable pollers, one per Hilltop collection.
+#
+# Each poller calls RecentDataTable on a fixed cadence and publishes an immutable,
+# versioned snapshot of the latest value per site and measurement. Map callbacks
+# read the snapshot (a dictionary lookup) instead of asking Hilltop themselves, so
+# the upstream load stays at one request per collection per cadence no matter
+# how many people are looking at the map.
+#
+# Only one process polls: the gunicorn master (see gunicorn.conf.py), the
+# single-process app, or a sidecar (`python recent_poller.py`, with
+# RECENT_POLL_ENABLED=0 for the app). Every snapshot is also pickled to
+# RECENT_POLL_SNAPSHOT_DIR, and latest_values() in any process uses the newest
+# of its own poller's snapshot and the published one, so workers never poll.
+
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from hilltop_api import fetch_and_parse_recent_hilltop_data, latest_valid_by_key
+from constants import RECENT_POLL_COLLECTIONS, RECENT_POLL_INTERVAL, RECENT_POLL_MAX_AGE, RECENT_POLL_SNAPSHOT_DIR
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# version: increments on every successful poll; fetched_at: time.time() of that poll
+# latest: SiteName plus, per "Measurement (Units)" column, the value and <column>_Time
+LatestSnapshot = namedtuple("LatestSnapshot", ["collection", "version", "fetched_at", "latest", "columns"])
+
+
+class RecentDataPoller:
+    """Polls RecentDataTable for one collection on a background thread."""
+
+    def __init__(self, collection, interval=RECENT_POLL_INTERVAL, fetch=fetch_and_parse_recent_hilltop_data):
+        self.collection = collection
+        self.interval = interval
+        self._fetch = fetch
+        self._snapshot = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """The most recent LatestSnapshot, or None before the first successful poll."""
+        return self._snapshot
+
+    def poll_once(self):
+        log_prefix = "[RECENT-POLLER]"
+        df = self._fetch(collection=self.collection)
+        columns = [c for c in df.columns if c not in ("SiteName", "Time")]
+        latest = latest_valid_by_key(df, columns) if columns else pd.DataFrame(columns=["SiteName"])
+        previous = self._snapshot
+        # Readers just grab the attribute, so swapping in a new tuple is all the locking they need
+        self._snapshot = LatestSnapshot(self.collection,
+                                        previous.version + 1 if previous else 1,
+                                        time.time(),
+                                        latest,
+                                        tuple(columns))
+        _publish(self._snapshot)
+        if verbose:
+            print(f"{log_prefix} {self.collection}: v{self._snapshot.version}, {len(latest)} sites, columns {columns}")
+        return self._snapshot
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"recent-poller-{self.collection}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        log_prefix = "[RECENT-POLLER]"
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"{log_prefix} {self.collection}: poll failed, keeping previous snapshot: {e}")
+            self._stop.wait(self.interval)
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+_published = {} # collection -> ((mtime_ns, size), LatestSnapshot) of the last published file read
+_published_lock = threading.Lock()
+
+
+def _snapshot_path(collection):
+    return os.path.join(RECENT_POLL_SNAPSHOT_DIR, f"{collection}.pkl")
+
+
+def _publish(snapshot):
+    """Pickles `snapshot` for the other processes (atomically, so readers never see half a file)."""
+    log_prefix = "[RECENT-POLLER-PUBLISH]"
+    path = _snapshot_path(snapshot.collection)
+    try:
+        os.makedirs(RECENT_POLL_SNAPSHOT_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"{log_prefix} Could not write snapshot {path}: {e}")
+
+
+def _read_published(collection):
+    """The snapshot last published by the polling process, or None. Re-read only when the file changes."""
+    log_prefix = "[RECENT-POLLER-READ]"
+    path = _snapshot_path(collection)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _published_lock:
+        cached = _published.get(collection)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        print(f"{log_prefix} Ignoring unreadable snapshot {path}: {e}")
+        return None
+    with _published_lock:
+        _published[collection] = (version, snapshot)
+    return snapshot
+
+
+def current_snapshot(collection):
+    """
+    The newest LatestSnapshot for `collection`: this process's own poller's or
+    the published one, or None if there is neither. Never starts a poller.
+    """
+    with _pollers_lock:
+        poller = _pollers.get(collection)
+    candidates = [poller.snapshot() if poller is not None else None, _read_published(collection)]
+    return max((s for s in candidates if s is not None), key=lambda s: s.fetched_at, default=None)
+
+
+def get_poller(collection, start=True):
+    """The shared poller for `collection`, created (and started) on first use."""
+    with _pollers_lock:
+        poller = _pollers.get(collection)
+        if poller is None:
+            poller = _pollers[collection] = RecentDataPoller(collection)
+    if start:
+        poller.start()
+    return poller
+
+
+def start_pollers(collections):
+    for collection in collections:
+        get_poller(collection)
+
+
+def stop_pollers():
+    """Stops every poller (their snapshots are kept), e.g. in a preloading master."""
+    with _pollers_lock:
+        pollers = list(_pollers.values())
+    for poller in pollers:
+        poller.stop()
+
+
+def forget_pollers():
+    """
+    Drops this process's pollers, e.g. the copies a forked worker inherits (their
+    threads didn't survive the fork); latest_values() then reads the published snapshots.
+    """
+    with _pollers_lock:
+        _pollers.clear()
+
+
+def _match_columns(columns, measures):
+    """
+    Snapshot columns ("Measurement (Units)") for a comma-separated measure list,
+    in measure order. "Flow" matches "Flow (m3/sec)"; "Air Temperature (Continuous)"
+    matches "Air Temperature (Continuous) (oC)" or, failing that, "Air Temperature (oC)".
+    """
+    matched = []
+    for measure in (m.strip() for m in measures.split(",")):
+        base = measure.split(" (")[0]
+        for candidate in (measure, base):
+            hits = [c for c in columns if c == candidate or c.startswith(candidate + " (")]
+            if hits:
+                matched.extend(h for h in hits if h not in matched)
+                break
+    return matched
+
+
+def latest_values(collection, measures, max_age=RECENT_POLL_MAX_AGE):
+    """
+    Latest reading per site from the newest poller snapshot (see
+    current_snapshot), as a DataFrame with
+    SiteName, M1 (value) and Time. When a measure list matches several columns
+    they are combined in order, like M1/M2 for rainfall.
+
+    Returns None if there is no snapshot younger than `max_age` seconds or it has
+    no matching column, so callers can fall back to fetching from Hilltop.
+    """
+    snapshot = current_snapshot(collection)
+    if snapshot is None or time.time() - snapshot.fetched_at > max_age:
+        return None
+
+    columns = _match_columns(snapshot.columns, measures)
+    if not columns:
+        return None
+
+    latest = snapshot.latest
+    values = latest[columns[0]]
+    times = latest[f"{columns[0]}_Time"]
+    for col in columns[1:]:
+        times = times.where(values.notna(), latest[f"{col}_Time"])
+        values = values.combine_first(latest[col])
+
+    result = pd.DataFrame({"SiteName": latest["SiteName"], "M1": values, "Time": times})
+    return result.dropna(subset=["M1"]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    # Sidecar: the only poller for every app process (run those with RECENT_POLL_ENABLED=0).
+    # Imported by name so the published snapshots unpickle as recent_poller.LatestSnapshot.
+    import recent_poller
+    recent_poller.start_pollers(RECENT_POLL_COLLECTIONS)
+    threading.Event().wait()
@@ -0,0 +1,197 @@
+# request_planner.py
+#
+# Merges many small (site, measurement, window) requests into as few Hilltop
+# DataTable calls as possible.
+#
+# DataTable accepts comma-separated site and measurement lists and returns one
+# row per site/time with an M1, M2, ... column per requested measurement (the
+# same trick process_map_data_2 uses for whole collections). The planner groups
+# compatible requests, keeps each call's URL under PLANNER_MAX_URL_LENGTH, runs
+# the calls concurrently and splits the M-columns back out per request.
+#
+# This is the one batching policy: every time series request in the app (the
+# dataset page, the collection map, and fetch_data/fetch_rollup for the quick
+# reference pages) is planned here. Each planned call then goes through
+# fetch_data_table_for_custom_collection, which only narrows it: sites whose
+# ranges are already cached or stored are dropped from the upstream request,
+# and sites missing different ranges are split into separate calls, but sites
+# are never merged beyond what the plan put together.
+
+from collections import namedtuple, OrderedDict
+from functools import partial
+from urllib.parse import quote
+
+import pandas as pd
+
+from hilltop_api import fetch_data_table_for_custom_collection
+from fetch_engine import iter_concurrently, FetchResult
+from tracing import traced
+from constants import BASE, PLANNER_MAX_URL_LENGTH, PLANNER_MAX_SITES_PER_CALL
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# One logical request. `measurement` may itself be a comma-separated list
+# (e.g. "Rainfall,Rainfall SCADA"); its parts come back as M1, M2, ... in that order.
+HilltopRequest = namedtuple("HilltopRequest", ["site", "measurement", "from_date", "to_date", "method", "interval"])
+
+# One DataTable call and the indexes of the requests it answers
+PlannedCall = namedtuple("PlannedCall", ["sites", "measurements", "from_date", "to_date", "method", "interval", "members"])
+
+
+def _split_measurements(measurement):
+    return tuple(m.strip() for m in measurement.split(",") if m.strip())
+
+
+def _url_length(base_url, sites, measurements, from_date, to_date, method, interval):
+    """Length of the DataTable URL fetch_data_table_for_custom_collection will build."""
+    return len(f"{base_url}?service=Hilltop&request=DataTable"
+               f"&site={quote(','.join(sites))}&measurement={quote(','.join(measurements))}"
+               f"&from={from_date}&to={to_date}&method={method}&interval={interval}")
+
+
+def plan_requests(requests, base_url=BASE, max_url_length=PLANNER_MAX_URL_LENGTH,
+                  max_sites_per_call=PLANNER_MAX_SITES_PER_CALL):
+    """
+    Groups `requests` (HilltopRequest) into PlannedCalls.
+
+    Requests can share a call when they have the same window, method and interval.
+    Within that, each site's measurements are combined, and sites that need the
+    same measurement list are batched together until the URL or site count limit
+    is reached.
+    """
+    windows = OrderedDict()
+    for i, req in enumerate(requests):
+        window = (str(req.from_date), str(req.to_date), req.method or "", req.interval or "")
+        windows.setdefault(window, OrderedDict()).setdefault(req.site, []).append(i)
+
+    calls = []
+    for (from_date, to_date, method, interval), sites in windows.items():
+        # Sites wanting the same measurements can share one multi-site call
+        by_measurements = OrderedDict()
+        for site, members in sites.items():
+            measurements = []
+            for i in members:
+                for m in _split_measurements(requests[i].measurement):
+                    if m not in measurements:
+                        measurements.append(m)
+            by_measurements.setdefault(tuple(measurements), []).append((site, members))
+
+        for measurements, site_members in by_measurements.items():
+            batch_sites, batch_members = [], []
+            for site, members in site_members:
+                candidate = batch_sites + [site]
+                too_long = _url_length(base_url, candidate, measurements, from_date, to_date,
+                                       method, interval) > max_url_length
+                if batch_sites and (too_long or len(candidate) > max_sites_per_call):
+                    calls.append(PlannedCall(tuple(batch_sites), measurements, from_date, to_date,
+                                             method, interval, tuple(batch_members)))
+                    batch_sites, batch_members = [], []
+                batch_sites.append(site)
+                batch_members.extend(members)
+            if batch_sites:
+                calls.append(PlannedCall(tuple(batch_sites), measurements, from_date, to_date,
+                                         method, interval, tuple(batch_members)))
+    return calls
+
+
+def _demultiplex(call, df, request):
+    """Cuts one request's rows and M-columns out of a combined DataTable result."""
+    if df is None or df.empty or "SiteName" not in df.columns:
+        return pd.DataFrame()
+
+    wanted = _split_measurements(request.measurement)
+    source_cols = {f"M{call.measurements.index(m) + 1}": f"M{j + 1}" for j, m in enumerate(wanted)}
+    present = [c for c in source_cols if c in df.columns]
+
+    rows = df[df["SiteName"] == request.site]
+    out = rows[["SiteName", "Time"] + present].rename(columns=source_cols)
+    out = out.dropna(subset=[source_cols[c] for c in present], how="all") if present else out.iloc[0:0]
+    return out.reset_index(drop=True)
+
+
+def _call_task(call, base_url):
+    return partial(fetch_data_table_for_custom_collection,
+                   quote(",".join(call.sites)),
+                   quote(",".join(call.measurements)),
+                   from_date=call.from_date,
+                   to_date=call.to_date,
+                   method=call.method,
+                   interval=call.interval,
+                   base_url=base_url)
+
+
+def iter_plan(calls, requests, base_url=BASE):
+    """
+    Runs the planned calls concurrently and yields one FetchResult per request
+    as soon as the call answering it finishes (completion order).
+    """
+    log_prefix = "[REQUEST-PLANNER-EXECUTE]"
+    tasks = [(call, _call_task(call, base_url)) for call in calls]
+    if verbose:
+        print(f"{log_prefix} {len(requests)} requests -> {len(calls)} DataTable calls")
+
+    for result in iter_concurrently(tasks):
+        call = result.key
+        for i in call.members:
+            request = requests[i]
+            if result.error is not None:
+                yield FetchResult(request, None, result.error)
+            else:
+                yield FetchResult(request, _demultiplex(call, result.value, request), None)
+
+
+def execute_plan(calls, requests, base_url=BASE):
+    """Runs the planned calls concurrently; returns one FetchResult per request, in request order."""
+    position = {id(request): i for i, request in enumerate(requests)}
+    results = [None] * len(requests)
+    for result in iter_plan(calls, requests, base_url=base_url):
+        results[position[id(result.key)]] = result
+    return results
+
+
+def fetch_batch(requests, base_url=BASE):
+    """
+    Plans, executes and demultiplexes a batch of HilltopRequests.
+
+    Returns a list of FetchResult (key=request, value=DataFrame with SiteName,
+    Time, M1, M2, ...) in the same order as `requests`.
+    """
+    requests = list(requests)
+    return execute_plan(plan_requests(requests, base_url=base_url), requests, base_url=base_url)
+
+
+def iter_batch(requests, base_url=BASE):
+    """Like fetch_batch, but yields each request's FetchResult as soon as it is ready."""
+    requests = list(requests)
+    return iter_plan(plan_requests(requests, base_url=base_url), requests, base_url=base_url)
+
+
+@traced()
+def fetch_collection_table(site_names, measurements, from_date, to_date, method, interval, base_url=BASE):
+    """
+    DataTable for a whole collection of sites that all want the same measurements.
+
+    The site list is split into URL/size-bounded chunks which are fetched
+    concurrently and merged as they arrive, giving the same SiteName, Time, M1,
+    M2, ... frame a single call would. Raises only if every chunk fails.
+    """
+    log_prefix = "[REQUEST-PLANNER-COLLECTION]"
+    requests = [HilltopRequest(site, measurements, from_date, to_date, method, interval) for site in site_names]
+    calls = plan_requests(requests, base_url=base_url)
+    if verbose:
+        print(f"{log_prefix} {len(site_names)} sites -> {len(calls)} DataTable chunk(s)")
+
+    frames, errors = [], []
+    for result in iter_concurrently([(call, _call_task(call, base_url)) for call in calls]):
+        if result.error is not None:
+            print(f"{log_prefix} Chunk of {len(result.key.sites)} sites failed: {result.error}")
+            errors.append(result.error)
+        elif result.value is not None and not result.value.empty:
+            frames.append(result.value)
+
+    if errors and len(errors) == len(calls):
+        raise errors[0]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
@@ -0,0 +1,212 @@
+# rollups.py
+#
+# Multi-resolution aggregates ("rollup pyramid") of Hilltop time series.
+#
+# For each series we keep hourly, daily, monthly and annual buckets holding the
+# sum, count and maximum of the values in them (so totals, means and maxima can
+# all be answered). They are built once as data is ingested and updated
+# incrementally: only time ranges that haven't been ingested before are added,
+# and only the coarser buckets those ranges touch are recomputed.
+#
+# Requests are answered from the coarsest level that can express them (a decade
+# of daily totals reads ~3,650 daily buckets, not the raw 5-minute points).
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from timeseries_cache import to_timestamp, merge_ranges, subtract_ranges
+from constants import ROLLUP_MAX_SERIES
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# Finest to coarsest
+LEVELS = ["h", "D", "MS", "YS"]
+_LEVEL_STEPS = {"h": pd.Timedelta(hours=1), "D": pd.Timedelta(days=1)}
+
+# Hilltop interval names and pandas aliases accepted for `freq`
+_FREQ_ALIASES = {
+    "1 hour": "h", "hour": "h", "h": "h", "H": "h",
+    "1 day": "D", "day": "D", "D": "D",
+    "1 month": "MS", "month": "MS", "MS": "MS", "M": "MS",
+    "1 year": "YS", "year": "YS", "YS": "YS", "Y": "YS", "A": "YS",
+}
+
+STATS = ("sum", "mean", "max", "count")
+
+
+def floor_to_level(ts, level):
+    """Bucket start for a Timestamp or DatetimeIndex at `level`."""
+    if level in _LEVEL_STEPS:
+        return ts.floor(level)
+    period = "M" if level == "MS" else "Y"
+    return ts.to_period(period).to_timestamp()
+
+
+def ceil_to_level(ts, level):
+    """Smallest bucket boundary at or after `ts`."""
+    start = floor_to_level(ts, level)
+    if start == ts:
+        return ts
+    return start + (_LEVEL_STEPS[level] if level in _LEVEL_STEPS else pd.tseries.frequencies.to_offset(level))
+
+
+def level_for(freq):
+    """
+    (level, resample rule) for a requested frequency: the coarsest stored level
+    whose buckets divide it, e.g. "1 day" -> ("D", None), "3h" -> ("h", "3h").
+    """
+    if freq in _FREQ_ALIASES:
+        return _FREQ_ALIASES[freq], None
+    try:
+        step = pd.Timedelta(freq)
+    except ValueError:
+        raise ValueError(f"Unsupported rollup frequency: {freq!r}")
+    for level in ("D", "h"):
+        if step % _LEVEL_STEPS[level] == pd.Timedelta(0):
+            return level, freq
+    raise ValueError(f"Rollup frequency {freq!r} is finer than an hour")
+
+
+class _Series:
+    def __init__(self, levels, columns):
+        self.lock = threading.RLock()
+        self.ranges = []   # Merged (start, end) ranges already ingested
+        self.columns = columns
+        self.levels = {level: pd.DataFrame(columns=columns, dtype="float64",
+                                           index=pd.DatetimeIndex([], name="Time"))
+                       for level in levels}
+
+
+class RollupPyramid:
+    """
+    Rollups for many series, keyed like TIMESERIES_CACHE, built from raw values
+    (sum, count and max at every level).
+    """
+
+    def __init__(self, max_series=ROLLUP_MAX_SERIES):
+        self.max_series = max_series
+        self._series = OrderedDict() # LRU order, oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key, start, end, freq="1 day", stat="sum", fetch_raw=None):
+        """
+        `stat` per bucket of `freq` for [start, end], as a DataFrame with Time and
+        the stat. Missing ranges are fetched with `fetch_raw(start, end)` and
+        ingested first.
+        """
+        log_prefix = "[ROLLUPS-GET]"
+        if stat not in STATS:
+            raise ValueError(f"Unsupported rollup stat: {stat!r}")
+        level, rule = level_for(freq)
+        start = to_timestamp(start)
+        end = to_timestamp(end) or pd.Timestamp.now()
+
+        series = self._get_series(key)
+
+        with series.lock: # One ingest per series at a time, so nothing is added twice
+            # Whole buckets only, so edge buckets hold complete totals
+            window_start = floor_to_level(start, level)
+            window_end = ceil_to_level(end, level)
+            gaps = subtract_ranges(window_start, window_end, series.ranges)
+            if verbose:
+                print(f"{log_prefix} {key} {stat}/{freq}: level {level}, {len(gaps)} gap(s) to ingest")
+            for gap_start, gap_end in gaps:
+                self._ingest_raw(series, fetch_raw(gap_start, gap_end), gap_start, gap_end)
+            return self._query(series, level, rule, stat, start, end)
+
+    def ingest_raw(self, key, frame, start, end, time_col="Time", value_col="Value"):
+        """Adds raw values for [start, end] that haven't been ingested yet."""
+        series = self._get_series(key)
+        with series.lock:
+            self._ingest_raw(series, frame, to_timestamp(start), to_timestamp(end), time_col, value_col)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    # --- Internals ---
+
+    def _get_series(self, key):
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(LEVELS, ["sum", "count", "max"])
+                while len(self._series) > self.max_series:
+                    self._series.popitem(last=False)
+            self._series.move_to_end(key)
+            return series
+
+    def _values(self, frame, time_col, value_col):
+        if frame is None or frame.empty or time_col not in frame.columns or value_col not in frame.columns:
+            return pd.Series(dtype="float64", index=pd.DatetimeIndex([]))
+        values = pd.Series(pd.to_numeric(frame[value_col], errors="coerce").to_numpy(),
+                           index=pd.DatetimeIndex(pd.to_datetime(frame[time_col])))
+        return values[values.notna()]
+
+    def _mark_ingested(self, series, start, end, last_time):
+        # Ranges reaching the present are only complete up to the newest value
+        # seen; later values stamped before `end` will still arrive
+        if end >= pd.Timestamp.now():
+            end = min(end, last_time) if last_time is not None else start
+        if end > start:
+            series.ranges = merge_ranges(series.ranges + [(start, end)])
+
+    def _ingest_raw(self, series, frame, start, end, time_col="Time", value_col="Value"):
+        values = self._values(frame, time_col, value_col)
+        # Skip anything inside already-ingested ranges (boundaries included)
+        keep = np.ones(len(values), dtype=bool)
+        for r_start, r_end in series.ranges:
+            keep &= ~((values.index >= r_start) & (values.index <= r_end))
+        values = values[keep & (values.index >= start) & (values.index <= end)]
+        last_time = values.index.max() if len(values) else None
+
+        if len(values):
+            hours = values.groupby(floor_to_level(values.index, "h")).agg(["sum", "count", "max"])
+            hours.index.name = "Time"
+            series.levels["h"] = self._combine(series.levels["h"], hours)
+            self._rebuild_coarser(series, "h", hours.index.min(), hours.index.max())
+        self._mark_ingested(series, start, end, last_time)
+
+    def _combine(self, existing, new):
+        """Merges bucket aggregates, adding sums/counts and taking the max where buckets overlap."""
+        if existing.empty:
+            return new.sort_index()
+        both = pd.concat([existing, new])
+        merged = both.groupby(level=0).agg({"sum": "sum", "count": "sum", "max": "max"})
+        return merged.sort_index()
+
+    def _rebuild_coarser(self, series, from_level, touched_start, touched_end):
+        """Recomputes the coarser buckets that overlap [touched_start, touched_end]."""
+        fine_level = from_level
+        for level in LEVELS[LEVELS.index(from_level) + 1:]:
+            lo = floor_to_level(touched_start, level)
+            hi = ceil_to_level(touched_end + pd.Timedelta(microseconds=1), level)
+            fine = series.levels[fine_level]
+            fine = fine[(fine.index >= lo) & (fine.index < hi)]
+            agg = {c: ("max" if c == "max" else "sum") for c in series.columns}
+            coarse = fine.groupby(floor_to_level(fine.index, level)).agg(agg)
+            coarse.index.name = "Time"
+            existing = series.levels[level]
+            existing = existing[(existing.index < lo) | (existing.index >= hi)]
+            series.levels[level] = pd.concat([existing, coarse]).sort_index() if not existing.empty else coarse
+            fine_level = level
+
+    def _query(self, series, level, rule, stat, start, end):
+        frame = series.levels[level]
+        frame = frame[(frame.index >= floor_to_level(start, level)) & (frame.index <= end)]
+        if rule is not None:
+            agg = {c: ("max" if c == "max" else "sum") for c in series.columns}
+            frame = frame.resample(rule).agg(agg).dropna(how="all")
+        if stat == "mean":
+            values = frame["sum"] / frame["count"]
+        else:
+            values = frame[stat]
+        return values.rename(stat).reset_index()
+
+
+# Shared pyramid used by hilltop_api
+ROLLUPS = RollupPyramid()
@@ -0,0 +1,277 @@
+# site_registry.py
+#
+# One shared, lazily loaded copy of the Hilltop site list (and the per-collection
+# site lists used by the maps/datasets pages).
+#
+# Nothing here touches the network at import time. The first caller either loads
+# the local snapshot file (fast path, milliseconds) or, if there is no usable
+# snapshot, fetches from Hilltop once and writes the snapshot for the next start.
+# Stale snapshots are served immediately and refreshed on a background thread.
+
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+from hilltoppy import web_service as ws
+
+from hilltop_http import install_hilltoppy_transport
+from metrics import hilltop_call
+from constants import (
+    TRC_HILLTOP_BASE_URL,
+    TRC_HILLTOP_HTS_FILE,
+    SITE_REGISTRY_SNAPSHOT,
+    SITE_REGISTRY_MAX_AGE,
+)
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# hilltoppy's own requests (SiteList, MeasurementList, GetData) share our pooled session
+install_hilltoppy_transport()
+
+# Bump this whenever the snapshot layout changes so old files are ignored
+SNAPSHOT_VERSION = 1
+
+
+class HilltopClient:
+    """
+    The part of hilltoppy's Hilltop client the app uses, made of hilltoppy's
+    web_service calls (which go through our pooled session). Unlike Hilltop(),
+    creating one sends no SiteList request: the registry supplies available_sites.
+    """
+
+    def __init__(self, base_url, hts, available_sites=()):
+        self.base_url = base_url
+        self.hts = hts
+        self.available_sites = list(available_sites)
+
+    def get_site_list(self, location=None, measurement=None, collection=None, site_parameters=None):
+        return ws.site_list(self.base_url, self.hts, location=location, measurement=measurement,
+                            collection=collection, site_parameters=site_parameters)
+
+    def get_measurement_list(self, sites=None, measurement=None):
+        if isinstance(sites, str):
+            return ws.measurement_list(self.base_url, self.hts, sites, measurement=measurement)
+        frames = [ws.measurement_list(self.base_url, self.hts, site, measurement=measurement)
+                  for site in (self.available_sites if sites is None else sites)]
+        return pd.concat(frames) if frames else pd.DataFrame(columns=['SiteName', 'MeasurementName'])
+
+    def get_collection_list(self):
+        return ws.collection_list(self.base_url, self.hts)
+
+    def get_data(self, sites, measurements, from_date=None, to_date=None, agg_method=None, agg_interval=None):
+        """One GetData call per site and measurement (hilltoppy's client adds a MeasurementList call per site)."""
+        sites = [sites] if isinstance(sites, str) else sites
+        measurements = [measurements] if isinstance(measurements, str) else measurements
+        frames = []
+        for site in sites:
+            if site not in self.available_sites:
+                raise ValueError('Requested site is not in hts file.')
+            for measurement in measurements:
+                try:
+                    df = ws.get_data(self.base_url, self.hts, site, measurement, from_date=from_date,
+                                     to_date=to_date, agg_method=agg_method, agg_interval=agg_interval)
+                except (ValueError, KeyError):
+                    # web_service raises on an <Error> reply (ValueError) and on a period
+                    # without readings (KeyError 'Time'); hilltoppy's client returns no rows
+                    df = pd.DataFrame(columns=['SiteName', 'MeasurementName', 'Time'])
+                frames.append(df)
+        return pd.concat(frames)
+
+
+class SiteRegistry:
+    """
+    Lazily loaded, snapshot-backed registry of Hilltop sites.
+
+    sites()          -> all sites with Latitude/Longitude (what DF_SITES used to be)
+    collection(name) -> sites for a Hilltop collection, e.g. "WebRivers"
+    client()         -> a shared HilltopClient for the same server
+    """
+
+    def __init__(self, base_url, hts, snapshot_path, max_age=SITE_REGISTRY_MAX_AGE):
+        self.base_url = base_url
+        self.hts = hts
+        self.snapshot_path = snapshot_path
+        self.max_age = max_age
+
+        self._lock = threading.RLock()      # Guards the data below; never held across a fetch
+        self._load_lock = threading.Lock()  # One first load at a time
+        self._refresh_thread = None
+        self._loaded = False
+        self._all_sites = None      # Full SiteList (LatLong), including sites without coordinates
+        self._collections = {}      # collection name -> DataFrame
+        self._saved_at = None       # datetime the current data was fetched from Hilltop
+        self._client = None
+
+    # --- Public API ---
+
+    def sites(self):
+        """Returns a DataFrame of all sites that have a Latitude and Longitude."""
+        self._ensure_loaded()
+        return self._all_sites.dropna()
+
+    def collection(self, name):
+        """Returns a DataFrame of the sites in a Hilltop collection, fetching it on first use."""
+        self._ensure_loaded()
+        with self._lock:
+            df = self._collections.get(name)
+        if df is None:
+            df = self._fetch_collection(name)
+            with self._lock:
+                self._collections[name] = df
+            self._save_snapshot()
+        return df
+
+    def client(self):
+        """
+        Returns the shared HilltopClient, its available_sites kept in step with
+        the registry. Building it costs no request: the site list is already loaded.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if self._client is None:
+                self._client = HilltopClient(self.base_url, self.hts, self._all_sites['SiteName'].tolist())
+            return self._client
+
+    def refresh(self):
+        """Re-fetches the site list and every known collection from Hilltop and rewrites the snapshot."""
+        log_prefix = "[SITE-REGISTRY-REFRESH]"
+        all_sites = self._fetch_all_sites()
+        with self._lock:
+            self._all_sites = all_sites
+            self._saved_at = datetime.now()
+            self._loaded = True
+            if self._client is not None:
+                self._client.available_sites = all_sites['SiteName'].tolist()
+            names = list(self._collections)
+
+        # The site list is in place, so client() can be used for the collections
+        collections = {name: self._fetch_collection(name) for name in names}
+        with self._lock:
+            self._collections.update(collections)
+        self._save_snapshot()
+        if verbose:
+            print(f"{log_prefix} Refreshed {len(all_sites)} sites and {len(collections)} collections")
+
+    def refresh_async(self):
+        """Starts a background refresh unless one is already running."""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return self._refresh_thread
+            self._refresh_thread = threading.Thread(target=self._refresh_quietly,
+                                                    name="site-registry-refresh",
+                                                    daemon=True)
+            self._refresh_thread.start()
+            return self._refresh_thread
+
+    @property
+    def saved_at(self):
+        """When the registry data was last fetched from Hilltop (None if not loaded yet)."""
+        return self._saved_at
+
+    # --- Loading ---
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        # Only the first load is serialised; refresh() fetches without holding
+        # self._lock and swaps the result in, so readers never wait on Hilltop
+        with self._load_lock:
+            if self._loaded:
+                return
+            if self._load_snapshot():
+                if datetime.now() - self._saved_at > self.max_age:
+                    self.refresh_async()
+                return
+            self.refresh()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"[SITE-REGISTRY-REFRESH] Background refresh failed, keeping current snapshot: {e}")
+
+    def _fetch_all_sites(self):
+        with hilltop_call("SiteList") as call:
+            df = ws.site_list(self.base_url, self.hts, location='LatLong')
+            call.rows = len(df)
+        return df
+
+    def _fetch_collection(self, name):
+        log_prefix = "[SITE-REGISTRY-FETCH-COLLECTION]"
+        with hilltop_call("SiteList") as call:
+            df = self.client().get_site_list(location='LatLong', collection=name)
+            call.rows = len(df)
+        if verbose:
+            print(f"{log_prefix} Found {len(df)} sites for collection '{name}'")
+        return df
+
+    # --- Snapshot file ---
+
+    def _load_snapshot(self):
+        log_prefix = "[SITE-REGISTRY-LOAD-SNAPSHOT]"
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"{log_prefix} Ignoring unreadable snapshot {self.snapshot_path}: {e}")
+            return False
+
+        if (snapshot.get("version") != SNAPSHOT_VERSION
+                or snapshot.get("base_url") != self.base_url
+                or snapshot.get("hts") != self.hts):
+            if verbose:
+                print(f"{log_prefix} Snapshot does not match this server/version, ignoring it.")
+            return False
+
+        all_sites = pd.DataFrame(snapshot["sites"], columns=snapshot["site_columns"])
+        collections = {
+            name: pd.DataFrame(c["sites"], columns=c["site_columns"])
+            for name, c in snapshot.get("collections", {}).items()
+        }
+        with self._lock:
+            self._all_sites = all_sites
+            self._collections = collections
+            self._saved_at = datetime.fromisoformat(snapshot["saved_at"])
+            self._loaded = True
+        if verbose:
+            print(f"{log_prefix} Loaded {len(self._all_sites)} sites saved at {self._saved_at}")
+        return True
+
+    def _save_snapshot(self):
+        log_prefix = "[SITE-REGISTRY-SAVE-SNAPSHOT]"
+        with self._lock:
+            snapshot = {
+                "version": SNAPSHOT_VERSION,
+                "base_url": self.base_url,
+                "hts": self.hts,
+                "saved_at": self._saved_at.isoformat(),
+                "site_columns": self._all_sites.columns.tolist(),
+                "sites": _records(self._all_sites),
+                "collections": {
+                    name: {"site_columns": df.columns.tolist(), "sites": _records(df)}
+                    for name, df in self._collections.items()
+                },
+            }
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            # Per thread too: collections can be fetched (and saved) in parallel
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path) # Atomic, so other workers never see half a file
+        except OSError as e:
+            print(f"{log_prefix} Could not write snapshot {self.snapshot_path}: {e}")
+
+
+def _records(df):
+    """DataFrame rows as JSON-safe lists (NaN -> None)."""
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+# The one registry shared by hilltop_api, constants, app.py and test.py
+SITE_REGISTRY = SiteRegistry(TRC_HILLTOP_BASE_URL, TRC_HILLTOP_HTS_FILE, SITE_REGISTRY_SNAPSHOT)
@@ -0,0 +1,275 @@
+# startup.py
+#
+# Application bootstrap: everything app.py needs before the Dash app is built.
+#
+# The site list is loaded once (from the registry snapshot when there is one),
+# then every collection's site list is fetched in parallel through fetch_engine
+# instead of one after the other. Each collection becomes one DataFrame that is
+# shared by every MEASUREMENTS_FOR_MAPS_AND_DATASETS entry using it (they only
+# read it). Each phase is timed and STARTUP.report() prints the breakdown, so
+# slow worker boots are easy to spot when workers are scaled up in a flood event.
+#
+# The finished measurement/site configuration is pickled to CONFIG_SNAPSHOT_PATH.
+# With several workers it is built only once:
+#
+#   gunicorn -c gunicorn.conf.py app:server   master builds it (preload), workers
+#                                              inherit it copy-on-write at fork
+#   python startup.py                          sidecar/deploy step writes the
+#                                              snapshot; workers just attach to it
+#
+# Any worker that starts without a fresh snapshot builds one and saves it for the rest.
+
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from site_registry import SITE_REGISTRY
+from fetch_engine import run_concurrently
+from constants import (
+    DUMMY_RAINFALL_SITES,
+    DUMMY_FLOW_SITES,
+    CONFIG_SNAPSHOT_ENABLED,
+    CONFIG_SNAPSHOT_PATH,
+    CONFIG_SNAPSHOT_MAX_AGE,
+)
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+
+class StartupTimer:
+    """Wall-clock timings of the named startup phases, in the order they ran."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []    # (name, seconds, note)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Times the body of the `with` block as phase `name`."""
+        t0 = time.perf_counter()
+        note = {}
+        try:
+            yield note # The block can set note["detail"] for the report
+        finally:
+            with self._lock:
+                self.phases.append((name, time.perf_counter() - t0, note.get("detail", "")))
+
+    def report(self):
+        """Prints the phase timings and the total since the timer was created."""
+        log_prefix = "[STARTUP]"
+        total = time.perf_counter() - self.started
+        lines = [f"{log_prefix} Worker {os.getpid()} ready in {total:.2f}s"]
+        for name, seconds, detail in self.phases:
+            lines.append(f"{log_prefix}   {name:<28} {seconds:7.2f}s  {detail}".rstrip())
+        print("\n".join(lines))
+        return total
+
+
+def load_collection_frames(collections, timer=None):
+    """
+    {collection name: site DataFrame} for `collections`, fetched in parallel.
+    A collection that fails to load is left out (and reported), so one bad
+    collection doesn't stop the others.
+    """
+    log_prefix = "[STARTUP-COLLECTIONS]"
+    timer = timer or STARTUP
+    collections = list(dict.fromkeys(collections)) # Each collection once, in order
+
+    with timer.phase("site list") as note:
+        # The collection fetches need the site list (client), so load it first, once
+        note["detail"] = f"{len(SITE_REGISTRY.sites())} sites"
+
+    with timer.phase("collections (parallel)") as note:
+        results = run_concurrently((name, lambda name=name: SITE_REGISTRY.collection(name)) for name in collections)
+        frames = {}
+        for result in results:
+            if result.error is not None:
+                print(f"{log_prefix} Could not load collection '{result.key}': {result.error}")
+                continue
+            # One copy per collection, shared read-only by every measurement that uses it
+            frames[result.key] = pd.DataFrame(result.value).copy()
+        note["detail"] = ", ".join(f"{name}={len(df)}" for name, df in frames.items())
+
+    if verbose:
+        print(f"{log_prefix} Loaded {len(frames)} of {len(collections)} collections")
+    return frames
+
+
+def build_measurement_config(timer=None):
+    """
+    (MEASUREMENTS_FOR_MAPS_AND_DATASETS entries, ok) built from the collection
+    site lists; the dummy sites, with ok False, if Hilltop can't be reached.
+    Each collection is one DataFrame, shared by every entry that uses it.
+    """
+    try:
+        site_frames = load_collection_frames(["WebRivers", "WebRainfall", "WebAirTemp"], timer)
+        river_sites = site_frames.get("WebRivers", pd.DataFrame())         # [Water Level], Flow, [Water temperature (Continuous)]
+        rainfall_sites = site_frames.get("WebRainfall", pd.DataFrame())    # [Rainfall]
+        air_temperature_sites = site_frames.get("WebAirTemp", pd.DataFrame()) # [Air temperature (Continuous)]
+        if not site_frames:
+            raise RuntimeError("no collection site lists could be loaded")
+
+        measurements = {
+            # "Rainfall (mm)": {
+            #     "hilltop_measurement_name": "Rainfall",# [Rainfall]",
+            #     "is_incremental": True,
+            #     "sites": rainfall_site_data,
+            #     "interval": "",
+            #     "method": "",
+            #     "measures": "Rainfall,Rainfall SCADA",
+            # },
+            "Hourly Rainfall (mm)": {
+                "hilltop_measurement_name": "Rainfall",# [Rainfall]",
+                "is_incremental": True,
+                "sites": rainfall_sites,
+                "interval": "1 hour",
+                "method": "Total",
+                "measures": "Rainfall,Rainfall SCADA",
+                "collection": "WebRainfall", # RecentDataTable poller feeding the latest-reading map
+            },
+            "Daily Rainfall (mm)": {
+                "hilltop_measurement_name": "Rainfall",# [Rainfall]",
+                "is_incremental": True,
+                "sites": rainfall_sites,
+                "interval": "1 day",
+                "method": "Total",
+                "measures": "Rainfall,Rainfall SCADA",
+                "collection": "WebRainfall",
+            },
+            "River Stage (m)": {
+                "hilltop_measurement_name": "Stage",# [Water Level]",
+                "is_incremental": False,
+                "sites": river_sites,
+                "interval": "",
+                "method": "",
+                "measures": "Stage",
+                "collection": "WebRivers",
+            },
+            "River Flow (m³/s)": {
+                "hilltop_measurement_name": "Flow",# [Water Level]",
+                "is_incremental": False,
+                "sites": river_sites,
+                "interval": "",
+                "method": "",
+                "measures": "Flow",
+                "collection": "WebRivers",
+            },
+            "Water Temperature (°C)": {
+                "hilltop_measurement_name": "Water Temperature",# [Water temperature (Continuous)]",
+                "is_incremental": False,
+                "sites": river_sites,
+                "interval": "",
+                "method": "",
+                "measures": "Water Temperature (Continuous)",
+                "collection": "WebRivers",
+            },
+            "Air Temperature (°C)": {
+                "hilltop_measurement_name": "Air Temperature",# [Air temperature (Continuous)]",
+                "is_incremental": False,
+                "sites": air_temperature_sites,
+                "interval": "",
+                "method": "",
+                "measures": "Air Temperature (Continuous)",
+                "collection": "WebAirTemp",
+            }, # Add other measurements as needed
+        }
+        print("Successfully loaded site and measurement configurations.")
+        return measurements, True
+    except Exception as e:
+        print(f"Error loading site/measurement configurations: {e}. Using dummy data.")
+        # Fallback to dummy data if Hilltop connection fails at startup
+        return {
+            "Rainfall (mm)": {
+                "hilltop_measurement_name": "Rainfall [Rainfall]",
+                "is_incremental": True,
+                "sites": DUMMY_RAINFALL_SITES,
+                "interval": "",
+                "method": "",
+                "measures": "Rainfall",
+            },
+            "River Flow (m³/s)": {
+                "hilltop_measurement_name": "Flow",
+                "is_incremental": False,
+                "sites": DUMMY_FLOW_SITES,
+                "interval": "",
+                "method": "",
+                "measures": "Flow",
+            },
+        }, False
+
+
+# Bump this whenever the measurement config layout changes so old snapshots are ignored
+CONFIG_SNAPSHOT_VERSION = 1
+
+
+def save_config_snapshot(measurements, path=CONFIG_SNAPSHOT_PATH):
+    """Pickles the measurement config to `path` (atomically, so attaching workers never see half a file)."""
+    log_prefix = "[STARTUP-SAVE-CONFIG]"
+    snapshot = {"version": CONFIG_SNAPSHOT_VERSION, "built_at": datetime.now(), "measurements": measurements}
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if verbose:
+            print(f"{log_prefix} Saved {len(measurements)} measurements to {path}")
+    except OSError as e:
+        print(f"{log_prefix} Could not write config snapshot {path}: {e}")
+
+
+def attach_config_snapshot(path=CONFIG_SNAPSHOT_PATH, max_age=CONFIG_SNAPSHOT_MAX_AGE):
+    """The measurement config from a snapshot younger than `max_age`, or None."""
+    log_prefix = "[STARTUP-ATTACH-CONFIG]"
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        print(f"{log_prefix} Ignoring unreadable config snapshot {path}: {e}")
+        return None
+    if snapshot.get("version") != CONFIG_SNAPSHOT_VERSION or datetime.now() - snapshot["built_at"] > max_age:
+        if verbose:
+            print(f"{log_prefix} Config snapshot is stale or from another version, rebuilding")
+        return None
+    return snapshot["measurements"]
+
+
+def load_measurement_config(timer=None):
+    """
+    The MEASUREMENTS_FOR_MAPS_AND_DATASETS entries for this process: from a
+    fresh snapshot when there is one, otherwise built and snapshotted.
+    """
+    timer = timer or STARTUP
+    if CONFIG_SNAPSHOT_ENABLED:
+        with timer.phase("attach config snapshot") as note:
+            measurements = attach_config_snapshot()
+            note["detail"] = "hit" if measurements is not None else "miss"
+        if measurements is not None:
+            return measurements
+
+    measurements, ok = build_measurement_config(timer)
+    if ok and CONFIG_SNAPSHOT_ENABLED: # Dummy fallbacks are never shared
+        save_config_snapshot(measurements)
+    return measurements
+
+
+# Timer for this process's startup, reported by app.py once the app is built
+STARTUP = StartupTimer()
+
+
+if __name__ == "__main__":
+    # Sidecar/deploy step: build the configuration once so workers only attach to it
+    measurements, ok = build_measurement_config()
+    if ok:
+        save_config_snapshot(measurements)
+    STARTUP.report()
+    raise SystemExit(0 if ok else 1)
@@ -5,7 +5,6 @@ from hilltop_api import (
     fetch_collection_list, 
     fetch_data)
 import pandas as pd
-from hilltoppy import Hilltop
 from datetime import datetime, timedelta  
 import requests  
 
@@ -15,7 +14,8 @@ TRC_HILLTOP_HTS_FILE = 'boo.hts' # Or 'boo.hts' if that's the correct one
 
 base = f"{TRC_HILLTOP_BASE_URL}{TRC_HILLTOP_HTS_FILE}"
 
-df_sites = Hilltop(TRC_HILLTOP_BASE_URL, TRC_HILLTOP_HTS_FILE).get_site_list(location='LatLong').dropna()
+from site_registry import SITE_REGISTRY
+df_sites = SITE_REGISTRY.sites()
 #print(df_sites.head())
 
 # result = ','.join(df_sites['SiteName'])
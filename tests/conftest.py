@@ -0,0 +1,18 @@
+# conftest.py
+#
+# Unit tests that run without a Hilltop server: `pytest tests/` from the
+# repository root. The app is configured here, before any app module is
+# imported, so nothing is read from or written to the real .cache/.
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.update({
+    "ENV_DASH_CACHE_DIR": tempfile.mkdtemp(prefix="env_dash_tests_"),
+    "RECENT_POLL_ENABLED": "0",
+    "TIMESERIES_STORE_ENABLED": "0",
+    "CONFIG_SNAPSHOT_ENABLED": "0",
+})
@@ -0,0 +1,86 @@
+# test_cache.py
+#
+# memoize never caches a failure: exceptions and results failing cache_if are
+# returned (or raised) uncached, and a refresh that fails keeps the stale value.
+# Stale entries are refreshed on a thread during requests, and synchronously
+# outside one (background callback jobs).
+
+import time
+
+import pytest
+from flask import Flask
+
+import cache
+from cache import init_cache, memoize
+
+
+@pytest.fixture
+def app_cache(monkeypatch):
+    monkeypatch.setattr(cache, "_server", None)
+    app = Flask(__name__)
+    init_cache(app, {"CACHE_TYPE": "SimpleCache"})
+    yield app
+    cache.cache.clear()
+
+
+def test_exceptions_are_not_cached(app_cache):
+    calls = []
+
+    @memoize(60)
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("Hilltop down")
+        return "data"
+
+    with pytest.raises(ConnectionError):
+        flaky()
+    assert flaky() == "data"
+    assert flaky() == "data"
+    assert len(calls) == 2
+
+
+def test_results_failing_cache_if_are_not_cached(app_cache):
+    results = iter([None, "data", "other"])
+
+    @memoize(60, cache_if=lambda value: value is not None)
+    def partial():
+        return next(results)
+
+    assert partial() is None
+    assert partial() == "data"
+    assert partial() == "data"
+
+
+def test_failed_refresh_keeps_the_stale_value(app_cache):
+    results = iter(["good", None])
+
+    @memoize(1, stale_ttl=60, cache_if=lambda value: value is not None)
+    def summary():
+        return next(results)
+
+    assert summary() == "good"
+    time.sleep(1.1)
+    with app_cache.test_request_context():
+        assert summary() == "good" # stale, the refresh thread gets None
+        deadline = time.time() + 5
+        while cache._refreshing and time.time() < deadline:
+            time.sleep(0.01)
+        assert cache.cache.get(cache.make_key(summary.__wrapped__, (), {}))[1] == "good"
+
+
+def test_stale_entry_is_refreshed_synchronously_outside_a_request(app_cache):
+    results = iter(["old", "new"])
+    progress_calls = []
+
+    @memoize(1, stale_ttl=60, ignore=("progress",))
+    def dataset(progress=None):
+        if progress is not None:
+            progress_calls.append(1)
+        return next(results)
+
+    assert dataset() == "old"
+    time.sleep(1.1)
+    assert dataset(progress=lambda: None) == "new"
+    assert progress_calls == [1]
+    assert not cache._refreshing
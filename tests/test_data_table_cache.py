@@ -0,0 +1,57 @@
+# test_data_table_cache.py
+#
+# Multi-site DataTable requests are cached per site, so overlapping site
+# selections reuse what was fetched before.
+
+from datetime import datetime, timedelta
+from urllib.parse import unquote
+
+import pandas as pd
+import pytest
+
+import hilltop_api
+from timeseries_cache import TIMESERIES_CACHE
+
+
+@pytest.fixture
+def data_table(monkeypatch):
+    """Replaces the Hilltop call with hourly readings for the requested sites; returns the sites of each call."""
+    calls = []
+
+    def fake_fetch(site, measurement, from_date, to_date, method, interval, base_url):
+        sites = unquote(site).split(",")
+        calls.append(sites)
+        times = pd.date_range(pd.Timestamp(from_date).ceil("h"), to_date, freq="h")
+        return pd.DataFrame({"SiteName": [s for s in sites for _ in times],
+                             "Time": list(times) * len(sites),
+                             "M1": 1.0})
+
+    TIMESERIES_CACHE.clear()
+    monkeypatch.setattr(hilltop_api, "_fetch_data_table", fake_fetch)
+    yield calls
+    TIMESERIES_CACHE.clear()
+
+
+def test_overlapping_selections_only_fetch_new_sites(data_table):
+    end = datetime.now() - timedelta(days=3)
+    start = end - timedelta(days=1)
+
+    first = hilltop_api.fetch_data_table_for_custom_collection("A,B", "Flow", start, end, None, None)
+    second = hilltop_api.fetch_data_table_for_custom_collection("A%2CC", "Flow", start, end, None, None)
+
+    assert data_table == [["A", "B"], ["C"]]
+    assert sorted(first["SiteName"].unique()) == ["A", "B"]
+    assert sorted(second["SiteName"].unique()) == ["A", "C"]
+    assert (second["SiteName"] == "A").sum() == (first["SiteName"] == "A").sum()
+
+
+def test_single_site_fetches_share_the_dataset_cache(data_table):
+    end = datetime.now() - timedelta(days=3)
+    start = end - timedelta(days=1)
+
+    hilltop_api.fetch_data_table_for_custom_collection("A,B", "Flow", start, end, "", "")
+    df = hilltop_api._get_data_cached("A", "Flow", start, end)
+
+    assert data_table == [["A", "B"]]
+    assert list(df.columns) == ["SiteName", "MeasurementName", "Time", "Value"]
+    assert len(df) == 24
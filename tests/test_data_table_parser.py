@@ -0,0 +1,65 @@
+# test_data_table_parser.py
+#
+# The streaming DataTable parser: typed columns straight from the XML, local
+# wall time for offset timestamps, NaN/NaT for cells missing from a row, and
+# SiteName as plain strings.
+
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from hilltop_api import parse_hilltop_xml, _stream_data_table, _columns_to_frame
+
+RESPONSE = """<?xml version="1.0" encoding="utf-8"?>
+<HilltopServer><Agency>Test</Agency>
+<Measurements><ColumnName>M1</ColumnName><Measurement>Flow</Measurement><Units>m3/sec</Units></Measurements>
+<Measurements><ColumnName>M2</ColumnName><Measurement>Stage</Measurement><Units>mm</Units></Measurements>
+<Results><SiteName>A</SiteName><Time>2025-07-01T10:00:00</Time><M1>1.5</M1></Results>
+<Results><SiteName>B</SiteName><Time>2025-07-01T10:00:00+12:00</Time><M1>2.5</M1><M2>300</M2></Results>
+<Results><SiteName>A</SiteName><Time>2025-07-01T10:15:00Z</Time><M2>-</M2></Results>
+<Results><SiteName>B</SiteName><M1>3.5</M1></Results>
+</HilltopServer>"""
+
+
+def test_columns_are_typed_and_labelled():
+    df = parse_hilltop_xml(RESPONSE)
+
+    assert list(df.columns) == ["SiteName", "Time", "Flow (m3/sec)", "Stage (mm)"]
+    assert df["SiteName"].tolist() == ["A", "B", "A", "B"]
+    assert not isinstance(df["SiteName"].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_string_dtype(df["SiteName"])
+    assert df["Time"].dtype == "datetime64[ns]"
+    assert df["Flow (m3/sec)"].dtype == np.float64
+
+
+def test_offset_timestamps_keep_local_wall_time():
+    times = parse_hilltop_xml(RESPONSE)["Time"]
+
+    assert times[0] == pd.Timestamp("2025-07-01 10:00")
+    assert times[1] == pd.Timestamp("2025-07-01 10:00") # +12:00 dropped, not converted to UTC
+    assert times[2] == pd.Timestamp("2025-07-01 10:15")
+    assert pd.isna(times[3])
+
+
+def test_cells_missing_from_a_row_are_nan():
+    df = parse_hilltop_xml(RESPONSE)
+
+    # M2 first appears in the second row; the "-" placeholder isn't a number
+    assert np.isnan(df["Stage (mm)"][0]) and df["Stage (mm)"][1] == 300 and np.isnan(df["Stage (mm)"][2])
+    assert np.isnan(df["Flow (m3/sec)"][2]) and df["Flow (m3/sec)"][3] == 3.5
+
+
+def test_streamed_source_matches_text():
+    columns, n_rows, column_map = _stream_data_table(BytesIO(RESPONSE.encode("utf-8")))
+
+    assert n_rows == 4
+    assert column_map == {"M1": "Flow (m3/sec)", "M2": "Stage (mm)"}
+    pd.testing.assert_frame_equal(_columns_to_frame(columns, n_rows)[["SiteName", "Time", "M1"]],
+                                  _columns_to_frame(_stream_data_table(RESPONSE)[0], 4)[["SiteName", "Time", "M1"]])
+
+
+def test_empty_response():
+    df = parse_hilltop_xml('<?xml version="1.0"?><HilltopServer><Agency>Test</Agency></HilltopServer>')
+
+    assert df.empty
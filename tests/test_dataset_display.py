@@ -0,0 +1,26 @@
+# test_dataset_display.py
+#
+# get_dataset_data_for_display with a collection whose site list failed to load
+# (an empty frame with no columns): every selected site is skipped, no error.
+
+import pandas as pd
+
+from data_processing import get_dataset_data_for_display
+from constants import MEASUREMENTS_FOR_MAPS_AND_DATASETS
+
+
+def test_empty_site_list_returns_no_data(monkeypatch):
+    monkeypatch.setitem(MEASUREMENTS_FOR_MAPS_AND_DATASETS, "River Flow (m³/s)", {
+        "hilltop_measurement_name": "Flow",
+        "measures": "Flow",
+        "method": "",
+        "interval": "",
+        "collection": "WebRivers",
+        "sites": pd.DataFrame(),
+    })
+
+    combined_df, data_found = get_dataset_data_for_display(
+        "River Flow (m³/s)", ["Patea at Skinner Rd"], "2026-01-01", "2026-01-02")
+
+    assert combined_df.empty
+    assert not data_found
@@ -0,0 +1,65 @@
+# test_downsampling.py
+#
+# lttb_indices and minmax_indices keep the first and last points and every
+# peak, and stay within their target point count.
+
+import numpy as np
+import pandas as pd
+
+from downsampling import lttb_indices, minmax_indices, downsample_frame
+
+
+def _flood(n=10_000, seed=0):
+    """A noisy 15-minute flow series with a short, sharp flood peak."""
+    rng = np.random.default_rng(seed)
+    x = pd.date_range("2025-07-01", periods=n, freq="15min").to_numpy()
+    y = 5 + rng.normal(scale=0.2, size=n)
+    peak = int(n * 0.6)
+    y[peak:peak + 4] = [80, 250, 180, 60]
+    return x, y
+
+
+def test_lttb_keeps_ends_and_peak_within_target():
+    x, y = _flood()
+
+    idx = lttb_indices(x, y, 500)
+
+    assert idx[0] == 0 and idx[-1] == len(y) - 1
+    assert np.all(np.diff(idx) > 0)
+    assert np.argmax(y) in idx # The flood peak
+    assert len(idx) <= 2 * 500 # n_out, plus at most one extra peak per bucket
+
+
+def test_lttb_without_peaks_hits_the_target_exactly():
+    x, y = _flood()
+
+    assert len(lttb_indices(x, y, 500, keep_peaks=False)) == 500
+
+
+def test_minmax_keeps_ends_and_extremes_within_target():
+    _, y = _flood()
+
+    idx = minmax_indices(y, 250)
+
+    assert idx[0] == 0 and idx[-1] == len(y) - 1
+    assert np.argmax(y) in idx and np.argmin(y) in idx
+    assert len(idx) <= 2 * 250 + 2
+
+
+def test_short_series_are_left_alone():
+    x, y = _flood(n=100)
+
+    assert lttb_indices(x, y, 500).tolist() == list(range(100))
+    assert minmax_indices(y, 250).tolist() == list(range(100))
+
+
+def test_downsample_frame_per_site():
+    x, y = _flood(n=3_000)
+    df = pd.concat([pd.DataFrame({"SiteName": site, "DateTime": x, "Value": y}) for site in ("A", "B")])
+
+    out = downsample_frame(df, "DateTime", "Value", n_out=300, by="SiteName")
+
+    for _, part in out.groupby("SiteName"):
+        assert len(part) <= 600
+        assert part["Value"].max() == y.max()
+        assert part["DateTime"].is_monotonic_increasing
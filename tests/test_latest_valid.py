@@ -0,0 +1,66 @@
+# test_latest_valid.py
+#
+# latest_valid_by_key gives what the groupby it replaced gave: the last valid
+# reading per site, sites with none left out, and its time alongside.
+
+import numpy as np
+import pandas as pd
+
+from hilltop_api import latest_valid_by_key, _last_index_per_key
+
+
+def _readings(n_sites=50, n_times=20, seed=0):
+    """Time-sorted readings per site, like a DataTable response, with gaps and an all-NaN site."""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2025-07-01", periods=n_times, freq="15min")
+    df = pd.DataFrame({"SiteName": np.repeat([f"Site {i:03d}" for i in range(n_sites)], n_times),
+                       "Time": np.tile(times, n_sites),
+                       "M1": rng.normal(size=n_sites * n_times)})
+    df.loc[rng.random(len(df)) < 0.3, "M1"] = np.nan
+    df.loc[df["SiteName"] == "Site 007", "M1"] = np.nan
+    return df
+
+
+def _old_groupby(df):
+    """The groupby().apply(last_valid_index) process_map_data_2 used before."""
+    latest = df.groupby("SiteName", group_keys=False)["M1"].apply(
+        lambda x: x.loc[x.last_valid_index()] if x.last_valid_index() is not None else None
+    ).dropna()
+    return latest.reset_index(name="M1")
+
+
+def test_matches_the_old_groupby():
+    df = _readings()
+
+    new = latest_valid_by_key(df, "M1")
+
+    pd.testing.assert_frame_equal(new[["SiteName", "M1"]], _old_groupby(df), check_dtype=False)
+    assert "Site 007" not in set(new["SiteName"])
+
+
+def test_times_belong_to_the_picked_values():
+    df = _readings()
+
+    new = latest_valid_by_key(df, "M1")
+
+    picked = new.merge(df, left_on=["SiteName", "M1_Time"], right_on=["SiteName", "Time"], suffixes=("", "_row"))
+    assert len(picked) == len(new)
+    assert (picked["M1"] == picked["M1_row"]).all()
+
+
+def test_latest_time_wins_regardless_of_row_order():
+    df = _readings().sample(frac=1, random_state=1) # Shuffled
+
+    new = latest_valid_by_key(df, "M1").set_index("SiteName")
+
+    expected = df.dropna(subset=["M1"]).sort_values("Time").groupby("SiteName").tail(1).set_index("SiteName")
+    pd.testing.assert_series_equal(new["M1_Time"], expected["Time"].sort_index(),
+                                  check_names=False, check_dtype=False)
+
+
+def test_last_index_per_key_marks_keys_without_valid_rows():
+    codes = np.array([0, 1, 0, 2, -1])
+    times = np.array([1, 5, 3, 2, 9], dtype=np.int64)
+    valid = np.array([True, True, True, False, True])
+
+    assert _last_index_per_key(codes, times, valid, 3).tolist() == [2, 1, -1]
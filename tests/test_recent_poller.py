@@ -0,0 +1,45 @@
+# test_recent_poller.py
+#
+# Only the polling process calls RecentDataTable; any other process (a gunicorn
+# worker) reads the snapshot it publishes and never starts a poller itself.
+
+import pandas as pd
+
+import recent_poller
+from recent_poller import RecentDataPoller, latest_values
+
+
+class FakeRecentDataTable:
+    """RecentDataTable for one collection; records each call."""
+
+    def __init__(self, flow):
+        self.flow = flow
+        self.calls = 0
+
+    def __call__(self, collection):
+        self.calls += 1
+        return pd.DataFrame({"SiteName": ["A", "B"],
+                             "Time": pd.to_datetime(["2026-01-01 00:00", "2026-01-01 00:15"]),
+                             "Flow (m3/sec)": self.flow})
+
+
+def test_worker_reads_the_published_snapshot_without_polling(monkeypatch):
+    monkeypatch.setattr(recent_poller, "_pollers", {})
+    upstream = FakeRecentDataTable([1.0, 2.0])
+    RecentDataPoller("WebRivers", fetch=upstream).poll_once() # In the polling process
+
+    latest = latest_values("WebRivers", "Flow")
+
+    assert latest["M1"].tolist() == [1.0, 2.0]
+    assert upstream.calls == 1
+    assert recent_poller._pollers == {}
+
+
+def test_newer_published_snapshot_wins_over_an_inherited_poller(monkeypatch):
+    monkeypatch.setattr(recent_poller, "_pollers", {})
+    inherited = RecentDataPoller("WebRivers", fetch=FakeRecentDataTable([1.0, 2.0]))
+    inherited.poll_once()
+    recent_poller._pollers["WebRivers"] = inherited # As copied into a worker at fork
+    RecentDataPoller("WebRivers", fetch=FakeRecentDataTable([3.0, 4.0])).poll_once()
+
+    assert latest_values("WebRivers", "Flow")["M1"].tolist() == [3.0, 4.0]
@@ -0,0 +1,33 @@
+# test_rollups.py
+#
+# Rainfall totals from the rollup pyramid match resampling the raw series,
+# including hours and days without readings (0, not missing).
+
+import pandas as pd
+import pytest
+
+import hilltop_api
+from rollups import ROLLUPS
+
+
+@pytest.fixture
+def raw(monkeypatch):
+    """15-minute rainfall over two days with a dry spell (no readings at all) in between."""
+    times = pd.date_range("2025-07-01 00:00", "2025-07-02 23:45", freq="15min")
+    times = times[(times < "2025-07-01 06:00") | (times >= "2025-07-01 09:00")]
+    frame = pd.DataFrame({"Time": times, "Value": 0.5})
+    monkeypatch.setattr(hilltop_api, "_get_data_cached",
+                        lambda site, measurement, start, end, *args: frame[(frame["Time"] >= start) & (frame["Time"] <= end)])
+    ROLLUPS.clear()
+    yield frame.set_index("Time")["Value"]
+    ROLLUPS.clear()
+
+
+def test_totals_match_resample(raw):
+    start, end = pd.Timestamp("2025-07-01"), pd.Timestamp("2025-07-02 23:59")
+    hourly = hilltop_api._zero_filled(hilltop_api.fetch_rollup("A", "Rainfall", start, end, "1 hour"), "h")
+    daily = hilltop_api._zero_filled(hilltop_api.fetch_rollup("A", "Rainfall", start, end, "1 day"), "D")
+
+    pd.testing.assert_series_equal(hourly, raw.resample("h").sum(), check_names=False, check_freq=False)
+    pd.testing.assert_series_equal(daily, raw.resample("D").sum(), check_names=False, check_freq=False)
+    assert hourly[pd.Timestamp("2025-07-01 07:00")] == 0
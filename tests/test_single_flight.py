@@ -0,0 +1,77 @@
+# test_single_flight.py
+#
+# _SingleFlight.do: concurrent callers with the same key share one upstream
+# call and all get its result or its exception; nothing is kept afterwards.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hilltop_api import _SingleFlight
+
+CALLERS = 8
+
+
+class SlowUpstream:
+    """Blocks until released so every caller arrives while the first call is in flight."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return "rows"
+
+
+def _run_concurrently(flight, key, upstream):
+    with ThreadPoolExecutor(CALLERS) as pool:
+        leader = pool.submit(flight.do, key, upstream)
+        upstream.started.wait(5)
+        followers = [pool.submit(flight.do, key, upstream) for _ in range(CALLERS - 1)]
+        # Let the followers join the in-flight call before it finishes
+        deadline = time.time() + 5
+        while flight._calls[key].waiters < CALLERS - 1 and time.time() < deadline:
+            time.sleep(0.001)
+        upstream.release.set()
+        return [leader] + followers
+
+
+def test_concurrent_identical_keys_make_one_call():
+    flight, upstream = _SingleFlight(), SlowUpstream()
+
+    futures = _run_concurrently(flight, "key", upstream)
+
+    assert [f.result() for f in futures] == ["rows"] * CALLERS
+    assert upstream.calls == 1
+    assert flight._calls == {}
+
+
+def test_error_reaches_every_waiter():
+    flight, upstream = _SingleFlight(), SlowUpstream(error=ConnectionError("Hilltop down"))
+
+    futures = _run_concurrently(flight, "key", upstream)
+
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result()
+    assert upstream.calls == 1
+
+
+def test_different_keys_and_later_calls_are_not_shared():
+    flight = _SingleFlight()
+    calls = []
+
+    flight.do("a", lambda: calls.append("a"))
+    flight.do("b", lambda: calls.append("b"))
+    flight.do("a", lambda: calls.append("a"))
+
+    assert calls == ["a", "b", "a"]
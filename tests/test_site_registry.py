@@ -0,0 +1,39 @@
+# test_site_registry.py
+#
+# A registry started from its snapshot makes no request until data is asked
+# for, and its client adds no SiteList call of its own. Runs against an
+# in-process hilltop_stub.py.
+
+import pytest
+
+from hilltop_stub import HilltopStub
+from site_registry import SiteRegistry
+
+
+@pytest.fixture
+def stub():
+    stub = HilltopStub(sites=5, history_days=2).start()
+    yield stub
+    stub.stop()
+
+
+def test_first_fetch_after_a_snapshot_start_is_one_get_data(stub, tmp_path):
+    snapshot = str(tmp_path / "site_registry.json")
+    SiteRegistry(stub.url, stub.hts, snapshot).sites() # Writes the snapshot
+    stub.calls.clear()
+
+    registry = SiteRegistry(stub.url, stub.hts, snapshot)
+    site = registry.sites()["SiteName"].iloc[0]
+    df = registry.client().get_data(site, "Flow")
+
+    assert dict(stub.calls) == {"GetData": 1}
+    assert not df.empty and set(df["SiteName"]) == {site}
+
+
+def test_period_without_readings_is_an_empty_frame(stub, tmp_path):
+    registry = SiteRegistry(stub.url, stub.hts, str(tmp_path / "site_registry.json"))
+    site = registry.sites()["SiteName"].iloc[0]
+
+    df = registry.client().get_data(site, "Flow", "2000-01-01", "2000-01-02")
+
+    assert df.empty
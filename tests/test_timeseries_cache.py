@@ -0,0 +1,74 @@
+# test_timeseries_cache.py
+#
+# RangeCache with ranges that run up to "now", asked for the way the callers
+# do: with an end of datetime.now() taken before get() is called.
+
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from timeseries_cache import RangeCache
+
+
+class FakeSeries:
+    """A 15-minute series whose readings are added over time; records each fetch."""
+
+    def __init__(self, times):
+        self.times = list(times)
+        self.fetches = []
+
+    def fetch(self, start, end):
+        self.fetches.append((start, end))
+        times = [t for t in self.times if start <= t <= end]
+        return pd.DataFrame({"Time": pd.to_datetime(times), "M1": [1.0] * len(times)})
+
+
+def _readings(start, end):
+    return list(pd.date_range(pd.Timestamp(start).ceil("15min"), end, freq="15min"))
+
+
+def test_live_range_is_reused_within_ttl():
+    cache = RangeCache(now_ttl=300, live_lag=3600)
+    now = datetime.now()
+    series = FakeSeries(_readings(now - timedelta(days=1), now))
+
+    cache.get("site", now - timedelta(days=1), now, series.fetch)
+    end = datetime.now()
+    cache.get("site", now - timedelta(days=1), end, series.fetch)
+
+    assert len(series.fetches) == 1
+
+
+def test_live_range_refetches_late_readings_after_ttl():
+    cache = RangeCache(now_ttl=300, live_lag=3600)
+    now = datetime.now()
+    start = now - timedelta(days=1)
+    late = pd.Timestamp(now - timedelta(minutes=40)).floor("15min")
+    series = FakeSeries([t for t in _readings(start, now) if t != late])
+
+    first = cache.get("site", start, now, series.fetch)
+    assert late not in set(first["Time"])
+
+    # The reading is logged late, and the TTL runs out
+    series.times.append(late)
+    for entry in cache._entries.values():
+        entry.live_fetched_at = time.time() - 301
+    second = cache.get("site", start, datetime.now(), series.fetch)
+
+    assert len(series.fetches) == 2
+    refetch_start, _ = series.fetches[1]
+    assert refetch_start <= late < pd.Timestamp(now)
+    assert late in set(second["Time"])
+    assert second["Time"].is_unique
+
+
+def test_past_range_is_complete():
+    cache = RangeCache(now_ttl=0, live_lag=3600)
+    end = datetime.now() - timedelta(days=2)
+    series = FakeSeries(_readings(end - timedelta(days=1), end))
+
+    cache.get("site", end - timedelta(days=1), end, series.fetch)
+    cache.get("site", end - timedelta(days=1), end, series.fetch)
+
+    assert len(series.fetches) == 1
@@ -0,0 +1,42 @@
+# test_timeseries_store.py
+#
+# Partitions that can't be unpickled (written by another pandas/numpy version)
+# are treated as misses and fetched again.
+
+import pickle
+
+import pandas as pd
+
+from timeseries_store import TimeseriesStore
+
+# A pickle naming a module that isn't installed, as a frame from another pandas version might
+FOREIGN_PICKLE = b"\x80\x04cno_such_module\nFrame\n."
+
+
+class FakeSeries:
+    def __init__(self):
+        self.fetches = []
+
+    def fetch(self, start, end):
+        self.fetches.append((start, end))
+        times = pd.date_range(start, end, freq="D")
+        return pd.DataFrame({"Time": times, "M1": 1.0})
+
+
+def test_unreadable_partition_is_fetched_again(tmp_path):
+    store = TimeseriesStore(path=str(tmp_path / "store.sqlite"), settle=pd.Timedelta(days=2))
+    series = FakeSeries()
+    start, end = pd.Timestamp("2025-01-01"), pd.Timestamp("2025-02-28")
+
+    store.get(("GetData", "A"), start, end, series.fetch)
+    with store._connect() as db:
+        db.execute("UPDATE partitions SET data = ? WHERE month = '2025-01'", (FOREIGN_PICKLE,))
+    df = store.get(("GetData", "A"), start, end, series.fetch)
+
+    assert len(series.fetches) == 2
+    assert series.fetches[1][0] == pd.Timestamp("2025-01-01")
+    assert series.fetches[1][1] <= pd.Timestamp("2025-02-01")
+    assert df["Time"].min() == start and df["Time"].is_unique
+    with store._connect() as db:
+        data = db.execute("SELECT data FROM partitions WHERE month = '2025-01'").fetchone()[0]
+    assert len(pickle.loads(data)) == 31
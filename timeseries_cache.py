@@ -0,0 +1,228 @@
+# timeseries_cache.py
+#
+# In-memory, range-aware cache for Hilltop time series.
+#
+# Each cache entry (one site/measurement/method/interval) remembers which time
+# ranges it already holds. A new request only fetches the gaps, e.g. moving the
+# dataset date picker from 1-10 July to 1-12 July fetches 10-12 July only.
+# Ranges that reached "now" when they were fetched (within TIMESERIES_CACHE_LIVE_LAG,
+# as callers compute "now" before asking) are only trusted for
+# TIMESERIES_CACHE_NOW_TTL seconds, so recent data keeps refreshing. The last
+# TIMESERIES_CACHE_LIVE_LAG seconds of such a range are never stored as complete,
+# so readings that are logged late are picked up by the next refresh.
+
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from metrics import cache_lookup
+from constants import TIMESERIES_CACHE_MAX_BYTES, TIMESERIES_CACHE_NOW_TTL, TIMESERIES_CACHE_LIVE_LAG
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+
+def to_timestamp(value):
+    """Normalises the mix of str/datetime/date values used for from/to dates to a naive pd.Timestamp."""
+    if value is None or value == "":
+        return None
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts
+
+
+def format_hilltop_time(ts):
+    """pd.Timestamp -> the ISO form Hilltop accepts for from/to (None stays None)."""
+    return ts.strftime("%Y-%m-%dT%H:%M:%S") if ts is not None else None
+
+
+def interval_to_timedelta(interval):
+    """'1 hour' / '1 day' / '15 minutes' -> pd.Timedelta, or None for raw data ('' or None)."""
+    if not interval:
+        return None
+    try:
+        return pd.Timedelta(interval)
+    except ValueError:
+        return None
+
+
+def merge_ranges(ranges):
+    """Sorts and merges overlapping/touching (start, end) ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(start, end, covered):
+    """Returns the parts of [start, end] not inside any of the (merged) `covered` ranges."""
+    gaps = []
+    cursor = start
+    for c_start, c_end in covered:
+        if c_end < cursor:
+            continue
+        if c_start > end:
+            break
+        if c_start > cursor:
+            gaps.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class _Entry:
+    def __init__(self):
+        self.frame = None        # Cached rows for this key, sorted by time
+        self.ranges = []         # Merged (start, end) time ranges known to be complete
+        self.live_edge = None    # End of the range that was fetched up to "now"
+        self.live_fetched_at = 0 # time.time() when that live edge was fetched
+        self.nbytes = 0
+
+
+class RangeCache:
+    """
+    Caches time series frames by key and fetches only the missing time ranges.
+
+    `fetch(start, end)` must return a DataFrame with a `time_col` column (an
+    empty frame is fine). Rows are de-duplicated on time (plus SiteName /
+    MeasurementName when present); newer fetches win.
+    """
+
+    def __init__(self, max_bytes=TIMESERIES_CACHE_MAX_BYTES, now_ttl=TIMESERIES_CACHE_NOW_TTL,
+                 live_lag=TIMESERIES_CACHE_LIVE_LAG, time_col="Time"):
+        self.max_bytes = max_bytes
+        self.now_ttl = now_ttl
+        self.live_lag = pd.Timedelta(seconds=live_lag)
+        self.time_col = time_col
+        self._entries = OrderedDict() # LRU order, oldest first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, start, end, fetch, interval=None):
+        log_prefix = "[TS-CACHE-GET]"
+        now = pd.Timestamp.now()
+        start = to_timestamp(start)
+        end = to_timestamp(end) or now
+        if start is None or start > end:
+            return fetch(start, end)
+
+        step = interval_to_timedelta(interval)
+        gaps = self._gaps(key, start, end)
+        cache_lookup("memory", "hit" if not gaps else "miss" if gaps == [(start, end)] else "partial")
+        if verbose:
+            print(f"{log_prefix} {key}: {start} -> {end}, fetching {len(gaps)} gap(s): {gaps}")
+
+        fetched = []
+        for gap_start, gap_end in gaps:
+            if step is not None:
+                gap_start = gap_start.floor(step) # Whole aggregation buckets only
+            fetched_at = pd.Timestamp.now()
+            frame = fetch(gap_start, gap_end)
+            # Asked for data up to (or beyond) the present; callers take their "now" a little earlier
+            is_live = gap_end >= now - self.live_lag
+            if is_live:
+                # Only complete up to the logging lag before the fetch; the rest may still arrive
+                gap_end = max(gap_start, min(gap_end, fetched_at) - self.live_lag)
+            fetched.append((gap_start, gap_end, is_live, frame))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            self._entries.move_to_end(key)
+            if fetched:
+                self._store(entry, fetched)
+                self._evict(keep=key)
+            frame = entry.frame
+
+        return self._slice(frame, start, end)
+
+    def missing(self, key, start, end):
+        """The (start, end) ranges get() would have to fetch for this key right now."""
+        start = to_timestamp(start)
+        end = to_timestamp(end) or pd.Timestamp.now()
+        if start is None or start > end:
+            return [(start, end)]
+        return self._gaps(key, start, end)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    # --- Internals ---
+
+    def _gaps(self, key, start, end):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return [(start, end)]
+            covered = list(entry.ranges)
+            if entry.live_edge is not None and time.time() - entry.live_fetched_at < self.now_ttl:
+                # Recently fetched up to "now": treat the open edge as still current
+                covered = [(s, pd.Timestamp.max if e == entry.live_edge else e) for s, e in covered]
+        return subtract_ranges(start, end, covered)
+
+    def _store(self, entry, fetched):
+        frames = [entry.frame] if entry.frame is not None else []
+        ranges = list(entry.ranges)
+        for gap_start, gap_end, is_live, frame in fetched:
+            if frame is not None and not frame.empty:
+                frames.append(frame)
+            if is_live:
+                # Only data up to the moment of the fetch is known; the rest may still arrive
+                entry.live_edge = gap_end
+                entry.live_fetched_at = time.time()
+            ranges.append((gap_start, gap_end))
+        entry.ranges = merge_ranges(ranges)
+
+        frames = [f for f in frames if self.time_col in f.columns]
+        if frames:
+            merged = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+            subset = [c for c in ("SiteName", "MeasurementName") if c in merged.columns] + [self.time_col]
+            merged = (merged.drop_duplicates(subset=subset, keep="last")
+                            .sort_values(self.time_col, kind="stable")
+                            .reset_index(drop=True))
+        else:
+            merged = fetched[-1][3] # Nothing with a time column, keep the (empty) shape we got
+        self._total_bytes -= entry.nbytes
+        entry.frame = merged
+        entry.nbytes = int(merged.memory_usage(deep=True).sum()) if merged is not None else 0
+        self._total_bytes += entry.nbytes
+
+    def _evict(self, keep):
+        log_prefix = "[TS-CACHE-EVICT]"
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, entry = next(iter(self._entries.items()))
+            if key == keep:
+                self._entries.move_to_end(key)
+                continue
+            del self._entries[key]
+            self._total_bytes -= entry.nbytes
+            if verbose:
+                print(f"{log_prefix} Evicted {key} ({entry.nbytes} bytes)")
+
+    def _slice(self, frame, start, end):
+        if frame is None:
+            return pd.DataFrame()
+        if self.time_col not in frame.columns:
+            return frame.copy()
+        times = frame[self.time_col]
+        return frame[(times >= start) & (times <= end)].reset_index(drop=True)
+
+
+# Shared cache used by hilltop_api
+TIMESERIES_CACHE = RangeCache()
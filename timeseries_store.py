@@ -0,0 +1,268 @@
+# timeseries_store.py
+#
+# On-disk, second-level store for Hilltop time series, shared by every worker
+# process and kept across restarts.
+#
+# Data lives in one SQLite file under CACHE_DIR, partitioned by request key and
+# calendar month (each partition is a pickled DataFrame), together with the time
+# ranges known to be complete for each key. Only "settled" history, older than
+# TIMESERIES_STORE_SETTLE, is written; anything newer is always fetched live, so
+# late-arriving or edited recent data is never frozen on disk.
+#
+# TIMESERIES_CACHE (in memory) sits in front of this; Hilltop sits behind it.
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+
+import pandas as pd
+
+from timeseries_cache import to_timestamp, merge_ranges, subtract_ranges
+from metrics import cache_lookup
+from constants import TIMESERIES_STORE_PATH, TIMESERIES_STORE_ENABLED, TIMESERIES_STORE_SETTLE
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+# Bump this whenever the table layout or partition format changes
+STORE_VERSION = 1
+
+# What unpickling a partition written by another pandas/numpy version can raise
+_UNPICKLE_ERRORS = (pickle.UnpicklingError, EOFError, AttributeError, ImportError)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS coverage (key TEXT PRIMARY KEY, ranges TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS partitions (
+    key TEXT NOT NULL,
+    month TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (key, month)
+);
+"""
+
+
+def _month_starts(start, end):
+    """First-of-month timestamps for every month touching [start, end]."""
+    return list(pd.date_range(start.to_period("M").to_timestamp(), end, freq="MS"))
+
+
+def _without_months(ranges, months):
+    """`ranges` minus the calendar months ("YYYY-MM") in `months`."""
+    for month in months:
+        month_start = pd.Timestamp(month)
+        month_end = month_start + pd.offsets.MonthBegin(1)
+        ranges = [piece for s, e in ranges
+                  for piece in ((s, min(e, month_start)), (max(s, month_end), e)) if piece[0] < piece[1]]
+    return ranges
+
+
+def _dedupe(frames, time_col):
+    frames = [f for f in frames if f is not None and not f.empty and time_col in f.columns]
+    if not frames:
+        return None
+    merged = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    subset = [c for c in ("SiteName", "MeasurementName") if c in merged.columns] + [time_col]
+    return (merged.drop_duplicates(subset=subset, keep="last")
+                  .sort_values(time_col, kind="stable")
+                  .reset_index(drop=True))
+
+
+class TimeseriesStore:
+    """
+    SQLite-backed store of settled time series history.
+
+    read_through(key, fetch) wraps a `fetch(start, end)` function (the same kind
+    RangeCache uses) so settled ranges are served from disk and anything fetched
+    for them is written back. Disk errors are reported and fall back to `fetch`.
+    """
+
+    def __init__(self, path=TIMESERIES_STORE_PATH, settle=TIMESERIES_STORE_SETTLE, time_col="Time"):
+        self.path = path
+        self.settle = settle
+        self.time_col = time_col
+        self._local = threading.local()
+        # SQLite connections can't be shared with a forked child: it opens its own
+        os.register_at_fork(after_in_child=self._forget_connections)
+
+    def read_through(self, key, fetch):
+        def fetch_via_store(start, end):
+            return self.get(key, start, end, fetch)
+        return fetch_via_store
+
+    def get(self, key, start, end, fetch):
+        start = to_timestamp(start)
+        end = to_timestamp(end) or pd.Timestamp.now()
+        # Settled history ends at a midnight so stored ranges always hold whole days
+        # (and whole hourly/daily aggregation buckets)
+        cutoff = (pd.Timestamp.now() - self.settle).floor("D")
+        if start is None or start >= cutoff:
+            return fetch(start, end)
+
+        closed_start = start.floor("D")
+        closed_end = min(end.ceil("D"), cutoff)
+        frames = self._get_closed(self._key(key), closed_start, closed_end, fetch)
+        if frames is None:
+            return fetch(start, end)
+
+        if end > cutoff:
+            frames.append(fetch(cutoff, end)) # Recent, unsettled data is never stored
+        merged = _dedupe(frames, self.time_col)
+        if merged is None:
+            return next((f for f in frames if f is not None), pd.DataFrame())
+        times = merged[self.time_col]
+        return merged[(times >= start) & (times <= end)].reset_index(drop=True)
+
+    def missing(self, key, start, end):
+        """The ranges get() would fetch for [start, end] right now (all of it if the store can't be read)."""
+        start = to_timestamp(start)
+        end = to_timestamp(end) or pd.Timestamp.now()
+        cutoff = (pd.Timestamp.now() - self.settle).floor("D")
+        if start is None or start >= cutoff:
+            return [(start, end)]
+        closed_start, closed_end = start.floor("D"), min(end.ceil("D"), cutoff)
+        try:
+            gaps = subtract_ranges(closed_start, closed_end, self._coverage(self._connect(), self._key(key)))
+        except (sqlite3.Error, OSError):
+            return [(start, end)]
+        return gaps + [(cutoff, end)] if end > cutoff else gaps
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM coverage")
+            db.execute("DELETE FROM partitions")
+
+    # --- Internals ---
+
+    def _forget_connections(self):
+        self._local = threading.local()
+
+    def _key(self, key):
+        return json.dumps([str(k) if k is not None else None for k in key])
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL") # Readers in other workers don't block on writers
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            row = db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or int(row[0]) != STORE_VERSION:
+                with db:
+                    db.execute("DELETE FROM coverage")
+                    db.execute("DELETE FROM partitions")
+                    db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(STORE_VERSION),))
+            self._local.db = db
+        return db
+
+    def _coverage(self, db, skey):
+        row = db.execute("SELECT ranges FROM coverage WHERE key = ?", (skey,)).fetchone()
+        if row is None:
+            return []
+        return [(pd.Timestamp(s), pd.Timestamp(e)) for s, e in json.loads(row[0])]
+
+    def _read(self, db, skey, start, end):
+        """(rows in [start, end] or None, months whose partitions couldn't be unpickled)."""
+        log_prefix = "[TS-STORE]"
+        months = [m.strftime("%Y-%m") for m in _month_starts(start, end)]
+        placeholders = ",".join("?" * len(months))
+        rows = db.execute(f"SELECT month, data FROM partitions WHERE key = ? AND month IN ({placeholders})",
+                          [skey] + months).fetchall()
+        frames, unreadable = [], []
+        for month, data in rows:
+            try:
+                frames.append(pickle.loads(data))
+            except _UNPICKLE_ERRORS as e:
+                print(f"{log_prefix} Ignoring unreadable partition {skey} {month}: {e!r}")
+                unreadable.append(month)
+        merged = _dedupe(frames, self.time_col)
+        if merged is None:
+            return None, unreadable
+        times = merged[self.time_col]
+        return merged[(times >= start) & (times <= end)], unreadable
+
+    def _forget_months(self, db, skey, months):
+        """Drops unreadable month partitions and their coverage, so they are fetched again."""
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            covered = _without_months(self._coverage(db, skey), months)
+            db.executemany("DELETE FROM partitions WHERE key = ? AND month = ?", [(skey, m) for m in months])
+            db.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?)",
+                       (skey, json.dumps([(s.isoformat(), e.isoformat()) for s, e in covered])))
+        return covered
+
+    def _get_closed(self, skey, start, end, fetch):
+        """Frames covering [start, end], read from disk where possible; None if the store can't be used."""
+        log_prefix = "[TS-STORE]"
+        try:
+            db = self._connect()
+            covered = self._coverage(db, skey)
+            frames = []
+            if subtract_ranges(start, end, covered) != [(start, end)]:
+                frame, unreadable = self._read(db, skey, start, end)
+                frames.append(frame)
+                if unreadable:
+                    covered = self._forget_months(db, skey, unreadable)
+            gaps = subtract_ranges(start, end, covered)
+        except (sqlite3.Error, OSError) as e:
+            print(f"{log_prefix} Store unavailable, fetching from Hilltop instead: {e}")
+            return None
+        cache_lookup("disk", "hit" if not gaps else "miss" if gaps == [(start, end)] else "partial")
+        if verbose:
+            print(f"{log_prefix} {skey}: {start} -> {end}, {len(gaps)} gap(s) to fetch: {gaps}")
+
+        for gap_start, gap_end in gaps:
+            frame = fetch(gap_start, gap_end)
+            frames.append(frame)
+            try:
+                self._write(db, skey, gap_start, gap_end, frame)
+            except (sqlite3.Error, pickle.PicklingError, OSError) as e:
+                print(f"{log_prefix} Could not write {skey} {gap_start} -> {gap_end} to the store: {e}")
+        return frames
+
+    def _write(self, db, skey, start, end, frame):
+        """Merges `frame` into the month partitions and marks [start, end] as complete."""
+        has_rows = frame is not None and not frame.empty and self.time_col in frame.columns
+        unreadable = []
+        with db: # One transaction, so another worker never sees coverage without its data
+            db.execute("BEGIN IMMEDIATE")
+            if has_rows:
+                months = pd.to_datetime(frame[self.time_col]).dt.to_period("M")
+                for month, part in frame.groupby(months, observed=True, sort=False):
+                    label = month.strftime("%Y-%m")
+                    row = db.execute("SELECT data FROM partitions WHERE key = ? AND month = ?",
+                                     (skey, label)).fetchone()
+                    try:
+                        existing = pickle.loads(row[0]) if row else None
+                    except _UNPICKLE_ERRORS:
+                        # Written by another pandas/numpy version: replaced by this fetch alone
+                        existing = None
+                        unreadable.append(label)
+                    merged = _dedupe([existing, part.reset_index(drop=True)], self.time_col)
+                    db.execute("INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?)",
+                               (skey, label, len(merged), pickle.dumps(merged, protocol=pickle.HIGHEST_PROTOCOL)))
+            ranges = merge_ranges(_without_months(self._coverage(db, skey), unreadable) + [(start, end)])
+            db.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?)",
+                       (skey, json.dumps([(s.isoformat(), e.isoformat()) for s, e in ranges])))
+
+
+class _NoStore:
+    """Stand-in used when TIMESERIES_STORE_ENABLED is off."""
+
+    def read_through(self, key, fetch):
+        return fetch
+
+    def missing(self, key, start, end):
+        return [(start, end)]
+
+    def clear(self):
+        pass
+
+
+# Shared store used by hilltop_api
+TIMESERIES_STORE = TimeseriesStore() if TIMESERIES_STORE_ENABLED else _NoStore()
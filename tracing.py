@@ -0,0 +1,329 @@
+# tracing.py
+#
+# Lightweight span tracing of a request through callbacks, data_processing and
+# hilltop_api.
+#
+# Each /_dash-update-component request starts a trace (register_tracing() adds the Flask
+# hooks). Code along the way opens spans with `with span("name"):` or the
+# @traced decorator; the current span lives in a contextvar, so nested calls
+# become child spans, and fetch_engine copies the context into its worker
+# threads so parallel Hilltop calls land under the span that started them.
+# Outside a trace, span() does nothing, so background work (pollers etc.)
+# costs nothing.
+#
+# A trace is exported when its root span ends:
+#
+#   in memory   the last TRACE_KEEP traces of this worker, shown as a waterfall
+#               on /admin/traces (needs ADMIN_TOKEN, like /admin/callbacks)
+#   OTLP file   when TRACE_OTLP_FILE is set, one OTLP/JSON ExportTraceServiceRequest
+#               per line, for loading into Jaeger/Tempo/an OpenTelemetry collector
+
+import contextvars
+import functools
+import html
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import Response, abort, request
+
+from constants import TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_KEEP, TRACE_OTLP_FILE
+
+# Chose whether to see all the print statements
+verbose=False # Default is False
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace, parent, attributes=None, start_ns=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.thread = threading.current_thread().name
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        """Seconds, or None while the span is open."""
+        return (self.end_ns - self.start_ns) / 1e9 if self.end_ns else None
+
+
+class _Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.last_child_end_ns = None   # When the root's latest direct child ended
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+
+def current_span():
+    return _current.get()
+
+
+def start_trace(name, **attributes):
+    """Starts a root span (sampled by TRACE_SAMPLE_RATE); returns (span, token) or None."""
+    if not TRACING_ENABLED or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    root = Span(name, _Trace(), None, attributes)
+    return root, _current.set(root)
+
+
+def end_trace(started, status="ok"):
+    if started is None:
+        return
+    root, token = started
+    root.status = status
+    root.end_ns = time.time_ns()
+    _current.reset(token)
+    root.trace.add(root)
+    for exporter in EXPORTERS:
+        try:
+            exporter.export(root.trace)
+        except Exception as e:
+            print(f"[TRACING] Exporter {type(exporter).__name__} failed: {e}")
+
+
+@contextmanager
+def span(name, root=False, expected=(), **attributes):
+    """
+    Times the block as a child of the current span. Outside a trace it does
+    nothing (yields None) unless `root` is set, in which case it starts one.
+    Exceptions other than the `expected` types mark the span as an error.
+    """
+    parent = _current.get()
+    if parent is None:
+        if not root:
+            yield None
+            return
+        started = start_trace(name, **attributes)
+        if started is None:
+            yield None
+            return
+        status = "ok"
+        try:
+            yield started[0]
+        except expected:
+            raise
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            end_trace(started, status)
+        return
+
+    child = Span(name, parent.trace, parent, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except expected:
+        raise
+    except BaseException:
+        child.status = "error"
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current.reset(token)
+        child.trace.add(child)
+        if child.parent_id is not None and parent.parent_id is None:
+            child.trace.last_child_end_ns = child.end_ns
+
+
+def record_span(name, seconds, **attributes):
+    """Adds an already finished span of `seconds`, ending now, under the current span."""
+    parent = _current.get()
+    if parent is None:
+        return
+    end_ns = time.time_ns()
+    finished = Span(name, parent.trace, parent, attributes, start_ns=end_ns - int(seconds * 1e9))
+    finished.end_ns = end_ns
+    parent.trace.add(finished)
+
+
+def traced(name=None):
+    """Decorator: runs the function inside span(name or the function's name)."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Exporters ---
+
+class InMemoryExporter:
+    """Keeps the last `keep` finished traces of this process."""
+
+    def __init__(self, keep=TRACE_KEEP):
+        self._traces = deque(maxlen=keep)
+
+    def export(self, trace):
+        self._traces.append(trace)
+
+    def traces(self):
+        return list(self._traces)
+
+    def get(self, trace_id):
+        return next((t for t in self._traces if t.trace_id == trace_id), None)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpFileExporter:
+    """Appends each trace to `path` as one OTLP/JSON ExportTraceServiceRequest per line."""
+
+    def __init__(self, path, service_name="env_dash"):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        spans = [{
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+            "name": s.name,
+            "kind": 2 if s.parent_id is None else 1, # SERVER for the request, INTERNAL below it
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in
+                           dict(s.attributes, **{"thread.name": s.thread}).items()],
+            "status": {"code": 2 if s.status == "error" else 1},
+        } for s in trace.spans]
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": self.service_name}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "env_dash.tracing"}, "spans": spans}],
+        }]}
+        line = json.dumps(payload, separators=(",", ":"))
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+MEMORY_EXPORTER = InMemoryExporter()
+EXPORTERS = [MEMORY_EXPORTER] + ([OtlpFileExporter(TRACE_OTLP_FILE)] if TRACE_OTLP_FILE else [])
+
+
+# --- Flask integration ---
+
+def register_tracing(server):
+    """Traces every Dash callback request and adds the /admin/traces pages."""
+    from flask import g
+    from callback_profiler import authorised
+    from constants import ADMIN_TOKEN
+
+    @server.before_request
+    def start_request_trace():
+        if request.path.endswith("/_dash-update-component"):
+            g.trace = start_trace(f"{request.method} {request.path}")
+
+    @server.after_request
+    def end_request_trace(response):
+        started = g.pop("trace", None)
+        if started is None:
+            return response
+        root = started[0]
+        # Dash serialises the callback's return value after the callback span has ended
+        if root.trace.last_child_end_ns is not None:
+            serialise = Span("serialize response", root.trace, root, start_ns=root.trace.last_child_end_ns)
+            serialise.end_ns = time.time_ns()
+            if not response.direct_passthrough:
+                serialise.set("response.bytes", response.calculate_content_length() or 0)
+            root.trace.add(serialise)
+        root.set("http.status_code", response.status_code)
+        end_trace(started, "error" if response.status_code >= 500 else "ok")
+        return response
+
+    @server.route("/admin/traces")
+    def admin_traces():
+        if not ADMIN_TOKEN or not authorised():
+            abort(404)
+        return Response(_traces_page(), mimetype="text/html")
+
+    @server.route("/admin/traces/<trace_id>")
+    def admin_trace(trace_id):
+        if not ADMIN_TOKEN or not authorised():
+            abort(404)
+        trace = MEMORY_EXPORTER.get(trace_id)
+        if trace is None:
+            abort(404)
+        return Response(_waterfall_page(trace), mimetype="text/html")
+
+
+def _callback_name(trace):
+    return next((s.name for s in trace.spans if s.name.startswith("callback ")), "")
+
+
+def _traces_page():
+    token = html.escape(request.args.get("token", ""), quote=True)
+    rows = []
+    for trace in sorted(MEMORY_EXPORTER.traces(), key=lambda t: -t.spans[-1].start_ns):
+        root = trace.spans[-1]
+        rows.append(f'<tr><td><a href="/admin/traces/{trace.trace_id}?token={token}">{time.strftime("%H:%M:%S", time.localtime(root.start_ns / 1e9))}</a></td>'
+                    f"<td>{html.escape(_callback_name(trace))}</td><td>{root.duration * 1000:.0f} ms</td>"
+                    f"<td>{len(trace.spans)}</td><td>{root.status}</td></tr>")
+    return f"""<!doctype html>
+<html><head><title>Traces</title><style>body{{font-family:sans-serif}} td,th{{padding:2px 10px}}</style></head><body>
+<h3>Recent traces (this worker, newest first)</h3>
+<table><tr><th>Started</th><th>Callback</th><th>Duration</th><th>Spans</th><th>Status</th></tr>{"".join(rows)}</table>
+</body></html>"""
+
+
+def _waterfall_page(trace):
+    spans = sorted(trace.spans, key=lambda s: s.start_ns)
+    by_id = {s.span_id: s for s in spans}
+    root = next(s for s in spans if s.parent_id is None)
+    total = max(root.end_ns - root.start_ns, 1)
+
+    def depth(s):
+        d = 0
+        while s.parent_id in by_id:
+            s, d = by_id[s.parent_id], d + 1
+        return d
+
+    rows = []
+    for s in spans:
+        left = 100 * (s.start_ns - root.start_ns) / total
+        width = max(100 * (s.end_ns - s.start_ns) / total, 0.2)
+        attrs = ", ".join(f"{k}={v}" for k, v in s.attributes.items())
+        colour = "#d9534f" if s.status == "error" else "#5b9bd5"
+        rows.append(f'<tr><td style="padding-left:{depth(s) * 16}px">{html.escape(s.name)}</td>'
+                    f"<td>{s.duration * 1000:.1f} ms</td>"
+                    f'<td style="width:50%"><div style="margin-left:{left:.2f}%;width:{width:.2f}%;background:{colour};height:12px"></div></td>'
+                    f"<td><small>{html.escape(s.thread)} {html.escape(attrs)}</small></td></tr>")
+    return f"""<!doctype html>
+<html><head><title>Trace {trace.trace_id}</title><style>body{{font-family:sans-serif}} td{{padding:1px 8px;white-space:nowrap}}</style></head><body>
+<h3>{html.escape(root.name)} &middot; {html.escape(_callback_name(trace))} &middot; {root.duration * 1000:.0f} ms</h3>
+<table>{"".join(rows)}</table>
+</body></html>"""
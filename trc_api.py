@@ -1,9 +1,15 @@
-from hilltoppy import Hilltop
+from site_registry import SITE_REGISTRY
+from constants import TRC_HILLTOP_BASE_URL, TRC_HILLTOP_HTS_FILE
 
 # TRC hydrology endpoint
-BASE_URL = "https://extranet.trc.govt.nz/getdata/"
-hts = "boo.hts"
-server = Hilltop(BASE_URL,hts)
+BASE_URL = TRC_HILLTOP_BASE_URL
+hts = TRC_HILLTOP_HTS_FILE
+
+def __getattr__(name):
+    # `server` is the shared Hilltop client, created on first use rather than at import
+    if name == "server":
+        return SITE_REGISTRY.client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def list_sites_with_coords(measurement='Flow [Water Level]'):
     """
@@ -11,8 +17,8 @@ def list_sites_with_coords(measurement='Flow [Water Level]'):
     Returns:
         DataFrame with SiteName, Latitude, Longitude
     """
-    # df = server.get_site_list(location="LatLong", measurement=measurement)
-    df = server.get_site_list(location="LatLong", collection="WebRivers")
+    # df = SITE_REGISTRY.client().get_site_list(location="LatLong", measurement=measurement)
+    df = SITE_REGISTRY.client().get_site_list(location="LatLong", collection="WebRivers")
     
     return df.dropna(subset=["Latitude", "Longitude"])
 
@@ -26,7 +32,7 @@ def list_measurements_for_site(site_name):
     Returns:
         DataFrame of measurement names
     """
-    return server.get_measurement_list(sites=site_name)
+    return SITE_REGISTRY.client().get_measurement_list(sites=site_name)
 
 def get_site_data(site_name, measurement, start, end):
     """
@@ -41,7 +47,7 @@ def get_site_data(site_name, measurement, start, end):
     Returns:
         DataFrame indexed by datetime with a 'Value' column
     """
-    return server.get_data(
+    return SITE_REGISTRY.client().get_data(
         sites=site_name,
         measurements=measurement,
         from_date=start,